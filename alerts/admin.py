@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import NotificationRoute, WantedItem, EbayItem
+from .models import NotificationRoute, WantedItem, EbayItem, ScanJob, ScanWorker
 
 
 # Register your models here.
@@ -8,6 +8,9 @@ class WantedItemAdmin(admin.ModelAdmin):
     search_fields = ('name', 'keywords', 'id', 'customer', 'custcode')
     list_filter = ['deleted']
     ordering = ('-id', 'name')
+    # Set by the scanner's adaptive polling and leasing.
+    readonly_fields = ('arrival_rate', 'poll_interval', 'last_polled_at', 'next_poll_at', 'lease_owner',
+                       'lease_expires')
     pass
 
 
@@ -34,3 +37,24 @@ class NotificationRouteAdmin(admin.ModelAdmin):
 
 
 admin.site.register(NotificationRoute, NotificationRouteAdmin)
+
+
+class ScanJobAdmin(admin.ModelAdmin):
+    list_display = ScanJob.DISPLAY_FIELDS
+    list_filter = ['status']
+    ordering = ('-id',)
+    readonly_fields = ('searches', 'searches_done', 'items_found', 'skipped_wanted_item_ids', 'error', 'started_at',
+                       'finished_at')
+    pass
+
+
+admin.site.register(ScanJob, ScanJobAdmin)
+
+
+class ScanWorkerAdmin(admin.ModelAdmin):
+    list_display = ScanWorker.DISPLAY_FIELDS
+    ordering = ('name',)
+    pass
+
+
+admin.site.register(ScanWorker, ScanWorkerAdmin)
@@ -6,4 +6,4 @@ class AlertsConfig(AppConfig):
 
     def ready(self):
         # importing model classes
-        pass
+        from . import signals  # noqa: F401 connects the route cache invalidation
@@ -0,0 +1,110 @@
+import datetime
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .models import EbayItem
+
+db_logger = logging.getLogger('db')
+
+
+class SeenItemCache:
+    """ Bounded in-process set of eBay item ids we have already found.
+
+    Each id is kept until its listing ends, after which it can't be returned by a search again. When the cache is full
+    the listings ending soonest are evicted first. If a path is given the cache is also saved to and loaded from a
+    local json file so it survives restarts.
+    """
+
+    def __init__(self, max_size=100000, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.warmed = False
+        self._items = {}  # item id -> end time as a unix timestamp
+        self._expiry = []  # heap of (end time, item id), may hold stale entries for re-added ids
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item_id):
+        return bool(self.seen([item_id]))
+
+    def seen(self, item_ids):
+        """ Return the subset of item_ids that are in the cache and haven't ended yet. """
+        now = time.time()
+        with self._lock:
+            return {int(item_id) for item_id in item_ids if self._items.get(int(item_id), 0) > now}
+
+    def add(self, item_id, end_time):
+        self.add_many([(item_id, end_time)])
+
+    def add_many(self, items):
+        """ Add (item id, end datetime) pairs to the cache. """
+        now = time.time()
+        with self._lock:
+            for item_id, end_time in items:
+                end = end_time.timestamp() if isinstance(end_time, datetime.datetime) else float(end_time)
+                if end <= now:
+                    continue
+                self._items[int(item_id)] = end
+                heapq.heappush(self._expiry, (end, int(item_id)))
+            self._evict(now)
+
+    def clear(self):
+        """ Forget every item, the cache is warmed again before it is next used. """
+        with self._lock:
+            self._items = {}
+            self._expiry = []
+            self.warmed = False
+
+    def evict_expired(self):
+        with self._lock:
+            self._evict(time.time())
+
+    def _evict(self, now):
+        # Drop ended listings, then the soonest ending ones while we are over size.
+        while self._expiry and (self._expiry[0][0] <= now or len(self._items) > self.max_size):
+            end, item_id = heapq.heappop(self._expiry)
+            if self._items.get(item_id) == end:
+                del self._items[item_id]
+        # Rebuild the heap if re-added ids have left it full of stale entries.
+        if len(self._expiry) > 2 * self.max_size:
+            self._expiry = [(end, item_id) for item_id, end in self._items.items()]
+            heapq.heapify(self._expiry)
+
+    def warm(self):
+        """ Fill the cache with every saved listing that hasn't ended yet. """
+        try:
+            if self.path and os.path.exists(self.path):
+                with open(self.path) as f:
+                    self.add_many(json.load(f).items())
+
+            now = datetime.datetime.now(datetime.timezone.utc)
+            live_items = (EbayItem.objects.filter(end_time__gt=now)
+                          .order_by('-end_time')
+                          .values_list('item_id', 'end_time')[:self.max_size])
+            self.add_many(live_items)
+            db_logger.info("Warmed seen item cache with {} items".format(len(self)))
+        except Exception as e:
+            db_logger.exception(e)
+        self.warmed = True
+
+    def save(self):
+        """ Write the cache to its local file, if it has one. """
+        if not self.path:
+            return
+        with self._lock:
+            items = dict(self._items)
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(items, f)
+        os.replace(tmp_path, self.path)
+
+
+seen_item_cache = SeenItemCache(max_size=settings.SEEN_CACHE_SIZE, path=settings.SEEN_CACHE_FILE)
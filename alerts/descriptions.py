@@ -0,0 +1,114 @@
+import collections
+import hashlib
+import re
+import threading
+from html.parser import HTMLParser
+
+import html2text
+from django.conf import settings
+
+# Tags whose content isn't description text.
+SKIP_TAGS = {'head', 'script', 'style', 'noscript', 'template'}
+# Tags that break the text onto a new line.
+BLOCK_TAGS = {'address', 'article', 'br', 'blockquote', 'dd', 'div', 'dl', 'dt', 'footer', 'h1', 'h2', 'h3', 'h4',
+              'h5', 'h6', 'header', 'hr', 'li', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul'}
+
+
+class TextExtractor(HTMLParser):
+    """ Collects the text of an HTML document as it is fed, without html2text's markdown formatting. """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skipping += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+    def text(self):
+        text = re.sub(r'[ \t\r\f\v]+', ' ', ''.join(self.parts))
+        return re.sub(r' ?\n[ \n]*', '\n', text).strip()
+
+
+def extract_text(html, matcher=None, chunk_size=8192):
+    """ Stream the text out of html a chunk at a time, returns (text, complete).
+
+    With a matcher, extraction stops at the first chunk whose text contains an anti keyword and the text so far is
+    returned with complete False, the rest of a long seller template is never parsed.
+    """
+    parser = TextExtractor()
+    checked = 0
+    tail = ''
+    overlap = max((len(keyword) for keyword in matcher.keywords), default=0) + 1 if matcher is not None else 0
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        if matcher is None:
+            continue
+        # Only search the new text, with enough of the old to catch a keyword split between chunks.
+        window = tail + ''.join(parser.parts[checked:])
+        checked = len(parser.parts)
+        if matcher.search(window) and matcher.search(parser.text()):
+            return parser.text(), False
+        tail = window[-overlap:]
+    parser.close()
+    return parser.text(), True
+
+
+class DescriptionConverter:
+    """ Converts listing descriptions to text, caching conversions by a hash of the HTML.
+
+    DESCRIPTION_TEXT picks html2text (the default) or 'fast', the streaming extractor. Seller templates are often
+    shared by many listings and a listing that is retried comes back with the same description, so both hit the
+    cache. Fast extractions that stopped early on an anti keyword aren't cached, they depend on the keywords.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def convert(self, html, matcher=None):
+        html = html or ''
+        mode = settings.DESCRIPTION_TEXT
+        key = (mode, hashlib.sha1(html.encode('utf-8')).digest())
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+
+        if mode == 'fast':
+            text, complete = extract_text(html, matcher)
+        else:
+            text, complete = html2text.html2text(html), True
+
+        if complete:
+            with self._lock:
+                self._entries[key] = text
+                while len(self._entries) > (self.max_entries or settings.DESCRIPTION_CACHE_SIZE):
+                    self._entries.popitem(last=False)
+        return text
+
+
+description_converter = DescriptionConverter()
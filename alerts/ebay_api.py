@@ -0,0 +1,112 @@
+import os
+import threading
+
+from django.conf import settings
+from ebaysdk.finding import Connection as Finding
+from ebaysdk.shopping import Connection as Shopping
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from .metrics import metrics
+from .ratelimit import rate_limiter
+from .response_cache import response_cache
+
+CONNECTION_CLASSES = {
+    'Finding': Finding,
+    'Shopping': Shopping,
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_local = threading.local()
+_transport = None
+
+
+class PooledSession(Session):
+    """ requests session shared by every eBay connection of one API type so their HTTP connections are reused.
+
+    ebaysdk closes its session after every response, which would throw the pooled connections away, so close() does
+    nothing here and the pool is only torn down by shutdown().
+    """
+
+    def __init__(self, pool_size):
+        super().__init__()
+        if settings.EBAY_API_RECORD:
+            from .replay import RecordingAdapter
+            adapter = RecordingAdapter(settings.EBAY_API_RECORD, pool_connections=1, pool_maxsize=pool_size,
+                                       max_retries=3)
+        else:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=3)
+        self.mount('http://', _transport or adapter)
+        self.mount('https://', _transport or adapter)
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class CachingSession(PooledSession):
+    """ PooledSession that answers repeated calls from the response cache while their responses are fresh, calls that
+    go to eBay wait for the rate limiter first. """
+
+    def send(self, request, **kwargs):
+        call = response_cache.verb(request)
+        response = response_cache.get(request)
+        if response is None:
+            rate_limiter.acquire(request)
+            with metrics.span('ebay_call', call=call):
+                response = super().send(request, **kwargs)
+            response_cache.set(request, response)
+            metrics.increment('ebay_calls', call=call, status=response.status_code)
+        else:
+            metrics.increment('ebay_calls', call=call, status='cached')
+        return response
+
+
+def set_transport(adapter):
+    """ Send every eBay call through adapter (a requests transport adapter, e.g. replay.ReplayAdapter) instead of
+    HTTP. None goes back to HTTP for sessions created afterwards. """
+    global _transport
+    with _sessions_lock:
+        _transport = adapter
+        if adapter is None:
+            return
+        for session in _sessions.values():
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+
+def get_transport():
+    return _transport
+
+
+def get_session(connection_type):
+    with _sessions_lock:
+        if connection_type not in _sessions:
+            _sessions[connection_type] = CachingSession(settings.EBAY_API_POOL_SIZE)
+        return _sessions[connection_type]
+
+
+def get_connection(connection_type="Finding"):
+    """ Return this thread's ebaysdk connection for the API type.
+
+    Connections keep the state of the request they are executing so each thread gets its own, but they all send
+    through the one pooled session for their API type.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    if connection_type not in connections:
+        api = new_connection(connection_type)
+        api.session = get_session(connection_type)
+        connections[connection_type] = api
+    return connections[connection_type]
+
+
+def new_connection(connection_type="Finding"):
+    return CONNECTION_CLASSES[connection_type](appid=os.getenv("EBAY_API_ID"), siteid='EBAY-GB', config_file=None,
+                                               timeout=settings.EBAY_API_TIMEOUT)
+
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from .ebay_api import new_connection, get_transport
+from .metrics import metrics
+from .ratelimit import rate_limiter
+from .response_cache import response_cache
+from .models import WantedItem
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+db_logger = logging.getLogger('db')
+
+
+class AsyncEbayClient:
+    """ asyncio client for the Finding and Shopping calls the scan makes.
+
+    Requests are built and responses parsed by ebaysdk exactly as in the blocking path, only the HTTP round trip goes
+    over a pooled aiohttp session so many calls can wait on the network at once from a single thread. Every call has
+    its own timeout and can be cancelled. Use it as an async context manager so the session is closed.
+    """
+
+    def __init__(self, pool_size=None, timeout=None, detail_concurrency=None):
+        if aiohttp is None:
+            raise ImproperlyConfigured("aiohttp must be installed to use SCAN_ASYNC")
+        self.pool_size = pool_size or settings.EBAY_API_POOL_SIZE
+        self.timeout = timeout or settings.EBAY_API_TIMEOUT
+        self.detail_concurrency = detail_concurrency or settings.DETAIL_FETCH_WORKERS
+        self.session = None
+        self._detail_semaphore = None
+        self._connections = {}
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        self._detail_semaphore = asyncio.Semaphore(self.detail_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        for api in self._connections.values():
+            api.session.close()
+
+    def connection(self, connection_type):
+        """ The client's ebaysdk connection for the API type, built once rather than for every call. """
+        if connection_type not in self._connections:
+            self._connections[connection_type] = new_connection(connection_type)
+        return self._connections[connection_type]
+
+    async def execute(self, connection_type, verb, data, timeout=None):
+        """ Async equivalent of ebaysdk's Connection.execute, returns the parsed ebaysdk response. """
+        api = self.connection(connection_type)
+
+        # The same steps as Connection.execute, without the blocking send. Every call on the client shares the
+        # connection, so its state is only touched between awaits and is set again for the response.
+        api._reset()
+        api._add_prefix(api._list_nodes, verb)
+        if hasattr(api, 'base_list_nodes'):
+            api._list_nodes += api.base_list_nodes
+        api.build_request(verb, data, None)
+        request, list_nodes = api.request, api._list_nodes
+
+        response = response_cache.get(request)
+        if response is None:
+            await rate_limiter.async_acquire(request)
+            with metrics.span('ebay_call', call=verb):
+                response = await self.send(request, timeout)
+            response_cache.set(request, response)
+            metrics.increment('ebay_calls', call=verb, status=response.status_code)
+        else:
+            metrics.increment('ebay_calls', call=verb, status='cached')
+
+        api._reset()
+        api.verb, api._list_nodes, api.response = verb, list_nodes, response
+        api.process_response()
+        api.error_check()
+        return api.response
+
+    async def send(self, request, timeout=None):
+        """ Send a prepared requests request over aiohttp, returning a requests response for ebaysdk to parse. """
+        transport = get_transport()
+        if transport is not None:
+            return await transport.async_send(request, timeout)
+        async with self.session.request(request.method, request.url, data=request.body,
+                                        headers=dict(request.headers),
+                                        timeout=aiohttp.ClientTimeout(total=timeout or self.timeout)) as reply:
+            response = Response()
+            response._content = await reply.read()
+            response.status_code = reply.status
+            response.reason = reply.reason
+            response.headers = CaseInsensitiveDict(reply.headers)
+            response.url = str(reply.url)
+            response.request = request
+        return response
+
+    async def search_buy_it_now(self, wanted_item: WantedItem):
+        """ Async search_buy_it_now, paging back to the wanted item's last seen listing. """
+        cutoff = wanted_item.search_cutoff()
+        items = []
+        page = 1
+        while True:
+            response = await self.execute('Finding', 'findItemsAdvanced',
+                                          wanted_item.search_request('FixedPrice', page))
+            response = response.dict()
+            page_items = wanted_item.search_results(response)
+            items += page_items
+            if not wanted_item.needs_next_page(response, page, page_items, cutoff) or page >= settings.SEARCH_MAX_PAGES:
+                break
+            page += 1
+        return wanted_item.new_since_last_scan(items)
+
+    async def search_auctions(self, wanted_item: WantedItem):
+        """ Async search_auctions, paging forward to the wanted item's auction horizon. """
+        horizon = wanted_item.auction_horizon()
+        items = []
+        page = 1
+        while True:
+            response = await self.execute('Finding', 'findItemsAdvanced', wanted_item.search_request('Auction', page))
+            response = response.dict()
+            page_items = wanted_item.search_results(response)
+            items += page_items
+            if (not wanted_item.needs_next_auction_page(response, page, page_items, horizon)
+                    or page >= settings.SEARCH_MAX_PAGES):
+                break
+            page += 1
+        return items
+
+    async def get_multiple_items(self, item_ids):
+        async with self._detail_semaphore:
+            response = await self.execute('Shopping', 'GetMultipleItems', WantedItem.multiple_items_request(item_ids))
+        return WantedItem.multiple_items_results(response.dict())
+
+    async def fetch_item_details(self, items):
+        """ Async fetch_item_details, batches run concurrently up to DETAIL_FETCH_WORKERS at a time. """
+        batch_size = min(settings.DETAIL_FETCH_BATCH_SIZE, 20)
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        results = await asyncio.gather(*[self.get_multiple_items([item.item_id for item in batch])
+                                         for batch in batches], return_exceptions=True)
+
+        details = {}
+        for batch, found in zip(batches, results):
+            if isinstance(found, BaseException):
+                db_logger.error("Exception in fetch_item_details: {!r}".format(found))
+                found = {}
+            for item in batch:
+                details[item.item_id] = found.get(str(item.item_id))
+        return details
@@ -0,0 +1,168 @@
+import atexit
+import contextlib
+import datetime
+import logging
+import math
+import os
+import socket
+import threading
+from datetime import timezone
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Q
+
+from .models import WantedItem, ScanWorker
+
+db_logger = logging.getLogger('db')
+
+
+def worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class LeaseManager:
+    """ Shares the wanted items out between scan worker processes by leasing their rows.
+
+    Each worker registers itself as a ScanWorker and claims up to an equal share of the wanted items, the ones with no
+    lease or an expired one, for SCAN_LEASE_DURATION seconds. Claims use SELECT ... FOR UPDATE SKIP LOCKED where the
+    database has it, so workers claiming at once pass over each other's rows instead of waiting. Everywhere the
+    lease is only taken by an update that checks the row is still free, so two workers can't both get it. A worker
+    that dies stops renewing, once its leases expire the other workers claim its wanted items. A worker holding more
+    than its share, because another has started, gives the extra back.
+
+    The rate limiter keeps its buckets in a file on each machine, so workers on two machines would each spend the full
+    daily quota. With RATE_LIMIT on, only the machine whose worker started first claims anything, the workers on any
+    other machine log an error and claim nothing until it's gone.
+    """
+
+    def __init__(self, name=None, duration=None):
+        self._name = name
+        self._duration = duration
+        self._release_registered = False
+
+    @property
+    def name(self):
+        # Worked out when first used, not at import, in case the process forks first.
+        if self._name is None:
+            self._name = worker_name()
+        return self._name
+
+    @property
+    def duration(self):
+        return datetime.timedelta(seconds=self._duration or settings.SCAN_LEASE_DURATION)
+
+    def touch(self, now):
+        """ Mark this worker alive. """
+        # Not update_or_create, its select and update in one transaction would need a lock upgrade on SQLite.
+        if not ScanWorker.objects.filter(name=self.name).update(last_seen=now):
+            ScanWorker.objects.get_or_create(name=self.name, defaults={'host': socket.gethostname(), 'last_seen': now})
+
+    def heartbeat(self, now):
+        """ Mark this worker alive, forget the ones that aren't, and return how many are. """
+        self.touch(now)
+        ScanWorker.objects.filter(last_seen__lte=now - self.duration).delete()
+        return ScanWorker.objects.count()
+
+    def claim(self):
+        """ Renew this worker's leases, claim free wanted items up to its share and return the ones it holds. """
+        now = datetime.datetime.now(timezone.utc)
+        expires = now + self.duration
+        workers = self.heartbeat(now)
+        wanted_items = WantedItem.objects.filter(deleted=False)
+        share = math.ceil(wanted_items.count() / max(workers, 1))
+        if settings.RATE_LIMIT:
+            host = ScanWorker.objects.order_by('started_at', 'pk').values_list('host', flat=True).first()
+            if host == socket.gethostname():
+                share = math.ceil(wanted_items.count() / ScanWorker.objects.filter(host=host).count())
+            else:
+                db_logger.error("{}  :  Scan worker {} claims nothing, workers on {} are already scanning and the rate "
+                                "limit is only shared on one machine".format(datetime.datetime.now(), self.name, host))
+                share = 0
+
+        held = list(wanted_items.filter(lease_owner=self.name, lease_expires__gt=now)
+                    .order_by('pk').values_list('pk', flat=True))
+        if len(held) > share:
+            WantedItem.objects.filter(pk__in=held[share:], lease_owner=self.name).update(lease_owner='',
+                                                                                          lease_expires=None)
+            held = held[:share]
+        WantedItem.objects.filter(pk__in=held, lease_owner=self.name).update(lease_expires=expires)
+
+        if len(held) < share:
+            free = Q(lease_expires__isnull=True) | Q(lease_expires__lte=now)
+            candidates = wanted_items.filter(free).order_by('pk')
+
+            def take():
+                ids = list(candidates.values_list('pk', flat=True)[:share - len(held)])
+                # Another worker may have picked the same rows, only the ones still free are taken.
+                WantedItem.objects.filter(free, pk__in=ids).update(lease_owner=self.name, lease_expires=expires)
+
+            if connection.features.has_select_for_update_skip_locked:
+                with transaction.atomic():
+                    candidates = candidates.select_for_update(skip_locked=True)
+                    take()
+            else:
+                # SQLite can't upgrade a read to a write lock while another process is writing, so the select and
+                # update aren't run in one transaction there, the update alone is atomic.
+                take()
+
+        return list(wanted_items.filter(lease_owner=self.name, lease_expires__gt=now)
+                    .prefetch_related('notifications'))
+
+    def acquire(self, wanted_items):
+        """ Lease those of wanted_items no worker holds, for a one off scan of them, and return them.
+
+        Unlike claim this doesn't register as a worker, so the workers' shares aren't changed for it.
+        """
+        now = datetime.datetime.now(timezone.utc)
+        pks = [wanted_item.pk for wanted_item in wanted_items]
+        free = Q(lease_expires__isnull=True) | Q(lease_expires__lte=now) | Q(lease_owner=self.name)
+        WantedItem.objects.filter(free, pk__in=pks).update(lease_owner=self.name, lease_expires=now + self.duration)
+        held = set(WantedItem.objects.filter(pk__in=pks, lease_owner=self.name, lease_expires__gt=now)
+                   .values_list('pk', flat=True))
+        return [wanted_item for wanted_item in wanted_items if wanted_item.pk in held]
+
+    def renew(self):
+        """ Extend this worker's leases, returns how many it still holds. """
+        now = datetime.datetime.now(timezone.utc)
+        # Only a registered worker is kept alive, acquire doesn't register.
+        ScanWorker.objects.filter(name=self.name).update(last_seen=now)
+        return WantedItem.objects.filter(lease_owner=self.name, lease_expires__gt=now).update(
+            lease_expires=now + self.duration)
+
+    def release(self):
+        """ Give up every lease and deregister, for a worker that is shutting down. """
+        WantedItem.objects.filter(lease_owner=self.name).update(lease_owner='', lease_expires=None)
+        ScanWorker.objects.filter(name=self.name).delete()
+
+    def release_at_exit(self):
+        """ Release when the process exits, for a worker that isn't told it's stopping. """
+        if not self._release_registered:
+            atexit.register(self.release)
+            self._release_registered = True
+
+    @contextlib.contextmanager
+    def keep_alive(self):
+        """ Renew the leases from a background thread every third of the lease duration while the block runs. """
+        stop = threading.Event()
+
+        def renew():
+            try:
+                while not stop.wait(self.duration.total_seconds() / 3):
+                    try:
+                        self.renew()
+                    except Exception as e:
+                        db_logger.exception("{}  :  Exception in renew leases: {}".format(datetime.datetime.now(), e))
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=renew, name='lease-renew', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+
+leases = LeaseManager()
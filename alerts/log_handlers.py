@@ -0,0 +1,180 @@
+import atexit
+import copy
+import datetime
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import timezone
+from logging.handlers import QueueHandler
+
+# Models aren't imported here, this module is loaded by settings.LOGGING before the apps are ready.
+
+_formatter = logging.Formatter()
+
+
+class QueuedDatabaseHandler(QueueHandler):
+    """ Logs to django_db_logger's StatusLog table without writing to the database on the logging thread.
+
+    Records are put on a bounded queue and a listener thread saves them with one bulk insert per batch_size records
+    or per flush_interval seconds, whichever comes first. When the queue is full records are dropped rather than
+    blocking the scan, the number dropped is logged with the next batch.
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, max_queue=10000):
+        super().__init__(queue.Queue(maxsize=max_queue))
+        self.listener = BatchingDatabaseListener(self.queue, batch_size, flush_interval)
+
+    def prepare(self, record):
+        # Everything the listener needs, worked out now while the arguments and exception are still current.
+        record = copy.copy(record)
+        record.trace = _formatter.formatException(record.exc_info) if record.exc_info else None
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        self.listener.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.listener.dropped += 1
+
+    def flush(self):
+        self.listener.flush()
+
+    def close(self):
+        self.listener.stop()
+        super().close()
+
+
+class BatchingDatabaseListener:
+    """ Saves the records queued by QueuedDatabaseHandler in batches, from its own thread. """
+
+    def __init__(self, record_queue, batch_size, flush_interval):
+        self.queue = record_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-log', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        """ Save whatever is still queued and stop the thread. """
+        if self._thread is not None and not self._stopping:
+            self._stopping = True
+            self._thread.join(timeout=10)
+
+    def flush(self, timeout=10):
+        """ Wait until every record queued so far has been saved. """
+        deadline = time.monotonic() + timeout
+        while (self.queue.unfinished_tasks and self._thread is not None and self._thread.is_alive()
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+
+    def _next_batch(self):
+        """ Wait for a record, then take more until the batch is full or the flush interval is up. """
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            # Waits in short steps so stop() doesn't have to sit out a long flush interval.
+            remaining = 0 if self._stopping else deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=min(max(remaining, 0), 0.1)))
+            except queue.Empty:
+                if remaining <= 0.1:
+                    break
+        return batch
+
+    def _run(self):
+        while not (self._stopping and self.queue.empty()):
+            batch = self._next_batch()
+            if batch or self.dropped:
+                self._save(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _save(self, batch):
+        from django.db import connection
+        from django_db_logger.models import StatusLog
+
+        rows = [StatusLog(logger_name=record.name, level=record.levelno, msg=record.msg, trace=record.trace)
+                for record in batch]
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            rows.append(StatusLog(logger_name='db', level=logging.WARNING,
+                                  msg="{}  :  Log queue full, dropped {} records".format(datetime.datetime.now(),
+                                                                                        dropped)))
+        try:
+            StatusLog.objects.bulk_create(rows)
+        except Exception as e:
+            # Logging the failure would queue it again, so it only goes to stderr.
+            print("{}  :  Couldn't save {} log records: {}".format(datetime.datetime.now(), len(rows), e),
+                  file=sys.stderr)
+        finally:
+            connection.close_if_unusable_or_obsolete()
+
+
+class RateLimitFilter(logging.Filter):
+    """ Lets through at most per_minute records a minute whose message contains match, the rest are dropped.
+
+    The first record let through in the next minute says how many were dropped. Records that don't contain match
+    always pass.
+    """
+
+    def __init__(self, match, per_minute=10):
+        super().__init__()
+        self.match = match
+        self.per_minute = per_minute
+        self._window = None
+        self._passed = 0
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not isinstance(record.msg, str) or self.match not in record.msg:
+            return True
+        window = int(time.monotonic() // 60)
+        with self._lock:
+            if window != self._window:
+                self._window, self._passed = window, 0
+            if self._passed >= self.per_minute:
+                self._suppressed += 1
+                return False
+            self._passed += 1
+            suppressed, self._suppressed = self._suppressed, 0
+        if suppressed:
+            record.msg = '{} ({} similar messages suppressed)'.format(record.msg, suppressed)
+        return True
+
+
+def prune_status_logs(days, chunk_size=5000):
+    """ Delete StatusLog rows older than days, a chunk at a time so the table isn't locked for long.
+
+    Returns the number deleted.
+    """
+    from django_db_logger.models import StatusLog
+
+    cutoff = datetime.datetime.now(timezone.utc) - datetime.timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(StatusLog.objects.filter(create_datetime__lt=cutoff).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += StatusLog.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,55 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from alerts.matching import AntiKeywordMatcher
+
+
+def legacy_filter(text, anti_keywords: str):
+    """ The split / lower per keyword check that filter_anti_keywords used before the compiled matcher. """
+    for anti in anti_keywords.split(','):
+        if anti.lower() in text.lower().strip('\n'):
+            return anti
+    return None
+
+
+def random_words(rng, count):
+    return ' '.join(''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(3, 10))) for _ in range(count))
+
+
+class Command(BaseCommand):
+    help = 'Benchmark anti keyword matching on long descriptions, compiled matcher against the old per keyword check.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keywords', type=int, default=50, help='number of anti keywords')
+        parser.add_argument('--size', type=int, default=50000, help='description length in characters')
+        parser.add_argument('--descriptions', type=int, default=200, help='descriptions matched per run')
+        parser.add_argument('--whole-word', action='store_true')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        # Keywords use digits so they never match the random letters, every description is checked in full.
+        anti_keywords = ','.join('junk{}'.format(i) for i in range(options['keywords']))
+        description = random_words(rng, options['size'] // 7)[:options['size']]
+        descriptions = [description] * options['descriptions']
+        megabytes = len(description) * len(descriptions) / 1e6
+
+        started = time.perf_counter()
+        for text in descriptions:
+            legacy_filter(text, anti_keywords)
+        legacy_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        matcher = AntiKeywordMatcher(anti_keywords, whole_word=options['whole_word'])
+        for text in descriptions:
+            matcher.search(text)
+        matcher_seconds = time.perf_counter() - started
+
+        self.stdout.write('{} keywords, {} descriptions of {} chars'.format(
+            options['keywords'], len(descriptions), len(description)))
+        for name, seconds in (('legacy', legacy_seconds), ('matcher', matcher_seconds)):
+            self.stdout.write('{:<8} {:8.3f}s  {:8.1f} MB/s  {:8.1f} descriptions/s'.format(
+                name, seconds, megabytes / seconds, len(descriptions) / seconds))
+        self.stdout.write('speedup  {:.1f}x'.format(legacy_seconds / matcher_seconds))
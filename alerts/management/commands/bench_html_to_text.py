@@ -0,0 +1,126 @@
+import os
+import random
+import time
+import xml.etree.ElementTree as ElementTree
+
+import html2text
+from django.core.management.base import BaseCommand, CommandError
+
+from alerts.descriptions import extract_text
+from alerts.matching import AntiKeywordMatcher
+
+from .bench_anti_keywords import random_words
+
+
+def seller_template(rng, paragraphs, keyword=None):
+    """ A description in the style of a seller template, styles and scripts around tables of text.
+
+    keyword is put near the top, where sellers usually say an item is faulty.
+    """
+    rows = ''.join('<tr><td><b>{}</b></td><td>{}</td></tr>'.format(random_words(rng, 2), random_words(rng, 12))
+                   for _ in range(paragraphs))
+    return ('<html><head><style>.x {{ color: red; }}</style><script>var a = 1;</script></head><body>'
+            '<div class="template"><h2>{}</h2><p>{}</p><table>{}</table><p>{}</p></div></body></html>').format(
+        random_words(rng, 5), keyword or '', rows, random_words(rng, 60))
+
+
+def load_corpus(directory):
+    descriptions = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8', errors='replace') as f:
+                descriptions.append(f.read())
+    return descriptions
+
+
+def load_fixtures(directory):
+    """ The descriptions in eBay responses recorded with EBAY_API_RECORD, as {item id: HTML}.
+
+    GetMultipleItems and GetSingleItem responses are read, a listing recorded more than once keeps its latest
+    description.
+    """
+    descriptions = {}
+    for call in ('GetMultipleItems', 'GetSingleItem'):
+        path = os.path.join(directory, call)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            try:
+                root = ElementTree.parse(os.path.join(path, name)).getroot()
+            except ElementTree.ParseError:
+                continue
+            for item in root.iterfind('.//{*}Item'):
+                item_id = item.findtext('{*}ItemID')
+                description = item.findtext('{*}Description')
+                if item_id and description:
+                    descriptions[item_id] = description
+    return descriptions
+
+
+def save_corpus(descriptions, directory):
+    """ Write each description to directory/<item id>.html, the layout --corpus reads. """
+    os.makedirs(directory, exist_ok=True)
+    for item_id, description in descriptions.items():
+        with open(os.path.join(directory, '{}.html'.format(item_id)), 'w', encoding='utf-8') as f:
+            f.write(description)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark description to text conversion, html2text against the streaming extractor.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help='directory of recorded descriptions, one HTML file each')
+        parser.add_argument('--fixtures',
+                            help='directory of eBay responses recorded with EBAY_API_RECORD to take descriptions from')
+        parser.add_argument('--save-corpus', help='write the --fixtures descriptions to this directory for --corpus')
+        parser.add_argument('--descriptions', type=int, default=200, help='generated descriptions without a corpus')
+        parser.add_argument('--paragraphs', type=int, default=200, help='table rows per generated description')
+        parser.add_argument('--match-rate', type=float, default=0.25,
+                            help='share of generated descriptions containing an anti keyword')
+        parser.add_argument('--anti-keywords', default='spares,repair,faulty,broken',
+                            help='comma separated anti keywords for the early exit run')
+
+    def handle(self, *args, **options):
+        if options['corpus']:
+            if not os.path.isdir(options['corpus']):
+                raise CommandError('{} is not a directory'.format(options['corpus']))
+            descriptions = load_corpus(options['corpus'])
+        elif options['fixtures']:
+            if not os.path.isdir(options['fixtures']):
+                raise CommandError('{} is not a directory'.format(options['fixtures']))
+            recorded = load_fixtures(options['fixtures'])
+            if options['save_corpus']:
+                save_corpus(recorded, options['save_corpus'])
+                self.stdout.write('Saved {} descriptions to {}'.format(len(recorded), options['save_corpus']))
+            descriptions = list(recorded.values())
+        else:
+            rng = random.Random(0)
+            keyword = options['anti_keywords'].split(',')[0]
+            descriptions = [seller_template(rng, options['paragraphs'],
+                                            keyword if rng.random() < options['match_rate'] else None)
+                            for _ in range(options['descriptions'])]
+        if not descriptions:
+            raise CommandError('no descriptions to benchmark')
+        megabytes = sum(len(description) for description in descriptions) / 1e6
+        matcher = AntiKeywordMatcher(options['anti_keywords'])
+
+        runs = (
+            ('html2text', lambda description: html2text.html2text(description)),
+            ('fast', lambda description: extract_text(description)),
+            ('fast+exit', lambda description: extract_text(description, matcher)),
+        )
+        self.stdout.write('{} descriptions, {:.1f} MB'.format(len(descriptions), megabytes))
+        baseline = None
+        for name, convert in runs:
+            stopped = 0
+            started = time.perf_counter()
+            for description in descriptions:
+                result = convert(description)
+                if isinstance(result, tuple) and not result[1]:
+                    stopped += 1
+            seconds = time.perf_counter() - started
+            baseline = baseline or seconds
+            self.stdout.write('{:<10} {:8.3f}s  {:8.1f} MB/s  {:8.1f} descriptions/s  {:5.1f}x{}'.format(
+                name, seconds, megabytes / seconds, len(descriptions) / seconds, baseline / seconds,
+                '  ({} stopped early)'.format(stopped) if name == 'fast+exit' else ''))
@@ -0,0 +1,150 @@
+import contextlib
+import io
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from alerts import ebay_api
+from alerts.cache import seen_item_cache
+from alerts.replay import ListingCatalogue, ReplayAdapter
+
+
+class QueryCounter:
+    """ Counts the queries run on every database connection, whichever thread opened it. """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ('Benchmark scan cycles against a replayed eBay, N wanted items with M new listings per search each '
+            'cycle. Runs in a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wanted-items', type=int, default=20, help='wanted items scanned each cycle')
+        parser.add_argument('--distinct-keywords', type=int, default=0,
+                            help='distinct searches among the wanted items, all different by default')
+        parser.add_argument('--listings', type=int, default=20, help='new buy it now listings per search per cycle')
+        parser.add_argument('--auctions', type=int, default=2, help='new auctions per search per cycle')
+        parser.add_argument('--cycles', type=int, default=5)
+        parser.add_argument('--latency', type=float, default=0.1, help='seconds per eBay call')
+        parser.add_argument('--jitter', type=float, default=0.05, help='up to this many more seconds per call')
+        parser.add_argument('--match-rate', type=float, default=0.2,
+                            help='share of listings whose description contains an anti keyword')
+        parser.add_argument('--paragraphs', type=int, default=20, help='table rows per listing description')
+        parser.add_argument('--fixtures', help='directory of recorded responses (EBAY_API_RECORD) to replay instead')
+        parser.add_argument('--async', dest='scan_async', action='store_true', help='scan with SCAN_ASYNC')
+        parser.add_argument('--rate-limit', action='store_true', help='keep the eBay rate limiter on')
+        parser.add_argument('--response-cache', action='store_true', help='keep the eBay response cache on')
+
+    def handle(self, *args, **options):
+        if options['fixtures'] and not os.path.isdir(options['fixtures']):
+            raise CommandError('{} is not a directory'.format(options['fixtures']))
+        # ebaysdk won't build a request without an app id, replayed calls never check it.
+        os.environ.setdefault('EBAY_API_ID', 'replay')
+
+        catalogue = ListingCatalogue(per_search=options['listings'], auctions_per_search=options['auctions'],
+                                     anti_match_rate=options['match_rate'],
+                                     description_paragraphs=options['paragraphs'])
+        adapter = ReplayAdapter(catalogue, latency=options['latency'], jitter=options['jitter'],
+                                fixtures=options['fixtures'])
+        overrides = {
+            'SCAN_ASYNC': options['scan_async'],
+            'RATE_LIMIT': options['rate_limit'],
+            'RESPONSE_CACHE': 'memory' if options['response_cache'] else '',
+            'METRICS_FILE': '',
+        }
+
+        if connection.vendor == 'sqlite':
+            # SQLite's shared in memory test database locks whole tables, the scan's threads need a file.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench_scan.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**overrides):
+                ebay_api.set_transport(adapter)
+                try:
+                    self.run(options, catalogue, adapter)
+                finally:
+                    ebay_api.set_transport(None)
+        finally:
+            # Save the queued log records while the test database is still there.
+            for handler in logging.getLogger('db').handlers:
+                handler.flush()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options, catalogue, adapter):
+        from alerts import tasks
+        from alerts.models import EbayItem, WantedItem
+        from alerts.response_cache import response_cache
+        from alerts.writer import EbayItemWriter
+
+        response_cache._configured = False
+        seen_item_cache.clear()
+        distinct = options['distinct_keywords'] or options['wanted_items']
+        for i in range(options['wanted_items']):
+            WantedItem.objects.create(name='bench {}'.format(i), keywords='bench search {}'.format(i % distinct),
+                                      anti_keywords='spares,repair,faulty', min_price=5, max_price=100 + i % 50,
+                                      min_feedback=5, buy_it_now_time=10)
+
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        connection.execute_wrappers.append(counter)
+        cycle_seconds, search_seconds, queries, calls = [], [], [], []
+        try:
+            for cycle in range(options['cycles']):
+                if cycle:
+                    catalogue.advance()
+                before_queries, before_calls = counter.count, adapter.calls
+                started = time.perf_counter()
+                wanted_items = list(WantedItem.objects.filter(deleted=False).prefetch_related('notifications'))
+                tasks.route_cache.prime(wanted_items)
+                with contextlib.redirect_stdout(io.StringIO()):  # The scan prints every alert.
+                    report = tasks.scan(wanted_items, EbayItemWriter())
+                cycle_seconds.append(time.perf_counter() - started)
+                search_seconds += [seconds for group, seconds, status in report]
+                queries.append(counter.count - before_queries)
+                calls.append(adapter.calls - before_calls)
+                self.stdout.write('cycle {:3}  {:7.3f}s  {:3} searches  {:5} queries  {:4} eBay calls'.format(
+                    cycle + 1, cycle_seconds[-1], len(report), queries[-1], calls[-1]))
+        finally:
+            connection_created.disconnect(counter.install)
+            connection.execute_wrappers.remove(counter)
+
+        self.stdout.write('')
+        self.stdout.write('{} wanted items, {} listings per search per cycle, {:.0f}ms latency{}'.format(
+            options['wanted_items'], options['listings'], options['latency'] * 1000,
+            ', async' if options['scan_async'] else ''))
+        self.stdout.write('cycles/s        {:8.3f}'.format(len(cycle_seconds) / sum(cycle_seconds)))
+        self.stdout.write('cycle p50/p99   {:8.3f}s {:8.3f}s'.format(percentile(cycle_seconds, 0.5),
+                                                                  percentile(cycle_seconds, 0.99)))
+        self.stdout.write('search p50/p99  {:8.3f}s {:8.3f}s'.format(percentile(search_seconds, 0.5),
+                                                                  percentile(search_seconds, 0.99)))
+        self.stdout.write('queries/cycle   {:8.1f}'.format(statistics.mean(queries)))
+        self.stdout.write('eBay calls/cycle{:8.1f}'.format(statistics.mean(calls)))
+        self.stdout.write('items saved     {:8}  ({} passed)'.format(
+            EbayItem.objects.count(), EbayItem.objects.filter(passed_filter=True).count()))
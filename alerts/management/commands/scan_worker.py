@@ -0,0 +1,57 @@
+import datetime
+import logging
+import signal
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from alerts.leasing import LeaseManager
+from alerts.notifications import alert_dispatcher
+
+db_logger = logging.getLogger('db')
+
+
+class Command(BaseCommand):
+    help = ('Scan a share of the wanted items every cycle. Start as many as needed against the same database, the '
+            "wanted items are shared out between them by leasing their rows and a dead worker's share is taken over "
+            'once its leases expire. With RATE_LIMIT on they must all run on one machine, which shares the limits.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=None,
+                            help='seconds between cycles, SCAN_WORKER_INTERVAL by default')
+        parser.add_argument('--lease-duration', type=int, default=None,
+                            help='seconds a lease lasts without renewal, SCAN_LEASE_DURATION by default')
+        parser.add_argument('--name', help='worker name, host:pid by default')
+        parser.add_argument('--cycles', type=int, default=0, help='stop after this many cycles, run forever if 0')
+
+    def handle(self, *args, **options):
+        from alerts.tasks import scan_cycle
+
+        interval = options['interval'] or settings.SCAN_WORKER_INTERVAL
+        leases = LeaseManager(name=options['name'], duration=options['lease_duration'])
+        # Stopped by a signal the worker still gives its leases back, so the others don't wait for them to expire.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        cycle = 0
+        try:
+            with leases.keep_alive():
+                while not options['cycles'] or cycle < options['cycles']:
+                    started = time.monotonic()
+                    try:
+                        wanted_items = leases.claim()
+                        self.stdout.write('{}  cycle {}  {} wanted items'.format(leases.name, cycle + 1,
+                                                                                 len(wanted_items)))
+                        scan_cycle(wanted_items)
+                    except Exception as e:
+                        db_logger.exception("{}  :  Exception in scan worker {}: {}".format(datetime.datetime.now(),
+                                                                                          leases.name, e))
+                    cycle += 1
+                    if not options['cycles'] or cycle < options['cycles']:
+                        time.sleep(max(interval - (time.monotonic() - started), 0))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            leases.release()
+            alert_dispatcher.drain()
@@ -0,0 +1,40 @@
+import functools
+import re
+
+
+class AntiKeywordMatcher:
+    """ Matches text against a comma separated anti keywords string using one compiled regex.
+
+    Empty keywords (e.g. from a trailing comma) are ignored. With whole_word a keyword only matches when it isn't part
+    of a longer word, and surrounding spaces in the keywords are stripped.
+    """
+
+    def __init__(self, anti_keywords: str, whole_word=False, case_sensitive=False):
+        keywords = [keyword for keyword in anti_keywords.split(',') if keyword.strip()]
+        if whole_word:
+            keywords = [keyword.strip() for keyword in keywords]
+        self.keywords = keywords
+        self.whole_word = whole_word
+        self.case_sensitive = case_sensitive
+
+        if keywords:
+            # Longest first so the reported match is the most specific keyword.
+            pattern = '|'.join(re.escape(keyword) for keyword in sorted(set(keywords), key=len, reverse=True))
+            if whole_word:
+                pattern = r'(?<!\w)(?:{})(?!\w)'.format(pattern)
+            self._regex = re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+        else:
+            self._regex = None
+
+    def search(self, text):
+        """ Return the first anti keyword found in text, or None. """
+        if self._regex is None or not text:
+            return None
+        match = self._regex.search(text)
+        return match.group(0) if match else None
+
+
+@functools.lru_cache(maxsize=1024)
+def get_matcher(anti_keywords: str, whole_word=False, case_sensitive=False):
+    """ Compiled matchers are cached on their settings, editing a wanted item's anti keywords builds a new one. """
+    return AntiKeywordMatcher(anti_keywords, whole_word=whole_word, case_sensitive=case_sensitive)
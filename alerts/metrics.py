@@ -0,0 +1,194 @@
+import contextlib
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+db_logger = logging.getLogger('db')
+
+PREFIX = 'ebay_flipper_'
+STALE_SECONDS = 15 * 60  # a process that hasn't written its metrics for this long has stopped
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _snapshot(counters, spans):
+    return {
+        'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                     for (name, labels), value in sorted(counters.items())],
+        'spans': [{'name': name, 'labels': dict(labels), 'count': count, 'seconds': seconds, 'max': longest}
+                  for (name, labels), (count, seconds, longest) in sorted(spans.items())],
+    }
+
+
+def merge(snapshots):
+    """ Several processes' snapshots as one, counters and spans added up and the latest cycle. """
+    counters = {}
+    spans = {}
+    for snapshot in snapshots:
+        for counter in snapshot['counters']:
+            key = _key(counter['name'], counter['labels'])
+            counters[key] = counters.get(key, 0) + counter['value']
+        for span in snapshot['spans']:
+            totals = spans.setdefault(_key(span['name'], span['labels']), [0, 0.0, 0.0])
+            totals[0] += span['count']
+            totals[1] += span['seconds']
+            totals[2] = max(totals[2], span['max'])
+    merged = _snapshot(counters, spans)
+    cycles = [snapshot['cycle'] for snapshot in snapshots if snapshot.get('cycle')]
+    merged['cycle'] = max(cycles, key=lambda cycle: cycle['started'] or 0) if cycles else None
+    merged['pids'] = sorted(snapshot['pid'] for snapshot in snapshots if 'pid' in snapshot)
+    return merged
+
+
+class Metrics:
+    """ Counters and timing spans for the scan, labelled by wanted item, call, route and so on.
+
+    Everything is cumulative since the process started, the way Prometheus expects. The scan marks each cycle with
+    start_cycle and end_cycle, end_cycle writes a snapshot for the metrics view (the scan runs in the background task
+    or scan worker processes, not the web process) along with what the cycle alone added, and logs that as JSON when
+    METRICS_LOG_JSON is set. Each process writes its own file next to METRICS_FILE and the view adds them up, files
+    are only shared by the processes on one machine unless METRICS_FILE is on storage they all mount.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.spans = {}  # (name, labels) -> [count, seconds, max seconds]
+        self._cycle_started = None
+        self._cycle_start = None
+
+    def increment(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            span = self.spans.setdefault(key, [0, 0.0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+            span[2] = max(span[2], seconds)
+
+    @contextlib.contextmanager
+    def span(self, name, **labels):
+        """ Time the block as one span of name, it is recorded even if the block raises. """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return _snapshot(self.counters, self.spans)
+
+    @staticmethod
+    def path():
+        """ This process's metrics file. """
+        return '{}.{}-{}'.format(settings.METRICS_FILE, socket.gethostname(), os.getpid())
+
+    def start_cycle(self):
+        self._cycle_started = time.time()
+        self._cycle_start = self.snapshot()
+
+    def end_cycle(self):
+        """ Finish the cycle, returns what it added: counters and span counts and seconds by name and labels. """
+        snapshot = self.snapshot()
+        before = self._cycle_start or {'counters': [], 'spans': []}
+        counted = {_key(c['name'], c['labels']): c['value'] for c in before['counters']}
+        timed = {_key(s['name'], s['labels']): (s['count'], s['seconds']) for s in before['spans']}
+        cycle = {'started': self._cycle_started, 'seconds': time.time() - (self._cycle_started or time.time()),
+                 'counters': [], 'spans': []}
+        for counter in snapshot['counters']:
+            value = counter['value'] - counted.get(_key(counter['name'], counter['labels']), 0)
+            if value:
+                cycle['counters'].append(dict(counter, value=value))
+        for span in snapshot['spans']:
+            count, seconds = timed.get(_key(span['name'], span['labels']), (0, 0.0))
+            if span['count'] != count:
+                cycle['spans'].append({'name': span['name'], 'labels': span['labels'], 'count': span['count'] - count,
+                                       'seconds': span['seconds'] - seconds})
+        snapshot['cycle'] = cycle
+        snapshot['pid'] = os.getpid()
+
+        if settings.METRICS_FILE:
+            # Replace the file in one step so the view never reads half of it.
+            path = self.path()
+            with open(path + '.tmp', 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(path + '.tmp', path)
+        if settings.METRICS_LOG_JSON:
+            db_logger.info(json.dumps(cycle))
+        return cycle
+
+    def load(self):
+        """ The snapshots the scan processes last wrote added up, or this process's own if there aren't any. """
+        snapshots = []
+        if settings.METRICS_FILE:
+            for path in glob.glob(glob.escape(settings.METRICS_FILE) + '.*'):
+                if path.endswith('.tmp'):
+                    continue
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE_SECONDS:
+                        os.remove(path)
+                        continue
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    # Removed or replaced by its process while being read.
+                    continue
+        if not snapshots:
+            return self.snapshot()
+        return merge(snapshots)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                    for label, value in sorted(labels.items())))
+
+
+def prometheus_text(snapshot):
+    """ A snapshot in the Prometheus text exposition format. """
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+    for counter in snapshot['counters']:
+        name = '{}{}_total'.format(PREFIX, counter['name'])
+        declare(name, 'counter')
+        lines.append('{}{} {}'.format(name, _labels(counter['labels']), counter['value']))
+    for span in snapshot['spans']:
+        name = '{}{}_seconds'.format(PREFIX, span['name'])
+        declare(name, 'summary')
+        labels = _labels(span['labels'])
+        lines.append('{}_count{} {}'.format(name, labels, span['count']))
+        lines.append('{}_sum{} {:.6f}'.format(name, labels, span['seconds']))
+    for span in snapshot['spans']:
+        name = '{}{}_seconds_max'.format(PREFIX, span['name'])
+        declare(name, 'gauge')
+        lines.append('{}{} {:.6f}'.format(name, _labels(span['labels']), span['max']))
+    cycle = snapshot.get('cycle')
+    if cycle:
+        declare(PREFIX + 'last_cycle_seconds', 'gauge')
+        lines.append('{}last_cycle_seconds {:.3f}'.format(PREFIX, cycle['seconds']))
+        declare(PREFIX + 'last_cycle_started', 'gauge')
+        lines.append('{}last_cycle_started {:.3f}'.format(PREFIX, cycle['started'] or 0))
+    return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_items(apps, schema_editor):
+    # Keep the first row saved for each item id so the unique index can be created.
+    EbayItem = apps.get_model('alerts', 'EbayItem')
+    duplicates = (EbayItem.objects.values('item_id')
+                  .annotate(first_id=models.Min('id'), count=models.Count('id'))
+                  .filter(count__gt=1))
+    for duplicate in duplicates:
+        EbayItem.objects.filter(item_id=duplicate['item_id']).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0012_ebayitem_passed_filter'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_items, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='ebayitem',
+            name='item_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0013_ebayitem_item_id_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wanteditem',
+            name='anti_keywords_whole_word',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='wanteditem',
+            name='anti_keywords_case_sensitive',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0014_wanteditem_anti_keywords_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wanteditem',
+            name='last_seen_start_time',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0015_wanteditem_last_seen_start_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wanteditem',
+            name='last_auction_search',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='ebayitem',
+            name='wanted_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                    related_name='ebay_items', to='alerts.WantedItem'),
+        ),
+        migrations.AddField(
+            model_name='ebayitem',
+            name='alert_at',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0016_auction_alert_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationroute',
+            name='digest_minutes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
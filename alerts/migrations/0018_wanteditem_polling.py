@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0017_notificationroute_digest_minutes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wanteditem',
+            name='arrival_rate',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wanteditem',
+            name='poll_interval',
+            field=models.PositiveIntegerField(default=60),
+        ),
+        migrations.AddField(
+            model_name='wanteditem',
+            name='last_polled_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='wanteditem',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, null=True),
+        ),
+    ]
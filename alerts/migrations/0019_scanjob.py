@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('alerts', '0018_wanteditem_polling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('QUE', 'Queued'), ('RUN', 'Running'), ('DON', 'Done'),
+                                                     ('ERR', 'Failed')], default='QUE', max_length=3)),
+                ('wanted_item_ids', models.TextField(blank=True)),
+                ('searches', models.IntegerField(default=0)),
+                ('searches_done', models.IntegerField(default=0)),
+                ('items_found', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('insert_date', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                                 related_name='scan_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Scan Job',
+                'verbose_name_plural': 'Scan Jobs',
+            },
+        ),
+    ]
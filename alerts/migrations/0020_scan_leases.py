@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0019_scanjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanWorker',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Scan Worker',
+                'verbose_name_plural': 'Scan Workers',
+            },
+        ),
+        migrations.AddField(
+            model_name='wanteditem',
+            name='lease_owner',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='wanteditem',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0020_scan_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanworker',
+            name='host',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
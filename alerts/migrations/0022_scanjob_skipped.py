@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alerts', '0021_scanworker_host'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='skipped_wanted_item_ids',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='scanjob',
+            name='status',
+            field=models.CharField(choices=[('QUE', 'Queued'), ('RUN', 'Running'), ('DON', 'Done'),
+                                            ('PAR', 'Partial'), ('ERR', 'Failed')], default='QUE', max_length=3),
+        ),
+    ]
@@ -1,19 +1,23 @@
 from django.db import models
 import datetime
+import decimal
 import pytz
 import logging
-import os
 from django.conf import settings
+from django.utils.functional import cached_property
 from datetime import timezone
-import html2text
 
 from djmoney.models.fields import MoneyField
-from ebaysdk.finding import Connection as Finding
-from ebaysdk.shopping import Connection as Shopping
 import discord
+import requests
+
+from .descriptions import description_converter
+from .ebay_api import get_connection
+from .matching import AntiKeywordMatcher, get_matcher
+from .metrics import metrics
+from .notifications import alert_dispatcher, route_cache
+from .smtp import smtp_pool
 
-# Import smtplib for the actual sending function
-import smtplib
 # Import the email modules we'll need
 from email.mime.text import MIMEText
 
@@ -28,6 +32,11 @@ def utc_to_local(utc_dt):
     return utc_dt.replace(tzinfo=timezone.utc).astimezone(tz=localtimezone)
 
 
+def parse_ebay_time(value):
+    """ eBay times look like '2020-05-04T14:40:00.000Z', fromisoformat is much faster than strptime. """
+    return datetime.datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc)
+
+
 class KeyWordString(models.Model):
     """ Currently not used, could be used later to improve anti keywords administration."""
     text = models.CharField(max_length=200)
@@ -36,8 +45,10 @@ class KeyWordString(models.Model):
 class NotificationRoute(models.Model):
     """ Routes for notifications. """
 
-    EDITABLE_FIELDS = ['name', 'description', 'webhook', 'created_by', 'insert_date', 'modified_date']
-    DISPLAY_FIELDS = ['name', 'description', 'webhook', 'created_by', 'insert_date', 'modified_date']
+    EDITABLE_FIELDS = ['name', 'description', 'webhook', 'digest_minutes', 'created_by', 'insert_date',
+                       'modified_date']
+    DISPLAY_FIELDS = ['name', 'description', 'webhook', 'digest_minutes', 'created_by', 'insert_date',
+                      'modified_date']
 
     TYPE_CHOICES = [
         ('DIS', 'Discord'),
@@ -50,6 +61,8 @@ class NotificationRoute(models.Model):
     webhook = models.CharField(max_length=400)
     type = models.CharField(max_length=3, choices=TYPE_CHOICES, null=False)
     include_item_description = models.BooleanField(default=False)
+    # Email routes only, collect alerts for this many minutes and send them as one message. 0 sends each straight away.
+    digest_minutes = models.PositiveIntegerField(default=0)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL,
                                    related_name='notifications')
     insert_date = models.DateTimeField(auto_now_add=True)
@@ -73,17 +86,54 @@ class NotificationRoute(models.Model):
         super().save(*args, **kwargs)  # Call the "real" save() method.
 
     # OTHER METHODS
-    pass
+    @cached_property
+    def webhook_id_token(self):
+        """ Discord webhook id and token parsed from the webhook url, once per route instance. """
+        split = self.webhook.split('/')
+        return split[5], split[6]
+
+    def connect(self):
+        """ Open a connection alerts can be sent over, the dispatcher keeps it for every alert on this route. """
+        if self.type == 'DIS':
+            id, token = self.webhook_id_token
+            # The adapter sleeps through Discord's rate limits rather than failing the send.
+            return discord.Webhook.partial(id,
+                                           token,
+                                           adapter=discord.RequestsWebhookAdapter(session=requests.Session(),
+                                                                                  sleep=True))
+        elif self.type == 'EMA':
+            # Email routes share the SMTP pool.
+            return smtp_pool
+        return None
+
+    def disconnect(self, connection):
+        try:
+            if self.type == 'DIS':
+                connection._adapter.session.close()
+        except Exception:
+            pass
+
+    def deliver_digest(self, items, connection=None):
+        """ Send one email listing every item in items, for routes with digest_minutes set. """
+        lines = ['{}\n£{} - {}\n{}'.format(item.name, item.price.amount, item.listing_type, item.url)
+                 for item in items]
+        msg = MIMEText('\n\n'.join(lines))
+        msg['Subject'] = '{} New Item Alerts'.format(len(items))
+        msg['From'] = settings.ALERT_EMAIL_FROM
+        msg['To'] = self.webhook
+        (connection or smtp_pool).sendmail(settings.ALERT_EMAIL_FROM, [self.webhook], msg.as_string())
 
 
 # Create your models here.
 class WantedItem(models.Model):
     """ Specification for an item to monitor and send alerts for. """
 
-    EDITABLE_FIELDS = ['name', 'keywords', 'anti_keywords', 'min_price', 'max_price', 'min_feedback', 'max_feedback',
-                       'auction_alert_time', 'buy_it_now_time', 'condition', 'notifications']
+    EDITABLE_FIELDS = ['name', 'keywords', 'anti_keywords', 'anti_keywords_whole_word', 'anti_keywords_case_sensitive',
+                       'min_price', 'max_price', 'min_feedback', 'max_feedback', 'auction_alert_time', 'buy_it_now_time',
+                       'condition', 'notifications']
     DISPLAY_FIELDS = ['name', 'keywords', 'anti_keywords', 'min_price', 'max_price', 'min_feedback', 'max_feedback',
-                      'auction_alert_time', 'buy_it_now_time', 'condition']
+                      'auction_alert_time', 'buy_it_now_time', 'condition', 'arrival_rate', 'poll_interval',
+                      'next_poll_at', 'lease_owner']
     CONDITION_CHOICES = [
         (0000, 'N/A'),
         (1000, 'New'),
@@ -104,6 +154,8 @@ class WantedItem(models.Model):
     # anti_keywords = ArrayField(models.CharField(max_length=100, blank=True))
     # anti_keywords = models.ManyToManyField(KeyWordString, blank=True, null=True)
     anti_keywords = models.TextField(blank=True)
+    anti_keywords_whole_word = models.BooleanField(default=False)  # only match anti keywords as whole words
+    anti_keywords_case_sensitive = models.BooleanField(default=False)
     min_price = MoneyField(
         decimal_places=2,
         default=0,
@@ -127,6 +179,18 @@ class WantedItem(models.Model):
                                    related_name='wanted_items')
     notifications = models.ManyToManyField(NotificationRoute, related_name='wanted_items')
     deleted = models.BooleanField(default=False)
+    # Start time of the newest buy it now listing seen, searches only page back as far as this.
+    last_seen_start_time = models.DateTimeField(null=True, blank=True, default=None)
+    # Auctions are scheduled for alerting when found, so they are only searched for every AUCTION_SEARCH_INTERVAL.
+    last_auction_search = models.DateTimeField(null=True, blank=True, default=None)
+    # Adaptive polling, see alerts.polling. New buy it now listings per minute (moving average) and when to search next.
+    arrival_rate = models.FloatField(default=0)
+    poll_interval = models.PositiveIntegerField(default=60)  # seconds
+    last_polled_at = models.DateTimeField(null=True, blank=True, default=None)
+    next_poll_at = models.DateTimeField(null=True, blank=True, default=None, db_index=True)
+    # Sharded scanning, see alerts.leasing. The scan worker searching for this wanted item and until when.
+    lease_owner = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    lease_expires = models.DateTimeField(null=True, blank=True, default=None, db_index=True)
     api = None
     found_items = []  # List of EbayItem
 
@@ -147,47 +211,105 @@ class WantedItem(models.Model):
         super().save(*args, **kwargs)  # Call the "real" save() method.
 
     # OTHER METHODS
+    @property
+    def anti_keyword_matcher(self):
+        return get_matcher(self.anti_keywords, self.anti_keywords_whole_word, self.anti_keywords_case_sensitive)
+
     def connect(self, connection_type="Finding"):
-        if connection_type == "Finding":
-            self.api = Finding(appid=os.getenv("EBAY_API_ID"), siteid='EBAY-GB', config_file=None)
-        elif connection_type == "Shopping":
-            self.api = Shopping(appid=os.getenv("EBAY_API_ID"), siteid='EBAY-GB', config_file=None)
+        self.api = get_connection(connection_type)
+
+    def search_request(self, listing_type, page=1):
+        """ findItemsAdvanced request for 'FixedPrice' (newest first) or 'Auction' (ending soonest first) listings. """
+        api_request = {
+            'keywords': self.keywords,
+            'itemFilter': [
+                {'name': 'FeedbackScoreMin',
+                 'value': self.min_feedback},
+                {'name': 'MaxPrice',
+                 'value': self.max_price.amount},
+                {'name': 'MinPrice',
+                 'value': self.min_price.amount},
+                {'name': 'LocatedIn',
+                 'value': self.located_in},
+                {'name': 'ListingType',
+                 'value': listing_type},
+            ],
+            'sortOrder': 'StartTimeNewest' if listing_type == 'FixedPrice' else 'EndTimeSoonest',
+            'descriptionSearch': True,
+            'outputSelector': 'SellerInfo',
+            'paginationInput': {'entriesPerPage': settings.SEARCH_PAGE_SIZE,
+                                'pageNumber': page},
+        }
+
+        if self.condition:
+            api_request['itemFilter'].append({'name': 'Condition',
+                                              'value': self.condition})
+        return api_request
+
+    @staticmethod
+    def search_results(response: dict):
+        items = response.get('searchResult').get('item')
+        if items is not None:
+            return items
+        else:
+            return []
+
+    def matches_search_result(self, item: dict):
+        """ The search filters of search_request applied locally, for results of a wider search shared with others. """
+        price = decimal.Decimal(item['sellingStatus']['currentPrice']['value'])
+        if price < self.min_price.amount or price > self.max_price.amount:
+            return False
+        if int(item['sellerInfo']['feedbackScore']) < self.min_feedback:
+            return False
+        if self.condition and str((item.get('condition') or {}).get('conditionId')) != str(self.condition):
+            return False
+        return True
+
+    def search_cutoff(self):
+        """ Start time past which buy it now results are of no interest, either seen before or too old to alert. """
+        now = datetime.datetime.now(timezone.utc)
+        cutoff = now - datetime.timedelta(minutes=self.buy_it_now_time)
+        if self.last_seen_start_time is not None and self.last_seen_start_time > cutoff:
+            cutoff = self.last_seen_start_time
+        return cutoff
+
+    def needs_next_page(self, response: dict, page, page_items, cutoff):
+        """ Newest first results carry on onto the next page until they reach the cutoff. """
+        if not page_items:
+            return False
+        total_pages = int((response.get('paginationOutput') or {}).get('totalPages') or 1)
+        if page >= total_pages:
+            return False
+        return parse_ebay_time(page_items[-1]['listingInfo']['startTime']) > cutoff
+
+    def new_since_last_scan(self, items):
+        """ Drop buy it now results older than the last scan's newest listing. """
+        if self.last_seen_start_time is None:
+            return items
+        return [item for item in items
+                if parse_ebay_time(item['listingInfo']['startTime']) >= self.last_seen_start_time]
 
     def search_buy_it_now(self):
         try:
-            api_request = {
-                'keywords': self.keywords,
-                'itemFilter': [
-                    {'name': 'FeedbackScoreMin',
-                     'value': self.min_feedback},
-                    {'name': 'MaxPrice',
-                     'value': self.max_price.amount},
-                    {'name': 'MinPrice',
-                     'value': self.min_price.amount},
-                    {'name': 'LocatedIn',
-                     'value': self.located_in},
-                    {'name': 'ListingType',
-                     'value': 'FixedPrice'},
-                ],
-                'sortOrder': 'StartTimeNewest',
-                'descriptionSearch': True,
-                'outputSelector': 'SellerInfo',
-            }
-
-            if self.condition is not 0:
-                api_request['itemFilter'].append({'name': 'Condition',
-                                                  'value': self.condition})
-
-            # Search for listings
-            response = self.api.execute('findItemsAdvanced', api_request)
-            response = response.dict()
+            cutoff = self.search_cutoff()
+            items = []
+            page = 1
+            while True:
+                # Search for listings, a page at a time until we get back to listings we have seen
+                response = self.api.execute('findItemsAdvanced', self.search_request('FixedPrice', page))
+                response = response.dict()
+                page_items = self.search_results(response)
+                items += page_items
+                if not self.needs_next_page(response, page, page_items, cutoff):
+                    break
+                if page >= settings.SEARCH_MAX_PAGES:
+                    db_logger.warning("{}  :  {} hit SEARCH_MAX_PAGES, older listings may have been missed".format(
+                        datetime.datetime.now(), self))
+                    break
+                page += 1
 
             # Return results
-            items = response.get('searchResult').get('item')
-            if items is not None:
-                return items
-            else:
-                return []
+            return self.new_since_last_scan(items)
         except ConnectionError as e:
             db_logger.error("{}  :  Exception in search_buy_it_now: {}".format(datetime.datetime.now(), e))
             try:
@@ -195,41 +317,47 @@ class WantedItem(models.Model):
             except:
                 pass
 
+    def auction_search_due(self):
+        if self.last_auction_search is None:
+            return True
+        interval = datetime.timedelta(minutes=settings.AUCTION_SEARCH_INTERVAL)
+        return datetime.datetime.now(timezone.utc) - self.last_auction_search >= interval
+
+    def auction_horizon(self):
+        """ Auctions ending before this need to be found now, the next search will be too late to alert them. """
+        minutes = settings.AUCTION_SEARCH_INTERVAL + self.auction_alert_time
+        return datetime.datetime.now(timezone.utc) + datetime.timedelta(minutes=minutes)
+
+    def needs_next_auction_page(self, response: dict, page, page_items, horizon):
+        """ Ending soonest results carry on onto the next page until they reach the horizon. """
+        if not page_items:
+            return False
+        total_pages = int((response.get('paginationOutput') or {}).get('totalPages') or 1)
+        if page >= total_pages:
+            return False
+        return parse_ebay_time(page_items[-1]['listingInfo']['endTime']) < horizon
+
     def search_auctions(self):
         try:
-            api_request = {
-                'keywords': self.keywords,
-                'itemFilter': [
-                    {'name': 'FeedbackScoreMin',
-                     'value': self.min_feedback},
-                    {'name': 'MaxPrice',
-                     'value': self.max_price.amount},
-                    {'name': 'MinPrice',
-                     'value': self.min_price.amount},
-                    {'name': 'LocatedIn',
-                     'value': self.located_in},
-                    {'name': 'ListingType',
-                     'value': 'Auction'},
-                ],
-                'sortOrder': 'EndTimeSoonest',
-                'outputSelector': 'SellerInfo',
-                'descriptionSearch': True
-            }
-
-            if self.condition is not 0:
-                api_request['itemFilter'].append({'name': 'Condition',
-                                                  'value': self.condition})
-
-            # Search for listings
-            response = self.api.execute('findItemsAdvanced', api_request)
-            response = response.dict()
+            horizon = self.auction_horizon()
+            items = []
+            page = 1
+            while True:
+                # Search for listings, a page at a time until they end after the next search
+                response = self.api.execute('findItemsAdvanced', self.search_request('Auction', page))
+                response = response.dict()
+                page_items = self.search_results(response)
+                items += page_items
+                if not self.needs_next_auction_page(response, page, page_items, horizon):
+                    break
+                if page >= settings.SEARCH_MAX_PAGES:
+                    db_logger.warning("{}  :  {} hit SEARCH_MAX_PAGES, auctions may have been missed".format(
+                        datetime.datetime.now(), self))
+                    break
+                page += 1
 
             # Return results
-            items = response.get('searchResult').get('item')
-            if items is not None:
-                return items
-            else:
-                return []
+            return items
         except ConnectionError as e:
             db_logger.error("{}  :  Exception in search_auctions: {}".format(datetime.datetime.now(), e))
             try:
@@ -237,22 +365,30 @@ class WantedItem(models.Model):
             except:
                 pass
 
-    def get_single_item(self, item_id):
-        self.connect("Shopping")
+    @staticmethod
+    def multiple_items_request(item_ids):
+        return {
+            'ItemID': [str(item_id) for item_id in item_ids],
+            'IncludeSelector': 'Description'
+        }
+
+    @staticmethod
+    def multiple_items_results(response: dict):
+        # A single item comes back as a dict rather than a list
+        items = response.get('Item') or []
+        if isinstance(items, dict):
+            items = [items]
+        return {item.get('ItemID'): item for item in items}
+
+    def get_multiple_items(self, item_ids):
+        """ Fetch up to 20 items in one GetMultipleItems call, returns a dict of item id (as a string) to item. """
+        api = get_connection("Shopping")
         try:
-            api_request = {
-                'ItemID': item_id,
-                'IncludeSelector': ['Description']
-            }
-            response = self.api.execute('GetSingleItem', api_request)
-            print("EndTime: %s" % response.reply.Item.EndTime)
-
-            response = response.dict()
-            # Return results
-            return response.get('Item')
+            response = api.execute('GetMultipleItems', self.multiple_items_request(item_ids))
+            return self.multiple_items_results(response.dict())
 
         except ConnectionError as e:
-            db_logger.exception("{}  :  Exception in get_single_item: {}".format(datetime.datetime.now(), e))
+            db_logger.exception("{}  :  Exception in get_multiple_items: {}".format(datetime.datetime.now(), e))
             try:
                 print(e.response.dict())
             except:
@@ -264,7 +400,7 @@ class EbayItem(models.Model):
     DISPLAY_FIELDS = ['item_id', 'name', 'description', 'start_time', 'end_time', 'listing_type', 'price', 'url',
                       'insert_date']
 
-    item_id = models.BigIntegerField()
+    item_id = models.BigIntegerField(unique=True)
     name = models.CharField(max_length=500)
     description = models.TextField()
     start_time = models.DateTimeField()
@@ -281,6 +417,10 @@ class EbayItem(models.Model):
     url = models.CharField(max_length=300)
     seller_feedback = models.IntegerField()
     passed_filter = models.BooleanField(default=True)
+    wanted_item = models.ForeignKey(WantedItem, null=True, blank=True, on_delete=models.SET_NULL,
+                                    related_name='ebay_items')
+    # Auctions found before their alert window wait here, the scheduler alerts them when it opens.
+    alert_at = models.DateTimeField(null=True, blank=True, default=None, db_index=True)
     insert_date = models.DateTimeField(auto_now_add=True)
     deleted = models.BooleanField(default=False)
 
@@ -301,6 +441,14 @@ class EbayItem(models.Model):
         super().save(*args, **kwargs)  # Call the "real" save() method.
 
     # OTHER METHODS
+    @classmethod
+    def existing_item_ids(cls, item_ids):
+        """ Return the subset of item_ids that are already saved, resolved with a single query. """
+        item_ids = {int(item_id) for item_id in item_ids}
+        if not item_ids:
+            return set()
+        return set(cls.objects.filter(item_id__in=item_ids).values_list('item_id', flat=True))
+
     def is_recent(self, max_mins):
         try:
             then = self.start_time
@@ -343,18 +491,20 @@ class EbayItem(models.Model):
             except:
                 pass
 
-    def filter_anti_keywords(self, text, anti_keywords: str):
+    def filter_anti_keywords(self, text, anti_keywords):
+        """ anti_keywords is a wanted item's anti_keyword_matcher, or a comma separated string. """
         try:
-            anti_keywords_list = anti_keywords.split(',')
-            for anti in anti_keywords_list:
-                if anti.lower() in text.lower().strip('\n'):
-                    db_logger.info(
-                        "{}  :  Filtered out anti keyword [{}] from item [{}]".format(datetime.datetime.now(), anti,
-                                                                                      str(text)))
-                    print(
-                        "{}  :  Filtered out anti keyword [{}] from item [{}]".format(datetime.datetime.now(), anti,
-                                                                                      str(text)))
-                    return False
+            if isinstance(anti_keywords, AntiKeywordMatcher):
+                matcher = anti_keywords
+            else:
+                matcher = get_matcher(anti_keywords)
+
+            anti = matcher.search(text)
+            if anti is not None:
+                db_logger.info(
+                    "{}  :  Filtered out anti keyword [{}] from item [{}]".format(datetime.datetime.now(), anti,
+                                                                                  str(text)))
+                return False
 
             return True
         except ConnectionError as e:
@@ -364,39 +514,14 @@ class EbayItem(models.Model):
             except:
                 pass
 
-    def filter_item(self, wanted_item: WantedItem):
+    def passes_description_filter(self, wanted_item: WantedItem, details: dict):
+        """ Checks the item's full description from its GetMultipleItems details. """
         try:
-            # Filter out ebay power sellers (feedback > 1000ish)
-            if self.seller_feedback < wanted_item.min_feedback or self.seller_feedback > wanted_item.max_feedback:
-                return False
-
-            if self.auction_or_fixed == 'F':
-                # Check if it was recent
-                good_item = self.is_recent(wanted_item.buy_it_now_time)
-                if not good_item:
-                    return False
-                # Check against our anti keywords to filter out junk
-                good_item = self.filter_anti_keywords(self.name, wanted_item.anti_keywords)
-                if not good_item:
-                    return False
-
-            elif self.auction_or_fixed == 'A':
-                # Check if it is ending soon
-                good_item = self.is_ending_soon(wanted_item.auction_alert_time)
-                if not good_item:
-                    return False
-                # Check against our anti keywords to filter out junk
-                good_item = self.filter_anti_keywords(self.name, wanted_item.anti_keywords)
-                if not good_item:
-                    return False
-
-            # Get Single item
-            details = wanted_item.get_single_item(self.item_id)
-
             # Check anti keywords not in description
-            self.description = html2text.html2text(details.get('Description'))
+            self.description = description_converter.convert(details.get('Description'),
+                                                             wanted_item.anti_keyword_matcher)
             # Check our description against anti keywords to filter out junk
-            good_item = self.filter_anti_keywords(self.description, wanted_item.anti_keywords)
+            good_item = self.filter_anti_keywords(self.description, wanted_item.anti_keyword_matcher)
             if not good_item:
                 return False
 
@@ -404,76 +529,23 @@ class EbayItem(models.Model):
             return True
 
         except ConnectionError as e:
-            db_logger.exception("{}  :  Exception in filter_item: {}".format(datetime.datetime.now(), e))
+            db_logger.exception("{}  :  Exception in passes_description_filter: {}".format(datetime.datetime.now(), e))
             try:
                 print(e.response.dict())
             except:
                 pass
 
     def send_alert(self, wanted_item: WantedItem):
+        """ Queue this item's alert for each of the wanted item's notification routes, the dispatcher sends them. """
         try:
             print("sending alert for item: {}".format(self.url))
             db_logger.info("Sending alert for item: {}".format(self.url))
 
-            notification_routes = wanted_item.notifications.all()
+            notification_routes = route_cache.routes(wanted_item)
             for notification_route in notification_routes:
                 # Send an alert for each notification route.
-                notification_route: NotificationRoute
-                split = notification_route.webhook.split('/')
-                if notification_route.type == 'DIS':
-                    id = split[5]
-                    token = split[6]
-                    # Create webhook
-                    webhook = discord.Webhook.partial(id,
-                                                      token,
-                                                      adapter=discord.RequestsWebhookAdapter())
-
-                    date_time_str = datetime.datetime.now()
-                    if type(date_time_str) == str:
-                        date_time_obj = datetime.datetime.strptime(date_time_str, "%Y-%m-%dT%H:%M:%S.%f%z")
-                    else:
-                        date_time_obj = date_time_str
-
-                    start_time = utc_to_local(self.start_time)
-                    end_time = utc_to_local(self.end_time)
-
-                    # Build the embed
-                    if notification_route.include_item_description:
-                        embed = discord.Embed(title=self.name, description=self.description, color=0x00ff00)
-                    else:
-                        embed = discord.Embed(title=self.name, color=0x00ff00)
-                    # embed.add_field(name='Description', value=self.description, inline=True)
-                    embed.add_field(name='Price', value='£' + str(self.price.amount), inline=True)
-                    embed.add_field(name='Type', value=self.listing_type, inline=True)
-                    embed.add_field(name=":date: Time of Alert", value=date_time_obj.strftime("%d/%m/%Y  %H:%M %Z"),
-                                    inline=True)
-                    embed.add_field(name=':date: Start Time', value=start_time.strftime("%d/%m/%Y  %H:%M %Z"),
-                                    inline=True)
-                    embed.add_field(name=':date: End Time', value=end_time.strftime("%d/%m/%Y  %H:%M %Z"), inline=True)
-                    embed.add_field(name='URL', value=self.url, inline=True)
-                    embed.set_image(url=self.image)
-
-                    # Send it
-                    webhook.send(embed=embed)
-
-                elif notification_route.type == 'EMA':
-                    me = 'alert@ebayflipper.com'
-                    to = notification_route.webhook
-                    # Email notification
-                    msg = MIMEText(self.url)
-                    msg['Subject'] = 'New Item Alert - {}'.format(self.name)
-                    msg['From'] = me
-                    msg['To'] = to
-
-                    # Send the message via our own SMTP server, but don't include the
-                    # envelope header.
-                    s = smtplib.SMTP('localhost')
-                    s.sendmail(me, [to], msg.as_string())
-                    s.quit()
-
-                else:
-                    # TODO: Slack webhook parse
-                    pass
+                alert_dispatcher.dispatch(self, notification_route)
+                metrics.increment('alerts_queued', route=notification_route.pk)
 
         except ConnectionError as e:
             db_logger.exception("{}  :  Exception in send_alert: {}".format(datetime.datetime.now(), e))
@@ -481,3 +553,148 @@ class EbayItem(models.Model):
                 print(e.response.dict())
             except:
                 pass
+
+    def discord_embed(self, notification_route: NotificationRoute, alerted_at=None):
+        """ Build the discord embed for this item, alerted_at is when the alert was raised. """
+        date_time_str = alerted_at or datetime.datetime.now()
+        if type(date_time_str) == str:
+            date_time_obj = datetime.datetime.strptime(date_time_str, "%Y-%m-%dT%H:%M:%S.%f%z")
+        else:
+            date_time_obj = date_time_str
+
+        start_time = utc_to_local(self.start_time)
+        end_time = utc_to_local(self.end_time)
+
+        # Build the embed
+        if notification_route.include_item_description:
+            embed = discord.Embed(title=self.name, description=self.description, color=0x00ff00)
+        else:
+            embed = discord.Embed(title=self.name, color=0x00ff00)
+        # embed.add_field(name='Description', value=self.description, inline=True)
+        embed.add_field(name='Price', value='£' + str(self.price.amount), inline=True)
+        embed.add_field(name='Type', value=self.listing_type, inline=True)
+        embed.add_field(name=":date: Time of Alert", value=date_time_obj.strftime("%d/%m/%Y  %H:%M %Z"),
+                        inline=True)
+        embed.add_field(name=':date: Start Time', value=start_time.strftime("%d/%m/%Y  %H:%M %Z"),
+                        inline=True)
+        embed.add_field(name=':date: End Time', value=end_time.strftime("%d/%m/%Y  %H:%M %Z"), inline=True)
+        embed.add_field(name='URL', value=self.url, inline=True)
+        embed.set_image(url=self.image)
+        return embed
+
+    def deliver_alert(self, notification_route: NotificationRoute, connection=None, alerted_at=None):
+        """ Send this item's alert to one notification route, raising if it fails so the dispatcher can retry.
+
+        connection is a reusable connection for the route from NotificationRoute.connect(), one is opened and closed
+        again if it isn't given.
+        """
+        if connection is None:
+            connection = notification_route.connect()
+            try:
+                return self.deliver_alert(notification_route, connection, alerted_at)
+            finally:
+                notification_route.disconnect(connection)
+
+        if notification_route.type == 'DIS':
+            # Send it
+            connection.send(embed=self.discord_embed(notification_route, alerted_at))
+
+        elif notification_route.type == 'EMA':
+            me = settings.ALERT_EMAIL_FROM
+            to = notification_route.webhook
+            # Email notification
+            msg = MIMEText(self.url)
+            msg['Subject'] = 'New Item Alert - {}'.format(self.name)
+            msg['From'] = me
+            msg['To'] = to
+
+            # Send the message via our own SMTP server, but don't include the
+            # envelope header.
+            connection.sendmail(me, [to], msg.as_string())
+
+        else:
+            # TODO: Slack webhook parse
+            pass
+
+
+class ScanWorker(models.Model):
+    """ A process scanning a share of the wanted items, see alerts.leasing. Seen in the last lease duration if alive. """
+
+    DISPLAY_FIELDS = ['name', 'host', 'started_at', 'last_seen']
+
+    name = models.CharField(max_length=255, unique=True)  # host:pid
+    host = models.CharField(max_length=255, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(db_index=True)
+
+    # MANAGERS
+    objects = models.Manager()
+
+    # META CLASS
+    class Meta:
+        verbose_name = 'Scan Worker'
+        verbose_name_plural = 'Scan Workers'
+
+    # TO STRING METHOD
+    def __str__(self):
+        return self.name
+
+
+class ScanJob(models.Model):
+    """ An on demand scan of some wanted items (or all of them), queued by the scan view and run in the background. """
+
+    DISPLAY_FIELDS = ['id', 'status', 'wanted_item_ids', 'searches', 'searches_done', 'items_found', 'insert_date',
+                      'started_at', 'finished_at']
+
+    STATUS_CHOICES = [
+        ('QUE', 'Queued'),
+        ('RUN', 'Running'),
+        ('DON', 'Done'),
+        ('PAR', 'Partial'),  # done, but some wanted items were left to the scan workers holding them
+        ('ERR', 'Failed'),
+    ]
+    FINISHED = ('DON', 'PAR', 'ERR')
+
+    status = models.CharField(max_length=3, choices=STATUS_CHOICES, default='QUE')
+    wanted_item_ids = models.TextField(blank=True)  # comma separated, every wanted item if blank
+    skipped_wanted_item_ids = models.TextField(blank=True)  # comma separated, leased by a scan worker so not scanned
+    searches = models.IntegerField(default=0)  # searches planned for the wanted items
+    searches_done = models.IntegerField(default=0)
+    items_found = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL,
+                                   related_name='scan_jobs')
+    insert_date = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True, default=None)
+    finished_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    # MANAGERS
+    objects = models.Manager()
+
+    # META CLASS
+    class Meta:
+        verbose_name = 'Scan Job'
+        verbose_name_plural = 'Scan Jobs'
+
+    # TO STRING METHOD
+    def __str__(self):
+        return 'Scan job {} ({})'.format(self.pk, self.get_status_display())
+
+    # OTHER METHODS
+    def wanted_items(self):
+        """ The wanted items to scan, the ones asked for or every one that isn't deleted. """
+        wanted_items = WantedItem.objects.filter(deleted=False).prefetch_related('notifications')
+        if self.wanted_item_ids:
+            wanted_items = wanted_items.filter(pk__in=[int(pk) for pk in self.wanted_item_ids.split(',')])
+        return list(wanted_items)
+
+    def progress(self):
+        return {
+            'job_id': self.pk,
+            'status': self.get_status_display().lower(),
+            'searches': self.searches,
+            'searches_done': self.searches_done,
+            'items_found': self.items_found,
+            'skipped': [int(pk) for pk in self.skipped_wanted_item_ids.split(',') if pk],
+            'error': self.error,
+        }
@@ -0,0 +1,258 @@
+import atexit
+import datetime
+import logging
+import queue
+import threading
+import time
+
+import discord
+from django.conf import settings
+from django.db import connection as db_connection
+
+from .metrics import metrics
+
+db_logger = logging.getLogger('db')
+
+# Queued on a route to send its digest now, whether or not the window has closed.
+SEND_DIGEST = object()
+
+
+class RouteWorker:
+    """ Delivers the alerts queued for one notification route, in order, from its own thread.
+
+    The route's connection (a discord webhook with its own HTTP session, or an SMTP connection) is kept between alerts
+    and only reopened when a send fails or the route is edited. A slow or rate limited route only delays its own queue.
+    Email routes with digest_minutes set collect their alerts and send them as one message when the window closes.
+    """
+
+    def __init__(self, route_id):
+        self.route_id = route_id
+        self.name = ''
+        self.queue = queue.Queue()
+        self.sent = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._route = None
+        self._connection = None
+        self._digest = []  # (item, route, queued at)
+        self._digest_due = None
+        self._thread = threading.Thread(target=self._run, name='alerts-route-{}'.format(route_id), daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                alert = self.queue.get(timeout=self._digest_wait())
+            except queue.Empty:
+                self._send_digest()
+                continue
+
+            if alert is SEND_DIGEST:
+                if self._digest:
+                    self._send_digest()
+                self.queue.task_done()
+                continue
+
+            item, route, alerted_at, queued_at = alert
+
+            if route.type == 'EMA' and route.digest_minutes:
+                # Hold the alert for the route's digest, the window starts with its first alert.
+                if not self._digest:
+                    self._digest_due = time.monotonic() + route.digest_minutes * 60
+                self._digest.append((item, route, queued_at))
+                self.queue.task_done()
+                continue
+
+            self._send(route, lambda connection: item.deliver_alert(route, connection, alerted_at), [queued_at])
+            self.queue.task_done()
+            if self._digest and time.monotonic() >= self._digest_due:
+                self._send_digest()
+
+    def _digest_wait(self):
+        if not self._digest:
+            return None
+        return max(0, self._digest_due - time.monotonic())
+
+    def _send_digest(self):
+        digest, self._digest = self._digest, []
+        items = [item for item, route, queued_at in digest]
+        route = digest[-1][1]
+        self._send(route, lambda connection: route.deliver_digest(items, connection),
+                   [queued_at for item, route, queued_at in digest])
+
+    def _send(self, route, deliver, queued_at):
+        try:
+            self._retry(route, deliver)
+            self.sent += len(queued_at)
+            metrics.increment('alerts_sent', len(queued_at), route=route.pk)
+        except Exception as e:
+            self.failed += len(queued_at)
+            metrics.increment('alerts_failed', len(queued_at), route=route.pk)
+            db_logger.exception("{}  :  Exception in alert delivery to {}: {}".format(datetime.datetime.now(),
+                                                                                      route, e))
+        finally:
+            now = time.monotonic()
+            for queued in queued_at:
+                self.total_latency += now - queued
+                self.max_latency = max(self.max_latency, now - queued)
+                metrics.observe('alert_delivery', now - queued, route=route.pk)
+            # The thread keeps its own database connection for logging, don't let it go stale.
+            db_connection.close_if_unusable_or_obsolete()
+
+    def _retry(self, route, deliver):
+        attempt = 0
+        while True:
+            try:
+                deliver(self._connect(route))
+                return
+            except (discord.Forbidden, discord.NotFound):
+                # The webhook has been deleted or revoked, retrying won't help.
+                self._disconnect()
+                raise
+            except discord.HTTPException as e:
+                if attempt >= settings.ALERT_MAX_RETRIES:
+                    raise
+                if e.status == 429:
+                    # Rate limited, wait as long as Discord asks rather than backing off blindly.
+                    wait = retry_after(e.response) or backoff(attempt)
+                else:
+                    self._disconnect()
+                    wait = backoff(attempt)
+            except Exception:
+                if attempt >= settings.ALERT_MAX_RETRIES:
+                    self._disconnect()
+                    raise
+                self._disconnect()
+                wait = backoff(attempt)
+            attempt += 1
+            time.sleep(wait)
+
+    def _connect(self, route):
+        # Reconnect if the route has been edited since the connection was opened.
+        if self._route is not None and (self._route.type, self._route.webhook) != (route.type, route.webhook):
+            self._disconnect()
+        if self._connection is None:
+            self._connection = route.connect()
+            self._route = route
+        return self._connection
+
+    def _disconnect(self):
+        if self._connection is not None:
+            self._route.disconnect(self._connection)
+        self._connection = None
+        self._route = None
+
+    def stats(self):
+        delivered = self.sent + self.failed
+        return {
+            'name': self.name,
+            'queued': self.queue.unfinished_tasks,
+            'sent': self.sent,
+            'failed': self.failed,
+            'digest': len(self._digest),
+            'avg_latency': self.total_latency / delivered if delivered else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+class AlertDispatcher:
+    """ Hands alerts off to a queue per notification route so the scan never waits on delivery. """
+
+    def __init__(self):
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def dispatch(self, item, route):
+        """ Queue item's alert for route, the time of the alert is now rather than when it is delivered. """
+        with self._lock:
+            worker = self._workers.get(route.pk)
+            if worker is None:
+                if not self._workers:
+                    # The route threads are daemons, without this whatever is still queued at exit is never sent.
+                    # Registered now rather than at import so it runs before the database log handler stops.
+                    atexit.register(self.drain)
+                worker = self._workers[route.pk] = RouteWorker(route.pk)
+        worker.name = route.name
+        worker.queue.put((item, route, datetime.datetime.now(), time.monotonic()))
+
+    def pending(self):
+        return sum(worker.queue.unfinished_tasks for worker in list(self._workers.values()))
+
+    def wait_until_empty(self, timeout=None):
+        """ Block until every queued alert has been delivered or given up on, returns False on timeout. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def drain(self, timeout=None):
+        """ Deliver everything queued and every digest still collecting, for a process that is about to exit.
+
+        Returns False if it took longer than timeout (ALERT_DRAIN_TIMEOUT by default), what's left is lost.
+        """
+        timeout = settings.ALERT_DRAIN_TIMEOUT if timeout is None else timeout
+        for worker in list(self._workers.values()):
+            worker.queue.put(SEND_DIGEST)
+        if self.wait_until_empty(timeout):
+            return True
+        db_logger.warning("{}  :  Gave up waiting for {} queued alerts after {}s".format(datetime.datetime.now(),
+                                                                                       self.pending(), timeout))
+        return False
+
+    def stats(self):
+        """ Queue depth, delivery counts and latency (seconds from dispatch to delivery) for each route. """
+        return {route_id: worker.stats() for route_id, worker in list(self._workers.items())}
+
+
+class RouteCache:
+    """ Each wanted item's notification routes, kept between scan cycles so alerting doesn't query them.
+
+    Every cycle primes it from the wanted items it loaded with prefetch_related('notifications'), which also picks up
+    edits made by other processes. Edits in this process invalidate it straight away through the signals in
+    signals.py.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def prime(self, wanted_items):
+        """ Replace the cache with the routes prefetched on wanted_items. """
+        routes = {wanted_item.pk: list(wanted_item.notifications.all()) for wanted_item in wanted_items}
+        with self._lock:
+            self._routes = routes
+
+    def routes(self, wanted_item):
+        routes = self._routes.get(wanted_item.pk)
+        if routes is None:
+            routes = list(wanted_item.notifications.all())
+            with self._lock:
+                self._routes[wanted_item.pk] = routes
+        return routes
+
+    def invalidate(self, wanted_item_ids=None):
+        """ Forget the routes of the given wanted items, or of all of them. """
+        with self._lock:
+            if wanted_item_ids is None:
+                self._routes = {}
+            else:
+                for wanted_item_id in wanted_item_ids:
+                    self._routes.pop(wanted_item_id, None)
+
+
+def backoff(attempt):
+    return settings.ALERT_RETRY_BACKOFF * 2 ** attempt
+
+
+def retry_after(response):
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+alert_dispatcher = AlertDispatcher()
+route_cache = RouteCache()
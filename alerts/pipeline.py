@@ -0,0 +1,214 @@
+import threading
+import time
+
+from djmoney.money import Money
+
+
+class FilterStage:
+    """ One check in the filter pipeline, run over a batch of items at a time.
+
+    cost is the stage's rough relative cost per item. Stages that need the item's details (needs_details) only run
+    once those have been fetched. Stages with a mask can also check search results as columns, before EbayItems are
+    built for them. Each stage counts the items it checked and rejected, the items it couldn't check
+    (errors) and the time it spent.
+    """
+    name = ''
+    cost = 1
+    needs_details = False
+    columnar = False
+
+    def __init__(self):
+        self.checked = 0
+        self.rejected = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def check(self, item, wanted_item, context):
+        """ True if item passes, False if it is rejected, None if it couldn't be checked. """
+        raise NotImplementedError
+
+    def mask(self, columns, wanted_item, context):
+        """ Columnar check, a mask of the results in columns that pass. Only for stages with columnar set. """
+        raise NotImplementedError
+
+    def record(self, checked, rejected, errors, seconds):
+        with self._lock:
+            self.checked += checked
+            self.rejected += rejected
+            self.errors += errors
+            self.seconds += seconds
+
+    def run(self, items, wanted_item, context):
+        """ Check a batch of items, returns (passed, rejected, errors). """
+        started = time.perf_counter()
+        passed, rejected, errors = [], [], []
+        for item in items:
+            result = self.check(item, wanted_item, context)
+            if result is None:
+                errors.append(item)
+            elif result:
+                passed.append(item)
+            else:
+                rejected.append(item)
+        self.record(len(items), len(rejected), len(errors), time.perf_counter() - started)
+        return passed, rejected, errors
+
+    def rank(self):
+        """ Cheap stages that reject a lot go first, using the rejection rate seen so far (smoothed). """
+        return self.cost / ((self.rejected + 1) / (self.checked + 2))
+
+    def stats(self):
+        return {'checked': self.checked, 'rejected': self.rejected, 'errors': self.errors, 'seconds': self.seconds}
+
+
+class FeedbackStage(FilterStage):
+    """ Filter out ebay power sellers (feedback > 1000ish) and new sellers. """
+    name = 'feedback'
+    cost = 1
+    columnar = True
+
+    def check(self, item, wanted_item, context):
+        return wanted_item.min_feedback <= item.seller_feedback <= wanted_item.max_feedback
+
+    def mask(self, columns, wanted_item, context):
+        return columns.between('feedback', wanted_item.min_feedback, wanted_item.max_feedback)
+
+
+class PriceStage(FilterStage):
+    name = 'price'
+    cost = 1
+    columnar = True
+
+    def check(self, item, wanted_item, context):
+        return wanted_item.min_price.amount <= item.price.amount <= wanted_item.max_price.amount
+
+    def mask(self, columns, wanted_item, context):
+        return columns.between('prices', float(wanted_item.min_price.amount), float(wanted_item.max_price.amount))
+
+
+class CurrentPriceStage(FilterStage):
+    """ The price check again at the price in the item's details, an auction may have been bid up since the search
+    found it. The item's price is updated to the current one. """
+    name = 'current_price'
+    cost = 1
+    needs_details = True
+
+    def check(self, item, wanted_item, context):
+        details = context['details'].get(item.item_id)
+        if details is None:
+            return None
+        current = (details.get('ConvertedCurrentPrice') or {}).get('value')
+        if current is not None:
+            item.price = Money(current, item.price.currency)
+        return wanted_item.min_price.amount <= item.price.amount <= wanted_item.max_price.amount
+
+
+class TimingStage(FilterStage):
+    """ Buy it now listings must be recent. Auctions must be ending soon, unless the context says they are being
+    scheduled (check_ending_soon False). """
+    name = 'timing'
+    cost = 2
+    columnar = True
+
+    def check(self, item, wanted_item, context):
+        if item.auction_or_fixed == 'F':
+            return bool(item.is_recent(wanted_item.buy_it_now_time))
+        if item.auction_or_fixed == 'A' and context.get('check_ending_soon', True):
+            return bool(item.is_ending_soon(wanted_item.auction_alert_time))
+        return True
+
+    def mask(self, columns, wanted_item, context):
+        # The same whole minute comparisons as is_recent and is_ending_soon.
+        now = time.time()
+        recent = columns.greater('start_times', now - wanted_item.buy_it_now_time * 60)
+        if context.get('check_ending_soon', True):
+            ending = columns.less('end_times', now + wanted_item.auction_alert_time * 60)
+        else:
+            ending = columns.everything()
+        return columns.any_of(columns.all_of(columns.fixed, recent),
+                              columns.all_of(columns.negate(columns.fixed), ending))
+
+
+class TitleStage(FilterStage):
+    """ Check the title against our anti keywords to filter out junk. """
+    name = 'title'
+    cost = 5
+
+    def check(self, item, wanted_item, context):
+        return bool(item.filter_anti_keywords(item.name, wanted_item.anti_keyword_matcher))
+
+
+class DescriptionStage(FilterStage):
+    """ Check the full description against our anti keywords, items whose details couldn't be fetched are errors. """
+    name = 'description'
+    cost = 100
+    needs_details = True
+
+    def check(self, item, wanted_item, context):
+        details = context['details'].get(item.item_id)
+        if details is None:
+            return None
+        return bool(item.passes_description_filter(wanted_item, details))
+
+
+class FilterPipeline:
+    """ Runs the filter stages over a batch of items, each stage only sees the items every earlier stage passed.
+
+    The stages that only need the search result run first, in rank order, so a listing rejected by a cheap check
+    never costs a detail fetch or a description conversion.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def ordered(self, needs_details):
+        return sorted((stage for stage in self.stages if stage.needs_details == needs_details),
+                      key=lambda stage: stage.rank())
+
+    def _run(self, stages, items, wanted_item, context):
+        rejected, errors = [], []
+        for stage in stages:
+            if not items:
+                break
+            items, stage_rejected, stage_errors = stage.run(items, wanted_item, context)
+            rejected += stage_rejected
+            errors += stage_errors
+        return items, rejected, errors
+
+    def columns(self, columns, wanted_item, check_ending_soon=True, alive=None):
+        """ Run the columnar stages over search results, returns the mask of the results that pass.
+
+        alive is a mask of the results to check, all of them if it isn't given.
+        """
+        context = {'check_ending_soon': check_ending_soon}
+        alive = columns.everything() if alive is None else alive
+        for stage in self.ordered(False):
+            if not stage.columnar:
+                continue
+            started = time.perf_counter()
+            checked = columns.count(alive)
+            alive = columns.all_of(alive, stage.mask(columns, wanted_item, context))
+            stage.record(checked, checked - columns.count(alive), 0, time.perf_counter() - started)
+        return alive
+
+    def quick(self, items, wanted_item, check_ending_soon=True, columns_checked=False):
+        """ Run the stages that don't need details, returns (passed, rejected).
+
+        With columns_checked the items have already been through columns() and only the other stages run.
+        """
+        stages = [stage for stage in self.ordered(False) if not (columns_checked and stage.columnar)]
+        passed, rejected, errors = self._run(stages, items, wanted_item, {'check_ending_soon': check_ending_soon})
+        # A quick stage that can't decide rejects, it has everything the item will ever have.
+        return passed, rejected + errors
+
+    def detailed(self, items, wanted_item, details: dict):
+        """ Run the stages that need the details fetched for items, returns (passed, rejected, errors). """
+        return self._run(self.ordered(True), items, wanted_item, {'details': details})
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+
+filter_pipeline = FilterPipeline([FeedbackStage(), PriceStage(), TimingStage(), TitleStage(), CurrentPriceStage(),
+                                  DescriptionStage()])
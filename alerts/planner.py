@@ -0,0 +1,78 @@
+from django.conf import settings
+
+from .models import WantedItem
+
+
+class SearchGroup:
+    """ Wanted items that differ only in the filters we can apply ourselves, searched for with one set of API calls.
+
+    proxy is an unsaved WantedItem with the group's keywords and location and the widest of its members' price,
+    feedback and condition bounds, paging as far back (and for auctions as far forward) as its most demanding member
+    needs. fan_out hands each member the results that its own search would have returned. A group of one searches with
+    the wanted item itself.
+    """
+
+    def __init__(self, members):
+        self.members = members
+        # Decided once so the members updated afterwards are the ones the auction search was for.
+        self.auction_members = [member for member in members if member.auction_search_due()]
+        self.proxy = members[0] if len(members) == 1 else self.build_proxy()
+
+    def __str__(self):
+        return ' + '.join(str(member) for member in self.members)
+
+    @property
+    def pk(self):
+        return self.members[0].pk
+
+    def build_proxy(self):
+        members = self.members
+        first = members[0]
+        conditions = {member.condition or None for member in members}
+        due = self.auction_members
+        return WantedItem(
+            name=' + '.join(str(member) for member in members),
+            keywords=first.keywords,
+            located_in=first.located_in,
+            min_price=min((member.min_price for member in members), key=lambda price: price.amount),
+            max_price=max((member.max_price for member in members), key=lambda price: price.amount),
+            min_feedback=min(member.min_feedback for member in members),
+            condition=conditions.pop() if len(conditions) == 1 else None,
+            buy_it_now_time=max(member.buy_it_now_time for member in members),
+            auction_alert_time=max(member.auction_alert_time for member in (due or members)),
+            # Page back to the oldest listing any member still needs.
+            last_seen_start_time=min(member.search_cutoff() for member in members),
+            # Search auctions as soon as any member is due.
+            last_auction_search=None if due else max(member.last_auction_search for member in members),
+        )
+
+    def fan_out(self, buy_it_now_items, auction_items):
+        """ Yield (wanted_item, buy_it_now_items, auction_items) with each member's share of the group's results. """
+        if len(self.members) == 1:
+            yield self.proxy, buy_it_now_items, auction_items
+            return
+
+        for member in self.members:
+            member_buy_it_now = member.new_since_last_scan(
+                [item for item in buy_it_now_items if member.matches_search_result(item)])
+            member_auctions = []
+            if member in self.auction_members:
+                member_auctions = [item for item in auction_items if member.matches_search_result(item)]
+            yield member, member_buy_it_now, member_auctions
+
+
+def search_key(wanted_item: WantedItem):
+    """ Wanted items with the same key can share a search, eBay matches keywords case insensitively. """
+    return (' '.join(wanted_item.keywords.lower().split()), wanted_item.located_in,
+            str(wanted_item.max_price.currency), str(wanted_item.min_price.currency))
+
+
+def plan_searches(wanted_items):
+    """ Group wanted items into SearchGroups, one per search, in the order their first member was given. """
+    if not settings.SEARCH_COALESCE:
+        return [SearchGroup([wanted_item]) for wanted_item in wanted_items]
+
+    groups = {}
+    for wanted_item in wanted_items:
+        groups.setdefault(search_key(wanted_item), []).append(wanted_item)
+    return [SearchGroup(members) for members in groups.values()]
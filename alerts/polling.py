@@ -0,0 +1,89 @@
+import datetime
+from datetime import timezone
+
+from django.conf import settings
+
+from .models import WantedItem
+
+
+class PollScheduler:
+    """ Decides how often each wanted item is searched, from the rate its new buy it now listings arrive at.
+
+    arrival_rate is an exponentially weighted moving average of new listings per minute. A wanted item is polled often
+    enough to expect POLL_TARGET_NEW new listings per poll, between POLL_MIN_INTERVAL and POLL_MAX_INTERVAL seconds
+    and never so rarely that listings age past its buy_it_now_time between polls. When the searches that would make
+    need more than SEARCH_CALL_BUDGET calls a minute every interval is stretched by the same factor, up to
+    POLL_MAX_INTERVAL.
+    """
+
+    def __init__(self):
+        self.budget_factor = 1.0
+
+    @staticmethod
+    def bounds(wanted_item: WantedItem):
+        # Leave a fifth of the buy it now window for the scan itself, and poll at least as often as auctions are
+        # searched for, auctions are only searched for when the wanted item is polled.
+        longest = min(settings.POLL_MAX_INTERVAL, int(wanted_item.buy_it_now_time * 60 * 0.8),
+                      settings.AUCTION_SEARCH_INTERVAL * 60)
+        return settings.POLL_MIN_INTERVAL, max(settings.POLL_MIN_INTERVAL, longest)
+
+    def base_interval(self, wanted_item: WantedItem):
+        """ Seconds between polls for the wanted item's arrival rate, before the budget is applied. """
+        shortest, longest = self.bounds(wanted_item)
+        if wanted_item.last_polled_at is None:
+            # Never polled, there's no rate to go on yet so start at the old once a minute.
+            return min(longest, max(shortest, 60))
+        if wanted_item.arrival_rate <= 0:
+            return longest
+        return min(longest, max(shortest, 60 * settings.POLL_TARGET_NEW / wanted_item.arrival_rate))
+
+    def plan(self, groups, now=None):
+        """ Update the budget factor for groups, a list of SearchGroups, and return the members of the due ones.
+
+        Every member of a group is searched when any of them is due, they share the search anyway.
+        """
+        now = now or datetime.datetime.now(timezone.utc)
+        demand = 0.0
+        due = []
+        for group in groups:
+            # Calls a minute: a buy it now search per poll and an auction search per AUCTION_SEARCH_INTERVAL.
+            demand += 60 / min(self.base_interval(member) for member in group.members)
+            demand += 1 / settings.AUCTION_SEARCH_INTERVAL
+            if any(member.next_poll_at is None or member.next_poll_at <= now for member in group.members):
+                due += group.members
+        for member in due:
+            # Held back until the poll is recorded, so a search that fails or times out isn't started again while
+            # it may still be running.
+            member.next_poll_at = now + datetime.timedelta(seconds=max(settings.POLL_MIN_INTERVAL,
+                                                                       settings.SCAN_ITEM_TIMEOUT))
+        self.budget_factor = max(1.0, demand / settings.SEARCH_CALL_BUDGET)
+        return due
+
+    def record(self, wanted_item: WantedItem, new_listings, polled_at=None):
+        """ Fields to update on wanted_item after a poll that found new_listings new buy it now listings. """
+        polled_at = polled_at or datetime.datetime.now(timezone.utc)
+        arrival_rate = wanted_item.arrival_rate
+        if wanted_item.last_polled_at is not None:
+            minutes = max((polled_at - wanted_item.last_polled_at).total_seconds() / 60, 1 / 60)
+            alpha = settings.POLL_RATE_SMOOTHING
+            arrival_rate = alpha * (new_listings / minutes) + (1 - alpha) * arrival_rate
+
+        wanted_item.arrival_rate = arrival_rate
+        interval = int(min(settings.POLL_MAX_INTERVAL, self.base_interval(wanted_item) * self.budget_factor))
+        return {
+            'arrival_rate': arrival_rate,
+            'poll_interval': interval,
+            'last_polled_at': polled_at,
+            'next_poll_at': polled_at + datetime.timedelta(seconds=interval),
+        }
+
+    @staticmethod
+    def next_due(wanted_items):
+        """ When the next of wanted_items is due. """
+        times = [wanted_item.next_poll_at for wanted_item in wanted_items]
+        if not times or None in times:
+            return None
+        return min(times)
+
+
+poll_scheduler = PollScheduler()
@@ -0,0 +1,196 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import datetime
+import json
+import threading
+import time
+from datetime import timezone
+
+from django.conf import settings
+
+from .response_cache import VERB_HEADERS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Call priorities, lower goes first.
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+# Routine searches, every other call defaults to NORMAL.
+SEARCH_CALLS = {'findItemsAdvanced'}
+# The API each header in VERB_HEADERS belongs to.
+HEADER_APIS = dict(zip(VERB_HEADERS, ('Finding', 'Shopping')))
+
+_priority = contextvars.ContextVar('ebay_call_priority', default=None)
+
+
+class RateLimitError(ConnectionError):
+    """ An eBay call wasn't made because of the rate limit, handled wherever a failed call is. """
+
+
+class RateLimited(RateLimitError):
+    """ No token came free within the wait allowed. """
+
+
+class QuotaExceeded(RateLimitError):
+    """ The call's daily quota is used up, or all but the share reserved for more urgent calls. """
+
+
+@contextlib.contextmanager
+def priority(level):
+    """ Make the eBay calls in the block at priority level, including calls made by tasks and threads started with a
+    copy of the context. """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimiter:
+    """ Token bucket and daily quota per eBay API and call, shared by every thread and process on the machine.
+
+    RATE_LIMITS maps call names to their per_second rate, burst size and daily quota, calls that aren't in it aren't
+    limited. The buckets are kept in RATE_LIMIT_FILE and updated under an exclusive lock on it, so scan workers in
+    other processes draw from the same tokens and quota. Without fcntl (Windows) they are only shared by threads.
+    The file is only shared on one machine, so while RATE_LIMIT is on LeaseManager keeps the scan workers to one.
+
+    Priorities share the tokens and quota by holding some back: a LOW call (a search) must leave RATE_LIMIT_RESERVE
+    of the bucket and of the day's quota, NORMAL half that and HIGH (an auction about to end) can take everything.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}  # Without a file lock.
+        self.granted = collections.Counter()
+        self.rejected = collections.Counter()
+        self.waited = collections.defaultdict(float)
+
+    @staticmethod
+    def call(request):
+        """ (api, call name) of a prepared eBay request, or None if it can't tell. """
+        for header in VERB_HEADERS:
+            if header in request.headers:
+                return HEADER_APIS[header], request.headers[header]
+        return None
+
+    @staticmethod
+    def priority_of(call):
+        level = _priority.get()
+        if level is not None:
+            return level
+        return LOW if call in SEARCH_CALLS else NORMAL
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with self._lock:
+            if fcntl is None:
+                yield self._state
+                return
+            path = self.path or settings.RATE_LIMIT_FILE
+            with open(path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read() or '{}')
+                    except ValueError:
+                        state = {}
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def try_acquire(self, api, call, level=None):
+        """ Take a token for the call if one is free, returns 0 if it was taken or the seconds until one will be.
+
+        Raises QuotaExceeded if the day's quota has run out for calls of this priority.
+        """
+        limits = settings.RATE_LIMITS.get(call)
+        if not limits:
+            return 0
+        level = self.priority_of(call) if level is None else level
+        held_back = settings.RATE_LIMIT_RESERVE * level / LOW
+        key = '{}.{}'.format(api, call)
+        now = time.time()
+        # eBay's quotas run from midnight to midnight, counted here in UTC.
+        today = datetime.datetime.now(timezone.utc).date().isoformat()
+
+        with self._locked_state() as state:
+            bucket = state.get(key)
+            if bucket is None or bucket['day'] != today:
+                bucket = {'tokens': bucket['tokens'] if bucket else limits['burst'], 'updated': now, 'day': today,
+                          'used': 0}
+            bucket['tokens'] = min(limits['burst'],
+                                   bucket['tokens'] + (now - bucket['updated']) * limits['per_second'])
+            bucket['updated'] = now
+            state[key] = bucket
+
+            if bucket['used'] >= limits['daily'] * (1 - held_back):
+                self.rejected[key] += 1
+                raise QuotaExceeded("{} daily quota used, {} of {}".format(key, bucket['used'], limits['daily']))
+            floor = limits['burst'] * held_back
+            if bucket['tokens'] - 1 < floor:
+                return (floor + 1 - bucket['tokens']) / limits['per_second']
+            bucket['tokens'] -= 1
+            bucket['used'] += 1
+        self.granted[key] += 1
+        return 0
+
+    def acquire(self, request, timeout=None):
+        """ Wait for a token for request's call, raises RateLimited if none comes free within timeout seconds. """
+        call = self.call(request)
+        if call is None or not settings.RATE_LIMIT:
+            return
+        deadline = time.monotonic() + (timeout or settings.EBAY_API_TIMEOUT)
+        while True:
+            wait = self.try_acquire(*call)
+            if not wait:
+                return
+            self._wait(call, wait, deadline)
+            time.sleep(wait)
+
+    async def async_acquire(self, request, timeout=None):
+        """ acquire for the asyncio scan, waits without blocking the event loop. """
+        call = self.call(request)
+        if call is None or not settings.RATE_LIMIT:
+            return
+        deadline = time.monotonic() + (timeout or settings.EBAY_API_TIMEOUT)
+        while True:
+            wait = self.try_acquire(*call)
+            if not wait:
+                return
+            self._wait(call, wait, deadline)
+            await asyncio.sleep(wait)
+
+    def _wait(self, call, wait, deadline):
+        key = '{}.{}'.format(*call)
+        if time.monotonic() + wait > deadline:
+            self.rejected[key] += 1
+            raise RateLimited("No {} token within the timeout".format(key))
+        self.waited[key] += wait
+
+    def usage(self):
+        """ Calls made today per api.call by every process, from the shared state. """
+        today = datetime.datetime.now(timezone.utc).date().isoformat()
+        with self._locked_state() as state:
+            return {key: bucket['used'] for key, bucket in state.items() if bucket['day'] == today}
+
+    def stats(self):
+        """ Calls let through, refused and seconds spent waiting per api.call, by this process. """
+        keys = set(self.granted) | set(self.rejected) | set(self.waited)
+        return {key: {'granted': self.granted[key], 'rejected': self.rejected[key], 'waited': self.waited[key]}
+                for key in keys}
+
+
+rate_limiter = RateLimiter()
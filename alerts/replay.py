@@ -0,0 +1,280 @@
+import asyncio
+import datetime
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from datetime import timezone
+from xml.sax.saxutils import escape
+
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .response_cache import VERB_HEADERS
+
+FINDING_NAMESPACE = 'http://www.ebay.com/marketplace/search/v1/services'
+SHOPPING_NAMESPACE = 'urn:ebay:apis:eBLBaseComponents'
+CONDITIONS = (('1000', 'New'), ('1500', 'New other (see details)'), ('3000', 'Used'),
+              ('7000', 'For parts or not working'))
+WORDS = ('boxed', 'genuine', 'tested', 'working', 'original', 'bundle', 'rare', 'clean', 'black', 'silver', 'large',
+         'small', 'vintage', 'official', 'complete')
+
+
+def ebay_time(value: datetime.datetime):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def call_name(request):
+    for header in VERB_HEADERS:
+        if header in request.headers:
+            return request.headers[header]
+    return None
+
+
+def parse_request(body):
+    """ The fields of an ebaysdk XML request body, as a dict of tag to a list of texts. itemFilter values are keyed
+    by the filter's name. """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    fields = {}
+    for element in ElementTree.fromstring(body).iter():
+        tag = element.tag.split('}')[-1]
+        if tag == 'itemFilter':
+            name = element.find('{*}name')
+            value = element.find('{*}value')
+            if name is not None and value is not None:
+                fields.setdefault(name.text, []).append(value.text)
+        elif len(element) == 0 and element.text is not None:
+            fields.setdefault(tag, []).append(element.text)
+    return fields
+
+
+class Listing:
+    """ One generated listing, with what findItemsAdvanced and GetMultipleItems say about it. """
+
+    def __init__(self, item_id, keywords, listing_type, start_time, end_time, rng, anti_keyword=None,
+                 description_paragraphs=20):
+        self.item_id = item_id
+        self.listing_type = listing_type
+        self.start_time = start_time
+        self.end_time = end_time
+        self.price = round(rng.uniform(1, 150), 2)
+        self.feedback = rng.choice((0, 3, 12, 48, 150, 420, 980, 2500, 14000))
+        self.condition = rng.choice(CONDITIONS)
+        self.title = '{} {} {}'.format(keywords.title(), ' '.join(rng.sample(WORDS, 3)),
+                                       anti_keyword if anti_keyword and rng.random() < 0.3 else '').strip()
+        words = [' '.join(rng.choices(WORDS, k=12)) for _ in range(description_paragraphs)]
+        rows = ''.join('<tr><td><b>{}</b></td><td>{}</td></tr>'.format(rng.choice(WORDS), text) for text in words)
+        self.description = ('<div class="template"><style>.t {{ color: #333; }}</style><h2>{}</h2><p>{}</p>'
+                            '<table>{}</table><p>Thanks for looking, please check my other items.</p></div>').format(
+            self.title, anti_keyword or 'Please see the photos for condition.', rows)
+
+    def search_result(self):
+        return (
+            '<item><itemId>{id}</itemId><title>{title}</title><globalId>EBAY-GB</globalId>'
+            '<primaryCategory><categoryId>139971</categoryId><categoryName>Consoles</categoryName></primaryCategory>'
+            '<galleryURL>https://thumbs.ebaystatic.com/images/g/{id}/s-l140.jpg</galleryURL>'
+            '<viewItemURL>https://www.ebay.co.uk/itm/{id}</viewItemURL><location>London,United Kingdom</location>'
+            '<country>GB</country><shippingInfo><shippingType>Flat</shippingType><shipToLocations>GB</shipToLocations>'
+            '</shippingInfo><sellingStatus><currentPrice currencyId="GBP">{price}</currentPrice>'
+            '<convertedCurrentPrice currencyId="GBP">{price}</convertedCurrentPrice><sellingState>Active</sellingState>'
+            '</sellingStatus><listingInfo><bestOfferEnabled>false</bestOfferEnabled>'
+            '<buyItNowAvailable>false</buyItNowAvailable><startTime>{start}</startTime><endTime>{end}</endTime>'
+            '<listingType>{type}</listingType><gift>false</gift></listingInfo><sellerInfo>'
+            '<sellerUserName>seller{feedback}</sellerUserName><feedbackScore>{feedback}</feedbackScore>'
+            '<positiveFeedbackPercent>99.6</positiveFeedbackPercent><topRatedSeller>false</topRatedSeller>'
+            '</sellerInfo><condition><conditionId>{condition}</conditionId>'
+            '<conditionDisplayName>{condition_name}</conditionDisplayName></condition></item>').format(
+            id=self.item_id, title=escape(self.title), price=self.price, start=ebay_time(self.start_time),
+            end=ebay_time(self.end_time), type=self.listing_type, feedback=self.feedback,
+            condition=self.condition[0], condition_name=escape(self.condition[1]))
+
+    def details(self):
+        return (
+            '<Item><Description>{description}</Description><ItemID>{id}</ItemID><EndTime>{end}</EndTime>'
+            '<ViewItemURLForNaturalSearch>https://www.ebay.co.uk/itm/{id}</ViewItemURLForNaturalSearch>'
+            '<ListingType>{type}</ListingType><Location>London</Location><PrimaryCategoryID>139971</PrimaryCategoryID>'
+            '<BidCount>0</BidCount><ConvertedCurrentPrice currencyID="GBP">{price}</ConvertedCurrentPrice>'
+            '<ListingStatus>Active</ListingStatus><Title>{title}</Title><Country>GB</Country>'
+            '<ConditionID>{condition}</ConditionID><ConditionDisplayName>{condition_name}</ConditionDisplayName>'
+            '</Item>').format(
+            description=escape(self.description), id=self.item_id, end=ebay_time(self.end_time),
+            type='Chinese' if self.listing_type == 'Auction' else 'FixedPriceItem', price=self.price,
+            title=escape(self.title), condition=self.condition[0], condition_name=escape(self.condition[1]))
+
+
+class ListingCatalogue:
+    """ The listings the replayed eBay knows about, per search keywords, growing by advance().
+
+    Each advance lists per_search new buy it now listings and auctions_per_search auctions for every search seen so
+    far. anti_match_rate of the listings mention anti_keyword in their description (and some in their title).
+    """
+
+    def __init__(self, per_search=20, auctions_per_search=2, anti_keyword='spares', anti_match_rate=0.2, seed=0,
+                 description_paragraphs=20):
+        self.per_search = per_search
+        self.auctions_per_search = auctions_per_search
+        self.anti_keyword = anti_keyword
+        self.anti_match_rate = anti_match_rate
+        self.description_paragraphs = description_paragraphs
+        self.rng = random.Random(seed)
+        self.listings = {}  # item id -> Listing
+        self.searches = {}  # keywords -> {'FixedPrice': [Listing], 'Auction': [Listing]}
+        self._ids = itertools.count(100000000000)
+        self._lock = threading.Lock()
+
+    def search(self, keywords):
+        keywords = ' '.join(keywords.lower().split())
+        with self._lock:
+            if keywords not in self.searches:
+                self.searches[keywords] = {'FixedPrice': [], 'Auction': []}
+                self._list(keywords)
+            return self.searches[keywords]
+
+    def advance(self):
+        with self._lock:
+            for keywords in self.searches:
+                self._list(keywords)
+
+    def _list(self, keywords):
+        now = datetime.datetime.now(timezone.utc)
+        search = self.searches[keywords]
+        # Newest first, the way findItemsAdvanced sorts StartTimeNewest.
+        listed = [self._listing(keywords, 'FixedPrice', now - datetime.timedelta(seconds=i),
+                                now + datetime.timedelta(days=30)) for i in range(self.per_search)]
+        search['FixedPrice'] = (listed + search['FixedPrice'])[:1000]
+        for _ in range(self.auctions_per_search):
+            search['Auction'].append(self._listing(keywords, 'Auction', now - datetime.timedelta(days=6),
+                                                   now + datetime.timedelta(minutes=self.rng.uniform(1, 120))))
+        search['Auction'] = sorted((listing for listing in search['Auction'] if listing.end_time > now),
+                                   key=lambda listing: listing.end_time)
+
+    def _listing(self, keywords, listing_type, start_time, end_time):
+        anti_keyword = self.anti_keyword if self.rng.random() < self.anti_match_rate else None
+        listing = Listing(next(self._ids), keywords, listing_type, start_time, end_time, self.rng, anti_keyword,
+                          self.description_paragraphs)
+        self.listings[str(listing.item_id)] = listing
+        return listing
+
+
+class ReplayAdapter(BaseAdapter):
+    """ requests transport that answers eBay calls locally, after latency seconds (plus up to jitter more).
+
+    With a fixtures directory, recorded response bodies (see RecordingAdapter) are replayed in turn for each call.
+    Otherwise findItemsAdvanced, GetSingleItem and GetMultipleItems are answered from a ListingCatalogue, honouring
+    the search's keywords, price and feedback filters and paging.
+    """
+
+    def __init__(self, catalogue: ListingCatalogue = None, latency=0.1, jitter=0.05, fixtures=None, seed=0):
+        super().__init__()
+        self.catalogue = catalogue or ListingCatalogue()
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.fixtures = self._load_fixtures(fixtures) if fixtures else None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_fixtures(directory):
+        fixtures = {}
+        for call in sorted(os.listdir(directory)):
+            path = os.path.join(directory, call)
+            if os.path.isdir(path):
+                bodies = []
+                for name in sorted(os.listdir(path)):
+                    with open(os.path.join(path, name), 'rb') as f:
+                        bodies.append(f.read())
+                fixtures[call] = itertools.cycle(bodies)
+        return fixtures
+
+    def delay(self):
+        with self._lock:
+            self.calls += 1
+            return self.latency + self.rng.uniform(0, self.jitter)
+
+    def send(self, request, **kwargs):
+        time.sleep(self.delay())
+        return self.respond(request)
+
+    async def async_send(self, request, timeout=None):
+        await asyncio.sleep(self.delay())
+        return self.respond(request)
+
+    def close(self):
+        pass
+
+    def respond(self, request):
+        call = call_name(request)
+        if self.fixtures is not None:
+            with self._lock:
+                content = next(self.fixtures[call]) if call in self.fixtures else None
+        elif call == 'findItemsAdvanced':
+            content = self.find_items_advanced(parse_request(request.body))
+        elif call in ('GetSingleItem', 'GetMultipleItems'):
+            content = self.get_items(call, parse_request(request.body))
+        else:
+            content = None
+
+        response = Response()
+        response.status_code = 200 if content is not None else 404
+        response.reason = 'OK' if content is not None else 'Not Found'
+        response._content = content or b''
+        response.headers = CaseInsensitiveDict({'Content-Type': 'text/xml;charset=UTF-8'})
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def find_items_advanced(self, fields):
+        listing_type = fields.get('ListingType', ['FixedPrice'])[0]
+        min_price = float(fields.get('MinPrice', [0])[0])
+        max_price = float(fields.get('MaxPrice', [0])[0]) or float('inf')
+        min_feedback = int(fields.get('FeedbackScoreMin', [0])[0])
+        entries = int(fields.get('entriesPerPage', [100])[0])
+        page = int(fields.get('pageNumber', [1])[0])
+
+        listings = [listing for listing in self.catalogue.search(fields['keywords'][0])[listing_type]
+                    if min_price <= listing.price <= max_price and listing.feedback >= min_feedback]
+        total_pages = max(1, -(-len(listings) // entries))
+        results = listings[(page - 1) * entries:page * entries]
+        return ('<?xml version="1.0" encoding="UTF-8"?><findItemsAdvancedResponse xmlns="{}"><ack>Success</ack>'
+                '<version>1.13.0</version><timestamp>{}</timestamp><searchResult count="{}">{}</searchResult>'
+                '<paginationOutput><pageNumber>{}</pageNumber><entriesPerPage>{}</entriesPerPage>'
+                '<totalPages>{}</totalPages><totalEntries>{}</totalEntries></paginationOutput>'
+                '</findItemsAdvancedResponse>').format(
+            FINDING_NAMESPACE, ebay_time(datetime.datetime.now(timezone.utc)), len(results),
+            ''.join(listing.search_result() for listing in results), page, entries, total_pages,
+            len(listings)).encode('utf-8')
+
+    def get_items(self, call, fields):
+        listings = [self.catalogue.listings[item_id] for item_id in fields.get('ItemID', [])
+                    if item_id in self.catalogue.listings]
+        return ('<?xml version="1.0" encoding="UTF-8"?><{call}Response xmlns="{}"><Timestamp>{}</Timestamp>'
+                '<Ack>Success</Ack><Build>E1119_CORE_APILW_19170841_R1</Build><Version>1119</Version>{}'
+                '</{call}Response>').format(
+            SHOPPING_NAMESPACE, ebay_time(datetime.datetime.now(timezone.utc)),
+            ''.join(listing.details() for listing in listings), call=call).encode('utf-8')
+
+
+class RecordingAdapter(HTTPAdapter):
+    """ HTTPAdapter that also saves every eBay response body under directory/<call name>/, for ReplayAdapter. """
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        call = call_name(request)
+        if call and response.status_code == 200:
+            path = os.path.join(self.directory, call)
+            os.makedirs(path, exist_ok=True)
+            name = '{:.6f}-{}.xml'.format(time.time(), hashlib.sha1(response.content).hexdigest()[:8])
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(response.content)
+        return response
@@ -0,0 +1,172 @@
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+# Headers the Finding and Shopping APIs name the call in.
+VERB_HEADERS = ('X-EBAY-SOA-OPERATION-NAME', 'X-EBAY-API-CALL-NAME')
+
+
+class MemoryBackend:
+    """ Least recently used responses, up to max_entries, for this process only. """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # key -> (expires, status, headers, content)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteBackend:
+    """ Responses kept in a SQLite file, shared by every process on the machine and kept across restarts. """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL, '
+                                   'status INTEGER, headers TEXT, content BLOB)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute('SELECT expires, status, headers, content FROM responses WHERE key = ?',
+                                         (key,)).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row[0], row[1], json.loads(row[2]), row[3]
+
+    def set(self, key, entry):
+        expires, status, headers, content = entry
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                           (key, expires, status, json.dumps(headers), content))
+        self._writes += 1
+        if self._writes % 500 == 0:
+            connection.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+
+
+class ResponseCache:
+    """ Cache of eBay API responses, keyed on the call, url and request body.
+
+    How long a response is kept depends on the call, RESPONSE_CACHE_TTLS maps call names to seconds and calls that
+    aren't in it are never cached. Failed calls aren't cached either. Hits and misses are counted per call.
+
+    With ADAPTIVE_POLLING searches are kept for less than POLL_MIN_INTERVAL whatever their TTL, so a wanted item's
+    next poll never gets its last poll's page back, finds nothing new and lowers its arrival rate.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._configured = False
+        self._lock = threading.Lock()
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    @property
+    def backend(self):
+        if not self._configured:
+            with self._lock:
+                if not self._configured:
+                    self._backend = None
+                    if settings.RESPONSE_CACHE == 'memory':
+                        self._backend = MemoryBackend(settings.RESPONSE_CACHE_SIZE)
+                    elif settings.RESPONSE_CACHE == 'sqlite':
+                        self._backend = SQLiteBackend(settings.RESPONSE_CACHE_FILE)
+                    self._configured = True
+        return self._backend
+
+    @staticmethod
+    def verb(request):
+        for header in VERB_HEADERS:
+            if header in request.headers:
+                return request.headers[header]
+        return None
+
+    @staticmethod
+    def key(request, verb):
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha1(body)
+        digest.update('{} {} {}'.format(request.method, request.url, verb).encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def ttl(verb):
+        """ Seconds verb's responses are cached for, 0 if they aren't. """
+        ttl = settings.RESPONSE_CACHE_TTLS.get(verb, 0)
+        if verb == 'findItemsAdvanced' and settings.ADAPTIVE_POLLING:
+            ttl = min(ttl, settings.POLL_MIN_INTERVAL - 1)
+        return max(ttl, 0)
+
+    def get(self, request):
+        """ The cached response to request, or None. """
+        verb = self.verb(request)
+        if self.backend is None or not self.ttl(verb):
+            return None
+        entry = self.backend.get(self.key(request, verb))
+        if entry is None:
+            self.misses[verb] += 1
+            return None
+        self.hits[verb] += 1
+
+        expires, status, headers, content = entry
+        response = Response()
+        response._content = content
+        response.status_code = status
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(headers)
+        response.url = request.url
+        response.request = request
+        response.encoding = 'utf-8'
+        return response
+
+    def set(self, request, response):
+        verb = self.verb(request)
+        ttl = self.ttl(verb)
+        if self.backend is None or not ttl:
+            return
+        # eBay reports failed calls in a successful HTTP response.
+        if response.status_code != 200 or b'>Failure<' in response.content:
+            return
+        self.backend.set(self.key(request, verb), (time.time() + ttl, response.status_code, dict(response.headers),
+                                                   response.content))
+
+    def stats(self):
+        """ Hits, misses and hit rate per call since the process started. """
+        stats = {}
+        for verb in set(self.hits) | set(self.misses):
+            hits, misses = self.hits[verb], self.misses[verb]
+            stats[verb] = {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses)}
+        return stats
+
+
+response_cache = ResponseCache()
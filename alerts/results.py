@@ -0,0 +1,94 @@
+import datetime
+from datetime import timezone
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def parse_timestamps(values):
+    """ eBay times ('2020-05-04T14:40:00.000Z') to unix timestamps, as an array with numpy and a list without. """
+    if numpy is not None:
+        return numpy.array([value[:-1] for value in values], dtype='datetime64[ms]').astype('int64') / 1000.0
+    return [datetime.datetime.fromisoformat(value[:-1]).replace(tzinfo=timezone.utc).timestamp() for value in values]
+
+
+class ResultColumns:
+    """ findItemsAdvanced results as columns, so the cheap filters check a whole search at once.
+
+    Each column has an entry per result. Masks are numpy boolean arrays when numpy is installed and lists of bools
+    when it isn't, build and combine them with the methods here rather than operators so both work.
+    """
+
+    def __init__(self, buy_it_now_items, auction_items):
+        self.results = list(buy_it_now_items) + list(auction_items)
+        results = self.results
+        self.item_ids = [int(item['itemId']) for item in results]
+        self.start_times = parse_timestamps([item['listingInfo']['startTime'] for item in results])
+        self.end_times = parse_timestamps([item['listingInfo']['endTime'] for item in results])
+        self.prices = self._array([float(item['sellingStatus']['currentPrice']['value']) for item in results], float)
+        self.feedback = self._array([int(item['sellerInfo']['feedbackScore']) for item in results], int)
+        self.fixed = self._array([True] * len(buy_it_now_items) + [False] * len(auction_items), bool)
+
+    def __len__(self):
+        return len(self.results)
+
+    @staticmethod
+    def _array(values, dtype=None):
+        return numpy.array(values, dtype=dtype) if numpy is not None else values
+
+    def everything(self):
+        return self._array([True] * len(self), bool)
+
+    def between(self, column, low, high):
+        values = getattr(self, column)
+        if numpy is not None:
+            return (values >= low) & (values <= high)
+        return [low <= value <= high for value in values]
+
+    def isin(self, column, values):
+        return self._array([value in values for value in getattr(self, column)], bool)
+
+    def greater(self, column, value):
+        values = getattr(self, column)
+        if numpy is not None:
+            return values > value
+        return [v > value for v in values]
+
+    def less(self, column, value):
+        values = getattr(self, column)
+        if numpy is not None:
+            return values < value
+        return [v < value for v in values]
+
+    def all_of(self, *masks):
+        if numpy is not None:
+            return numpy.logical_and.reduce(masks)
+        return [all(row) for row in zip(*masks)]
+
+    def any_of(self, *masks):
+        if numpy is not None:
+            return numpy.logical_or.reduce(masks)
+        return [any(row) for row in zip(*masks)]
+
+    def negate(self, mask):
+        if numpy is not None:
+            return ~mask
+        return [not row for row in mask]
+
+    @staticmethod
+    def count(mask):
+        return int(sum(mask))
+
+    def rows(self, mask):
+        """ Indexes of the rows mask is true for. """
+        if numpy is not None:
+            return numpy.flatnonzero(mask).tolist()
+        return [i for i, row in enumerate(mask) if row]
+
+    def start_time(self, row):
+        return datetime.datetime.fromtimestamp(float(self.start_times[row]), timezone.utc)
+
+    def end_time(self, row):
+        return datetime.datetime.fromtimestamp(float(self.end_times[row]), timezone.utc)
@@ -0,0 +1,76 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+
+from django.db import connection
+
+from .models import EbayItem
+
+db_logger = logging.getLogger('db')
+
+
+class AuctionAlertScheduler:
+    """ Fires auction alerts the moment each auction enters its wanted item's alert window.
+
+    Scheduled auctions are EbayItems with alert_at set, the database index on alert_at keeps them across restarts and
+    this keeps a heap of them in memory so a thread can sleep until exactly the next one is due. fire is called with
+    the item ids that are due and is responsible for claiming them, so several processes can share the table.
+    """
+
+    def __init__(self, fire):
+        self.fire = fire
+        self._heap = []  # (alert_at timestamp, item id)
+        self._scheduled = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def start(self):
+        """ Load the scheduled auctions and start the scheduler thread if it isn't running. """
+        self.load()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='auction-alerts', daemon=True)
+            self._thread.start()
+
+    def load(self):
+        """ Pick up auctions scheduled in the database, including by other processes. """
+        self.schedule_many(EbayItem.objects.filter(alert_at__isnull=False).values_list('item_id', 'alert_at'))
+
+    def schedule(self, item_id, alert_at):
+        self.schedule_many([(item_id, alert_at)])
+
+    def schedule_many(self, items):
+        with self._condition:
+            for item_id, alert_at in items:
+                if int(item_id) in self._scheduled:
+                    continue
+                self._scheduled.add(int(item_id))
+                heapq.heappush(self._heap, (alert_at.timestamp(), int(item_id)))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._condition.wait(timeout=self._heap[0][0] - time.time() if self._heap else None)
+                due = []
+                while self._heap and self._heap[0][0] <= time.time():
+                    alert_at, item_id = heapq.heappop(self._heap)
+                    self._scheduled.discard(item_id)
+                    due.append(item_id)
+            try:
+                self.fire(due)
+            except Exception as e:
+                db_logger.exception(e)
+            finally:
+                # The thread keeps its own connection, don't let it go stale between alerts.
+                connection.close_if_unusable_or_obsolete()
+
+
+def alert_time(item: EbayItem, auction_alert_time):
+    """ When an auction enters the alert window, auction_alert_time minutes before it ends. """
+    return item.end_time - datetime.timedelta(minutes=auction_alert_time)
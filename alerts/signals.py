@@ -0,0 +1,30 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import NotificationRoute, WantedItem
+from .notifications import route_cache
+
+
+@receiver([post_save, post_delete], sender=NotificationRoute)
+def notification_route_changed(sender, instance, **kwargs):
+    # A route can belong to any number of wanted items.
+    route_cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=WantedItem)
+def wanted_item_changed(sender, instance, **kwargs):
+    route_cache.invalidate([instance.pk])
+
+
+@receiver(m2m_changed, sender=WantedItem.notifications.through)
+def wanted_item_notifications_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        route_cache.invalidate([instance.pk])
+    elif pk_set is not None:
+        # Changed from the route's side, pk_set holds the wanted items.
+        route_cache.invalidate(pk_set)
+    else:
+        # post_clear from the route's side doesn't say which wanted items it had.
+        route_cache.invalidate()
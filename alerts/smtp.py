@@ -0,0 +1,98 @@
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+
+
+class SMTPPool:
+    """ Long lived SMTP connections shared by every email route, so a burst of alerts doesn't pay a TCP and SMTP
+    handshake per message.
+
+    Connections idle for longer than SMTP_IDLE_TIMEOUT are closed rather than reused, servers drop them. A send that
+    fails because the connection went away anyway is retried once on a fresh connection.
+    """
+
+    def __init__(self, host=None, port=None, size=None, idle_timeout=None):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # (last used, connection)
+        self._lock = threading.Lock()
+        self._available = None
+        self.opened = 0
+
+    def _settings(self):
+        if self._available is None:
+            self.host = self.host or settings.EMAIL_HOST
+            self.port = self.port or settings.EMAIL_PORT
+            self.size = self.size or settings.SMTP_POOL_SIZE
+            self.idle_timeout = self.idle_timeout if self.idle_timeout is not None else settings.SMTP_IDLE_TIMEOUT
+            self._available = threading.BoundedSemaphore(self.size)
+
+    def _open(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=settings.EMAIL_TIMEOUT)
+        if settings.EMAIL_USE_TLS:
+            connection.starttls()
+        if settings.EMAIL_HOST_USER:
+            connection.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+        self.opened += 1
+        return connection
+
+    def acquire(self):
+        self._settings()
+        self._available.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    last_used, connection = self._idle.pop()
+                if time.monotonic() - last_used < self.idle_timeout:
+                    return connection
+                self._close(connection)
+            return self._open()
+        except Exception:
+            self._available.release()
+            raise
+
+    def release(self, connection, broken=False):
+        if broken:
+            self._close(connection)
+        else:
+            with self._lock:
+                self._idle.append((time.monotonic(), connection))
+        self._available.release()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        for attempt in range(2):
+            connection = self.acquire()
+            try:
+                connection.sendmail(from_addr, to_addrs, msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self.release(connection, broken=True)
+                if attempt:
+                    raise
+            except Exception:
+                self.release(connection, broken=True)
+                raise
+            else:
+                self.release(connection)
+                return
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for last_used, connection in idle:
+            self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+
+smtp_pool = SMTPPool()
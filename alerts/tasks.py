@@ -1,13 +1,37 @@
 from background_task import background
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import WantedItem, NotificationRoute, EbayItem
+from django.db import connections
+from django.db.models import F
+from .models import WantedItem, NotificationRoute, EbayItem, ScanJob, parse_ebay_time
+from .cache import seen_item_cache
+from .writer import EbayItemWriter
+from .ebay_async import AsyncEbayClient
+from .scheduler import AuctionAlertScheduler, alert_time
+from .notifications import alert_dispatcher, route_cache
+from .planner import SearchGroup, plan_searches
+from .response_cache import response_cache
+from .descriptions import description_converter
+from .pipeline import filter_pipeline
+from .results import ResultColumns
+from .polling import poll_scheduler
+from .ratelimit import rate_limiter, priority, HIGH
+from .metrics import metrics
+from .log_handlers import prune_status_logs
+from .leasing import LeaseManager, leases, worker_name
 import discord
 
+import asyncio
+import contextvars
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from asgiref.sync import sync_to_async
 
 db_logger = logging.getLogger('db')
 
-from datetime import timezone, datetime
+from datetime import timezone, datetime, timedelta
 
 
 # @background(schedule=60)
@@ -38,85 +62,569 @@ def notify_user():
         webhook.send(embed=embed)
 
 
-# TODO: Later do multithreading
-def search_and_filter(wanted_item: WantedItem):
-    try:
+def find_already_found(items):
+    """ Return the ids of search results we have already found, asking the database only about ones not cached. """
+    end_times = {int(item['itemId']): item['listingInfo']['endTime'] for item in items}
+    already_found = seen_item_cache.seen(end_times)
+    in_database = EbayItem.existing_item_ids(set(end_times) - already_found)
+    seen_item_cache.add_many((item_id, parse_ebay_time(end_times[item_id])) for item_id in in_database)
+    return already_found | in_database
 
-        # Connect to API
-        wanted_item.connect()
 
-        # List to hold all Ebay Items
-        wanted_item.found_items = []
+# Shared by every scan worker so DETAIL_FETCH_WORKERS bounds the detail lookups in flight across the whole cycle.
+detail_executor = ThreadPoolExecutor(max_workers=settings.DETAIL_FETCH_WORKERS, thread_name_prefix='detail')
 
-        # Search for latest buy it now / fixed price deals
-        buy_it_now_items = wanted_item.search_buy_it_now()
-        for item in buy_it_now_items:
-            # Check if we have already found and sent this.
-            try:
-                already_found = EbayItem.objects.get(item_id=item['itemId'])
-            except Exception as e:
-                # New item, continue
-                # Prepare Item
-                time_started = datetime.strptime(item['listingInfo']['startTime'],
-                                                 '%Y-%m-%dT%H:%M:%S.%fZ')
-                time_started = time_started.replace(tzinfo=timezone.utc)
-                time_ending = datetime.strptime(item['listingInfo']['endTime'],
-                                                '%Y-%m-%dT%H:%M:%S.%fZ')
-                time_ending = time_ending.replace(tzinfo=timezone.utc)
-
-                ebay_item = EbayItem(item_id=item['itemId'], name=item['title'], description='',
-                                     start_time=time_started,
-                                     end_time=time_ending, listing_type=item['listingInfo']['listingType'],
-                                     auction_or_fixed='F',
-                                     price=item['sellingStatus']['currentPrice']['value'], image=item['galleryURL'],
-                                     url=item['viewItemURL'], seller_feedback=int(item['sellerInfo']['feedbackScore']))
-
-                wanted_item.found_items.append(ebay_item)
-
-        # Search for latest Auction Deals
-        auction_items = wanted_item.search_auctions()
-        for item in auction_items:
-            # Check if we have already found and sent this.
-            try:
-                already_found = EbayItem.objects.get(item_id=item['itemId'])
-            except Exception as e:
-                # New item, continue
-                # Prepare Item
-                time_started = datetime.strptime(item['listingInfo']['startTime'],
-                                                 '%Y-%m-%dT%H:%M:%S.%fZ')
-                time_started = time_started.replace(tzinfo=timezone.utc)
-                time_ending = datetime.strptime(item['listingInfo']['endTime'],
-                                                '%Y-%m-%dT%H:%M:%S.%fZ')
-                time_ending = time_ending.replace(tzinfo=timezone.utc)
-
-                ebay_item = EbayItem(item_id=item['itemId'], name=item['title'], description='',
-                                     start_time=time_started,
-                                     end_time=time_ending, listing_type=item['listingInfo']['listingType'],
-                                     auction_or_fixed='A',
-                                     price=item['sellingStatus']['currentPrice']['value'], image=item['galleryURL'],
-                                     url=item['viewItemURL'], seller_feedback=int(item['sellerInfo']['feedbackScore']))
-
-                wanted_item.found_items.append(ebay_item)
-
-        # Filter Auction and Fixed Price items and then send alerts to Discord
-        for item in wanted_item.found_items:
-            item: EbayItem
-
-            passed_filter = item.filter_item(wanted_item)
-
-            if passed_filter:
-                # Add to list of found items. (save to database)
-                item.save()
-
-                # Send alert to discord.
+
+def fetch_item_details(wanted_item: WantedItem, items):
+    """ Fetch the details of items in batches of DETAIL_FETCH_BATCH_SIZE, running the batches concurrently.
+
+    Returns a dict of item id to details, None if the lookup failed or eBay didn't return the item.
+    """
+    batch_size = min(settings.DETAIL_FETCH_BATCH_SIZE, 20)
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    # Each batch runs in a copy of this context so the calls keep the caller's rate limit priority.
+    futures = [(batch, detail_executor.submit(contextvars.copy_context().run, wanted_item.get_multiple_items,
+                                              [item.item_id for item in batch]))
+               for batch in batches]
+
+    details = {}
+    for batch, future in futures:
+        try:
+            found = future.result() or {}
+        except Exception as e:
+            db_logger.exception(e)
+            found = {}
+        for item in batch:
+            details[item.item_id] = found.get(str(item.item_id))
+    return details
+
+
+def flush_writer(writer: EbayItemWriter):
+    """ Save everything pending on the writer, returns the saved items for send_alerts. """
+    with metrics.span('save'):
+        return writer.flush()
+
+
+def send_alerts(saved_items):
+    """ Send alerts for newly saved items that passed their wanted item's filters, or schedule them if auctions. """
+    for item, wanted_item in saved_items:
+        metrics.increment('items_saved', wanted_item=wanted_item.pk)
+        if item.alert_at is not None:
+            auction_scheduler.schedule(item.item_id, item.alert_at)
+        elif item.passed_filter:
+            with metrics.span('alert', wanted_item=wanted_item.pk):
                 item.send_alert(wanted_item)
+
+
+def fire_auction_alerts(item_ids):
+    """ Alert scheduled auctions whose alert window has opened, once their descriptions pass the filters. """
+    now = datetime.now(timezone.utc)
+    due = {}
+    for item in EbayItem.objects.filter(item_id__in=item_ids, alert_at__isnull=False).select_related('wanted_item'):
+        # Claim the item so only one process alerts it.
+        if not EbayItem.objects.filter(pk=item.pk, alert_at=item.alert_at).update(alert_at=None):
+            continue
+        item.alert_at = None
+        wanted_item = item.wanted_item
+        if wanted_item is None or wanted_item.deleted or item.end_time <= now:
+            continue
+        due.setdefault(wanted_item.pk, (wanted_item, []))[1].append(item)
+
+    for wanted_item, items in due.values():
+        # These auctions are about to end, their details go ahead of the routine searches.
+        with priority(HIGH):
+            details = fetch_item_details(wanted_item, items)
+        passed, rejected, errors = filter_pipeline.detailed(items, wanted_item, details)
+        for item in errors:
+            # Lookup failed, try again shortly while there is still time to alert.
+            retry_at = now + timedelta(seconds=settings.AUCTION_ALERT_RETRY)
+            if retry_at < item.end_time:
+                EbayItem.objects.filter(pk=item.pk).update(alert_at=retry_at)
+                auction_scheduler.schedule(item.item_id, retry_at)
             else:
-                item.passed_filter = False
-                item.save()
+                db_logger.warning("{}  :  Couldn't fetch the details of auction {} before its alert time".format(
+                    datetime.now(), item.item_id))
+
+        # The details' current price is checked as well, the auction may have been bid past max_price since.
+        for item in rejected:
+            item.passed_filter = False
+            item.save(update_fields=['description', 'price', 'passed_filter'])
+        for item in passed:
+            item.passed_filter = True
+            item.save(update_fields=['description', 'price', 'passed_filter'])
+            item.send_alert(wanted_item)
+
+
+auction_scheduler = AuctionAlertScheduler(fire_auction_alerts)
+
+
+def collect_new_items(wanted_item: WantedItem, buy_it_now_items, auction_items):
+    """ Turn the search results we haven't found before into EbayItems on wanted_item.found_items.
+
+    The results are checked as columns by the pipeline's columnar stages first and EbayItems are only built for the
+    ones that pass. The rest aren't saved, they are returned as item id -> end time for the seen item cache so they
+    aren't checked again.
+    """
+    columns = ResultColumns(buy_it_now_items, auction_items)
+
+    # Check which we have already found and sent, in at most one query for the whole search.
+    already_found = find_already_found(columns.results)
+    new = columns.negate(columns.isin('item_ids', already_found))
+    passed = filter_pipeline.columns(columns, wanted_item, check_ending_soon=False, alive=new)
+    rejected = {columns.item_ids[row]: columns.end_time(row)
+                for row in columns.rows(columns.all_of(new, columns.negate(passed)))}
+
+    # List to hold all Ebay Items
+    wanted_item.found_items = []
+    for row in columns.rows(passed):
+        item = columns.results[row]
+        ebay_item = EbayItem(item_id=item['itemId'], name=item['title'], description='',
+                             start_time=columns.start_time(row),
+                             end_time=columns.end_time(row), listing_type=item['listingInfo']['listingType'],
+                             auction_or_fixed='F' if columns.fixed[row] else 'A',
+                             price=item['sellingStatus']['currentPrice']['value'], image=item['galleryURL'],
+                             url=item['viewItemURL'], seller_feedback=int(columns.feedback[row]))
+
+        wanted_item.found_items.append(ebay_item)
+
+    return rejected
+
+
+def quick_filter_items(wanted_item: WantedItem, items, writer: EbayItemWriter):
+    """ Filter items on what the search told us, rejects go straight to the writer and the rest are returned. """
+    for item in items:
+        item.wanted_item = wanted_item
+    # The columnar stages have already been run by collect_new_items.
+    passed, rejected = filter_pipeline.quick(items, wanted_item, check_ending_soon=False, columns_checked=True)
+
+    for item in rejected:
+        item.passed_filter = False
+        writer.add(item, wanted_item)
+
+    candidates = []
+    for item in passed:
+        item: EbayItem
+        if item.auction_or_fixed == 'A' and not item.is_ending_soon(wanted_item.auction_alert_time):
+            # Too early to alert, save it with the time its alert window opens for the scheduler.
+            item.alert_at = alert_time(item, wanted_item.auction_alert_time)
+            writer.add(item, wanted_item)
+        else:
+            candidates.append(item)
+    return candidates
+
+
+def description_filter_items(wanted_item: WantedItem, candidates, details: dict, writer: EbayItemWriter):
+    """ Check the candidates' descriptions and queue them on the writer, returns the items left to retry. """
+    passed, rejected, retry = filter_pipeline.detailed(candidates, wanted_item, details)
+    for item in rejected:
+        item.passed_filter = False
+
+    # Add to list of found items. (saved to database on flush)
+    for item in passed + rejected:
+        writer.add(item, wanted_item)
+
+    # An auction found ending soon would have ended before the next auction search, retry it shortly instead.
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=settings.AUCTION_ALERT_RETRY)
+    for item in [item for item in retry if item.auction_or_fixed == 'A' and retry_at < item.end_time]:
+        item.alert_at = retry_at
+        writer.add(item, wanted_item)
+        retry.remove(item)
+
+    if retry:
+        # Lookup failed, leave them unsaved so they are retried next scan.
+        db_logger.warning("{}  :  Couldn't fetch the details of {} items for {}, retrying next scan: {}".format(
+            datetime.now(), len(retry), wanted_item, ', '.join(str(item.item_id) for item in retry)))
+    return retry
+
+
+def advance_mark(wanted_item: WantedItem, buy_it_now_items, retry, writer: EbayItemWriter):
+    """ Move the wanted item's high water mark up to its newest buy it now listing, but not past one to retry. """
+    if not buy_it_now_items:
+        return
+    # eBay's times all have the same format, so the latest is the greatest string.
+    mark = parse_ebay_time(max(item['listingInfo']['startTime'] for item in buy_it_now_items))
+    for item in retry:
+        if item.auction_or_fixed == 'F' and item.start_time < mark:
+            mark = item.start_time
+    writer.advance_mark(wanted_item, mark)
+
+
+def quick_filter_group(group: SearchGroup, buy_it_now_items, auction_items, writer: EbayItemWriter, polled_at=None):
+    """ Fan a group's search results out to its members and quick filter each member's new listings.
+
+    Returns a list of (wanted_item, candidates) and the candidates of every member with duplicates removed, so their
+    details are fetched once. polled_at is when the buy it now search ran, if it succeeded, and records the poll for
+    each member's arrival rate.
+    """
+    members = []
+    unique = {}
+    rejected = {}
+    wanted = set()
+    for wanted_item, member_buy_it_now, member_auctions in group.fan_out(buy_it_now_items, auction_items):
+        if polled_at is not None and settings.ADAPTIVE_POLLING:
+            writer.update_wanted_item(wanted_item,
+                                      **poll_scheduler.record(wanted_item, len(member_buy_it_now), polled_at))
+        with metrics.span('dedup', wanted_item=wanted_item.pk):
+            rejected.update(collect_new_items(wanted_item, member_buy_it_now, member_auctions))
+            wanted.update(int(item.item_id) for item in wanted_item.found_items)
+        with metrics.span('filter', wanted_item=wanted_item.pk):
+            candidates = quick_filter_items(wanted_item, wanted_item.found_items, writer)
+        metrics.increment('new_listings', len(wanted_item.found_items), wanted_item=wanted_item.pk)
+        metrics.increment('candidates', len(candidates), wanted_item=wanted_item.pk)
+        members.append((wanted_item, candidates))
+        for item in candidates:
+            unique.setdefault(item.item_id, item)
+    # Only once every member has had its share, one member's reject may be another's alert.
+    seen_item_cache.add_many((item_id, end_time) for item_id, end_time in rejected.items() if item_id not in wanted)
+    return members, list(unique.values())
+
+
+def description_filter_group(members, buy_it_now_items, details: dict, writer: EbayItemWriter):
+    for wanted_item, candidates in members:
+        retry = description_filter_items(wanted_item, candidates, details, writer)
+        # The group's search covered every member back to its own mark, so each mark can move up to the newest result.
+        advance_mark(wanted_item, buy_it_now_items, retry, writer)
+
+
+# Searches given up on after SCAN_ITEM_TIMEOUT by wanted item id, with the future of the worker still running them.
+abandoned_searches = {}
+abandoned_lock = threading.Lock()
+
+
+class SearchCancelled(Exception):
+    """ Raised in a search that has been given up on, so it stops at its next stage and leaves nothing to save. """
+
+
+def stop_if_cancelled(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise SearchCancelled()
+
+
+def search_and_filter(wanted_item, writer: EbayItemWriter = None, cancelled=None):
+    """ Search for a wanted item, or a SearchGroup of them, filter the new listings and queue them on the writer.
+
+    Without a writer the items are saved and alerted before returning, with a shared writer they are flushed here when
+    SCAN_FLUSH is 'item' and left for the caller to flush when it is 'cycle'. The search queues on its own writer and
+    only merges it into the shared one if it finishes, a failed search leaves nothing behind to save. Once the
+    cancelled event is set the search stops between stages, the same as if it had failed.
+
+    Returns the search's status for the scan report: 'ok', 'error' if an eBay search or anything after it failed, or
+    'timeout' if it was cancelled.
+    """
+    flush = writer is None or settings.SCAN_FLUSH == 'item'
+    shared = writer if writer is not None else EbayItemWriter()
+    writer = EbayItemWriter()
+    group = wanted_item if isinstance(wanted_item, SearchGroup) else SearchGroup([wanted_item])
+    status = 'ok'
+    try:
+
+        # Connect to API
+        group.proxy.connect()
+
+        # Search for latest buy it now / fixed price deals, and auctions when they are due
+        with metrics.span('search', wanted_item=group.pk):
+            polled_at = datetime.now(timezone.utc)
+            buy_it_now_items = group.proxy.search_buy_it_now()
+            if buy_it_now_items is None:
+                polled_at, buy_it_now_items, status = None, [], 'error'
+            auction_items = []
+            if group.auction_members:
+                searched_at = datetime.now(timezone.utc)
+                auction_items = group.proxy.search_auctions()
+                if auction_items is not None:
+                    for member in group.auction_members:
+                        writer.update_wanted_item(member, last_auction_search=searched_at)
+                else:
+                    status = 'error'
+                auction_items = auction_items or []
+        stop_if_cancelled(cancelled)
+
+        # Filter Auction and Fixed Price items, fetching the details of the candidates all at once
+        members, candidates = quick_filter_group(group, buy_it_now_items, auction_items, writer, polled_at)
+        stop_if_cancelled(cancelled)
+        with metrics.span('detail_fetch', wanted_item=group.pk):
+            details = fetch_item_details(group.proxy, candidates)
+        stop_if_cancelled(cancelled)
+        with metrics.span('description_filter', wanted_item=group.pk):
+            description_filter_group(members, buy_it_now_items, details, writer)
+
+        # Checked under the lock the scan cancels under, so a search merges either before it's given up on or never.
+        with abandoned_lock:
+            stop_if_cancelled(cancelled)
+            shared.merge(writer)
+        if flush:
+            # Send alert to discord for the items that were new.
+            with metrics.span('save', wanted_item=group.pk):
+                saved = shared.flush()
+            send_alerts(saved)
+
+    except SearchCancelled:
+        db_logger.warning("{}  :  Gave up on the search for {} after it timed out".format(datetime.now(), group))
+        return 'timeout'
 
     except Exception as e:
+        metrics.increment('scan_errors', wanted_item=group.pk)
         print(e)
         db_logger.exception(e)
+        return 'error'
+
+    return status
+
+
+def timed_search_and_filter(group: SearchGroup, writer: EbayItemWriter, started: dict, cancelled=None):
+    """ Worker entry point, runs search_and_filter and returns how long it took in seconds and its status. """
+    started[group.pk] = time.monotonic()
+    try:
+        status = search_and_filter(group, writer, cancelled)
+        return time.monotonic() - started[group.pk], status
+    finally:
+        # Django connections are per thread, close this worker's connection so it is not left open in the pool.
+        connections.close_all()
+
+
+class ScanReport(list):
+    """ The (group, seconds, status) tuples of a scan, calling progress with each one as it is added. """
+
+    def __init__(self, progress=None):
+        super().__init__()
+        self.progress = progress
+
+    def append(self, entry):
+        super().append(entry)
+        if self.progress is not None:
+            self.progress(*entry)
+
+
+def still_running(group: SearchGroup):
+    """ Whether a search for any of the group's members timed out earlier and hasn't stopped yet. """
+    with abandoned_lock:
+        for member in group.members:
+            future = abandoned_searches.get(member.pk)
+            if future is not None and future.done():
+                del abandoned_searches[member.pk]
+            elif future is not None:
+                return True
+    return False
+
+
+def scan_wanted_items(wanted_items, workers=None, timeout=None, writer=None, groups=None, progress=None):
+    """ Scan wanted items on a pool of worker threads and report how long each search took.
+
+    Wanted items that can share a search are grouped by plan_searches, unless the groups are given. Returns a list of
+    (group, seconds, status) tuples where status is 'ok', 'error', 'timeout' or 'busy', progress is called with each
+    tuple as it is added. A timed out scan can't be killed, it is cancelled so it stops at its next stage without
+    saving anything, and its wanted items are reported 'busy' and not searched again until it has. Anything still
+    pending on the writer is flushed and alerted once every scan is done.
+    """
+    workers = workers or settings.SCAN_WORKERS
+    timeout = timeout or settings.SCAN_ITEM_TIMEOUT
+    writer = writer if writer is not None else EbayItemWriter()
+    groups = groups if groups is not None else plan_searches(wanted_items)
+    report = ScanReport(progress)
+
+    busy = [group for group in groups if still_running(group)]
+    for group in busy:
+        report.append((group, 0.0, 'busy'))
+    groups = [group for group in groups if group not in busy]
+
+    if workers <= 1:
+        for group in groups:
+            started = time.monotonic()
+            status = search_and_filter(group, writer)
+            report.append((group, time.monotonic() - started, status))
+        send_alerts(flush_writer(writer))
+        return list(report)
+
+    started = {}
+    cancelled = {group.pk: threading.Event() for group in groups}
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan')
+    pending = {executor.submit(timed_search_and_filter, group, writer, started, cancelled[group.pk]): group
+               for group in groups}
+    try:
+        while pending:
+            done, _ = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                group = pending.pop(future)
+                try:
+                    report.append((group, *future.result()))
+                except Exception as e:
+                    db_logger.exception(e)
+                    report.append((group, time.monotonic() - started[group.pk], 'error'))
+
+            # Give up on scans that have been running for longer than the timeout.
+            now = time.monotonic()
+            for future, group in list(pending.items()):
+                if group.pk in started and now - started[group.pk] > timeout:
+                    pending.pop(future)
+                    with abandoned_lock:
+                        cancelled[group.pk].set()
+                        for member in group.members:
+                            abandoned_searches[member.pk] = future
+                    report.append((group, now - started[group.pk], 'timeout'))
+    finally:
+        executor.shutdown(wait=False)
+
+    send_alerts(flush_writer(writer))
+    return list(report)
+
+
+async def async_search_and_filter(group: SearchGroup, client: AsyncEbayClient, shared: EbayItemWriter):
+    """ search_and_filter for the asyncio scan, the database work runs on Django's thread sensitive sync thread. """
+    flush = settings.SCAN_FLUSH == 'item'
+    writer = EbayItemWriter()
+
+    # Search for latest buy it now / fixed price deals, and auctions when they are due, at the same time
+    searches = [client.search_buy_it_now(group.proxy)]
+    searched_at = datetime.now(timezone.utc)
+    if group.auction_members:
+        searches.append(client.search_auctions(group.proxy))
+    with metrics.span('search', wanted_item=group.pk):
+        buy_it_now_items, *auction_items = await asyncio.gather(*searches)
+    if auction_items:
+        auction_items = auction_items[0]
+        for member in group.auction_members:
+            writer.update_wanted_item(member, last_auction_search=searched_at)
+
+    # The filters log to the database too, so they can't run on the event loop either.
+    members, candidates = await sync_to_async(quick_filter_group, thread_sensitive=True)(group, buy_it_now_items,
+                                                                                         auction_items, writer,
+                                                                                         searched_at)
+    with metrics.span('detail_fetch', wanted_item=group.pk):
+        details = await client.fetch_item_details(candidates)
+    with metrics.span('description_filter', wanted_item=group.pk):
+        await sync_to_async(description_filter_group, thread_sensitive=True)(members, buy_it_now_items, details,
+                                                                             writer)
+
+    # Not merged if the search is cancelled before here, a timed out search leaves nothing behind to save.
+    shared.merge(writer)
+    if flush:
+        with metrics.span('save', wanted_item=group.pk):
+            saved = await sync_to_async(shared.flush, thread_sensitive=True)()
+        await sync_to_async(send_alerts, thread_sensitive=True)(saved)
+
+
+async def async_scan_wanted_items(wanted_items, writer: EbayItemWriter, concurrency=None, timeout=None):
+    """ Scan wanted items concurrently on one event loop, same report as scan_wanted_items.
+
+    Unlike the threaded scan a timed out search is actually cancelled.
+    """
+    concurrency = concurrency or settings.SCAN_ASYNC_CONCURRENCY
+    timeout = timeout or settings.SCAN_ITEM_TIMEOUT
+    semaphore = asyncio.Semaphore(concurrency)
+    report = []
+
+    async def scan(client, group):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(async_search_and_filter(group, client, writer), timeout)
+                status = 'ok'
+            except asyncio.TimeoutError:
+                status = 'timeout'
+            except Exception as e:
+                metrics.increment('scan_errors', wanted_item=group.pk)
+                print(e)
+                db_logger.exception(e)
+                status = 'error'
+            report.append((group, time.monotonic() - started, status))
+
+    async with AsyncEbayClient() as client:
+        await asyncio.gather(*[scan(client, group) for group in plan_searches(wanted_items)])
+
+    await sync_to_async(lambda: send_alerts(flush_writer(writer)), thread_sensitive=True)()
+    await sync_to_async(connections.close_all, thread_sensitive=True)()
+    return report
+
+
+def log_scan_report(report, cycle_seconds, writer: EbayItemWriter, polled=()):
+    lines = ["{}  :  {:.2f}s  :  {}".format(group, seconds, status)
+             for group, seconds, status in sorted(report, key=lambda r: r[1], reverse=True)]
+    db_logger.info("Scanned {} searches in {:.2f}s, saved {} new items, skipped {}\n{}".format(
+        len(report), cycle_seconds, writer.inserted, writer.skipped, '\n'.join(lines)))
+
+    routes = ["{name}  :  {queued} queued, {sent} sent, {failed} failed, "
+              "{avg_latency:.2f}s avg / {max_latency:.2f}s max latency".format(**stats)
+              for stats in alert_dispatcher.stats().values()]
+    if routes:
+        db_logger.info("Alert delivery\n{}".format('\n'.join(routes)))
+
+    calls = ["{}  :  {hits} hits, {misses} misses, {hit_rate:.0%}".format(verb, **stats)
+             for verb, stats in sorted(response_cache.stats().items())]
+    if calls:
+        db_logger.info("Response cache\n{}".format('\n'.join(calls)))
+
+    stages = ["{}  :  {checked} checked, {rejected} rejected, {errors} errors, {seconds:.3f}s".format(name, **stats)
+              for name, stats in filter_pipeline.stats().items() if stats['checked']]
+    if stages:
+        db_logger.info("Filters\n{}".format('\n'.join(stages)))
+
+    limits = ["{}  :  {granted} calls, {rejected} refused, {waited:.1f}s waiting, {} today".format(
+        key, usage.get(key, 0), **stats) for usage in [rate_limiter.usage()]
+        for key, stats in sorted(rate_limiter.stats().items())]
+    if limits:
+        db_logger.info("Rate limits\n{}".format('\n'.join(limits)))
+
+    if settings.ADAPTIVE_POLLING:
+        polls = ["{}  :  {:.2f} new/min, every {}s, next {}".format(
+            wanted_item, wanted_item.arrival_rate, wanted_item.poll_interval,
+            wanted_item.next_poll_at.strftime('%H:%M:%S') if wanted_item.next_poll_at else '-')
+            for wanted_item in sorted(polled, key=lambda w: w.poll_interval)]
+        db_logger.info("Polling  :  budget factor {:.2f}\n{}".format(poll_scheduler.budget_factor, '\n'.join(polls)))
+
+    if description_converter.hits or description_converter.misses:
+        db_logger.info("Description cache  :  {} hits, {} misses".format(description_converter.hits,
+                                                                       description_converter.misses))
+
+
+def scan(wanted_items, writer: EbayItemWriter):
+    if settings.SCAN_ASYNC:
+        return asyncio.run(async_scan_wanted_items(wanted_items, writer))
+    return scan_wanted_items(wanted_items, writer=writer)
+
+
+def poll_wanted_items(wanted_items, writer: EbayItemWriter, deadline):
+    """ Scan each wanted item when its poll is due until the deadline (a time.monotonic() time), returns the report.
+
+    The scan task runs every minute, so wanted items polled more often than that are searched again within the task.
+    """
+    report = []
+    while True:
+        due = poll_scheduler.plan(plan_searches(wanted_items))
+        if due:
+            report += scan(due, writer)
+        next_poll = poll_scheduler.next_due(wanted_items)
+        if next_poll is None:
+            break
+        pause = max((next_poll - datetime.now(timezone.utc)).total_seconds(), 0)
+        if time.monotonic() + pause >= deadline:
+            break
+        time.sleep(pause)
+    return report
+
+
+def scan_cycle(wanted_items):
+    """ One scan of the wanted items, with adaptive polling if it's on, then logs and records the cycle. """
+    cycle_started = time.monotonic()
+    metrics.start_cycle()
+
+    if not seen_item_cache.warmed:
+        seen_item_cache.warm()
+    auction_scheduler.start()
+    route_cache.prime(wanted_items)
+
+    writer = EbayItemWriter()
+    if settings.ADAPTIVE_POLLING:
+        report = poll_wanted_items(wanted_items, writer, cycle_started + settings.POLL_CYCLE)
+    else:
+        report = scan(wanted_items, writer)
+    log_scan_report(report, time.monotonic() - cycle_started, writer, wanted_items)
+
+    seen_item_cache.evict_expired()
+    seen_item_cache.save()
+
+    metrics.increment('searches', len(report))
+    metrics.observe('cycle', time.monotonic() - cycle_started)
+    metrics.end_cycle()
 
 
 @background(schedule=60)  # Every minute
@@ -124,11 +632,13 @@ def scan_ebay_items():
     try:
         db_logger.info("Scanning items...")
 
-        # Get Wanted Items
-        wanted_items = WantedItem.objects.filter(deleted=False)
-
-        for wanted_item in wanted_items:
-            search_and_filter(wanted_item)
+        # Get Wanted Items, only this process's share of them when scan workers are sharing them out
+        if settings.SCAN_LEASING:
+            leases.release_at_exit()
+            with leases.keep_alive():
+                scan_cycle(leases.claim())
+        else:
+            scan_cycle(list(WantedItem.objects.filter(deleted=False).prefetch_related('notifications')))
 
         # db_logger.info("Finished scanning items...")
 
@@ -136,3 +646,61 @@ def scan_ebay_items():
     except Exception as e:
         print(e)
         db_logger.exception(e)
+
+
+@background(schedule=60 * 60)  # Every hour
+def prune_logs():
+    """ Delete database log records older than LOG_RETENTION_DAYS. """
+    try:
+        deleted = prune_status_logs(settings.LOG_RETENTION_DAYS)
+        if deleted:
+            db_logger.info("Pruned {} log records older than {} days".format(deleted, settings.LOG_RETENTION_DAYS))
+    except Exception as e:
+        print(e)
+        db_logger.exception(e)
+
+
+@background(schedule=0, queue=settings.SCAN_JOB_QUEUE)
+def run_scan_job(job_id):
+    """ Run a ScanJob queued by the scan view, recording its progress on the job as each search finishes.
+
+    The job leases the wanted items it scans, the ones a scan worker holds are left to that worker and recorded as
+    skipped on the job. It is Partial if any were skipped, and Failed if every one was.
+    """
+    job = ScanJob.objects.get(pk=job_id)
+    job_leases = LeaseManager(name='{}:job{}'.format(worker_name(), job.pk))
+    try:
+        if not seen_item_cache.warmed:
+            seen_item_cache.warm()
+        asked_for = job.wanted_items()
+        wanted_items = job_leases.acquire(asked_for)
+        leased = {wanted_item.pk for wanted_item in wanted_items}
+        skipped = [wanted_item.pk for wanted_item in asked_for if wanted_item.pk not in leased]
+        if skipped:
+            db_logger.info("Scan job {}  :  {} wanted items left to the scan workers holding them".format(
+                job.pk, len(skipped)))
+        route_cache.prime(wanted_items)
+        groups = plan_searches(wanted_items)
+        job.status, job.started_at, job.searches = 'RUN', datetime.now(timezone.utc), len(groups)
+        job.skipped_wanted_item_ids = ','.join(str(pk) for pk in skipped)
+        job.save(update_fields=['status', 'started_at', 'searches', 'skipped_wanted_item_ids'])
+
+        def progress(group, seconds, status):
+            ScanJob.objects.filter(pk=job.pk).update(searches_done=F('searches_done') + 1)
+
+        writer = EbayItemWriter()
+        with job_leases.keep_alive():
+            scan_wanted_items(wanted_items, writer=writer, groups=groups, progress=progress)
+        job.status, job.items_found = 'PAR' if skipped else 'DON', writer.inserted
+        if skipped and not wanted_items:
+            job.status, job.error = 'ERR', 'All {} wanted items are being scanned by scan workers'.format(len(skipped))
+    except Exception as e:
+        print(e)
+        db_logger.exception(e)
+        job.status, job.error = 'ERR', str(e)
+    finally:
+        job_leases.release()
+        job.finished_at = datetime.now(timezone.utc)
+        job.save(update_fields=['status', 'items_found', 'error', 'finished_at'])
+        # The job is done once its alerts are sent, digests included.
+        alert_dispatcher.drain()
@@ -1,3 +1,1104 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import email
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import warnings
+from datetime import timezone
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django_db_logger.models import StatusLog
+
+with warnings.catch_warnings():
+    # Deprecated, but still the stdlib's only SMTP server, and enough to test against.
+    warnings.simplefilter('ignore', DeprecationWarning)
+    import asyncore
+    import smtpd
+
+from . import ebay_api
+from .cache import SeenItemCache, seen_item_cache
+from .descriptions import DescriptionConverter, extract_text
+from .leasing import LeaseManager
+from .log_handlers import QueuedDatabaseHandler, RateLimitFilter, prune_status_logs
+from .management.commands.bench_html_to_text import load_corpus, load_fixtures, save_corpus
+from .matching import AntiKeywordMatcher
+from .metrics import Metrics
+from . import results
+from .models import EbayItem, NotificationRoute, ScanJob, ScanWorker, WantedItem, parse_ebay_time
+from .notifications import AlertDispatcher, route_cache
+from .planner import SearchGroup, plan_searches
+from .polling import PollScheduler
+from .ratelimit import HIGH, LOW, QuotaExceeded, RateLimiter
+from .replay import ListingCatalogue, ReplayAdapter, ebay_time
+from .response_cache import response_cache
+from .results import ResultColumns
+from .scheduler import AuctionAlertScheduler
+from .smtp import SMTPPool
+from .tasks import (async_scan_wanted_items, description_filter_items, fire_auction_alerts, run_scan_job,
+                    scan_wanted_items, search_and_filter, send_alerts)
+from .writer import EbayItemWriter
+
+# ebaysdk won't build a request without an app id, replayed calls never check it.
+os.environ.setdefault('EBAY_API_ID', 'replay')
+
+
+replay_settings = override_settings(RATE_LIMIT=False, RESPONSE_CACHE='', METRICS_FILE='', SCAN_WORKERS=1,
+                                    ADAPTIVE_POLLING=False)
+
+
+class Replay:
+    """ Scans against a replayed eBay, answered from a catalogue of generated listings. """
+
+    def setUp(self):
+        self.catalogue = ListingCatalogue(per_search=10, auctions_per_search=0, anti_match_rate=0)
+        self.adapter = ReplayAdapter(self.catalogue, latency=0, jitter=0)
+        ebay_api.set_transport(self.adapter)
+        response_cache._configured = False
+        seen_item_cache.clear()
+
+    def tearDown(self):
+        ebay_api.set_transport(None)
+        response_cache._configured = False
+        seen_item_cache.clear()
+
+    @staticmethod
+    def wanted_item(keywords='test search', **fields):
+        fields = dict({'name': keywords, 'keywords': keywords, 'min_price': 0, 'max_price': 1000, 'min_feedback': 0,
+                       'buy_it_now_time': 60 * 24}, **fields)
+        return WantedItem.objects.create(**fields)
+
+    @staticmethod
+    def ebay_item(item_id, **fields):
+        now = datetime.datetime.now(timezone.utc)
+        fields = dict({'item_id': item_id, 'name': 'item {}'.format(item_id), 'description': '', 'start_time': now,
+                       'end_time': now + datetime.timedelta(days=1), 'listing_type': 'FixedPrice',
+                       'auction_or_fixed': 'F', 'price': 10, 'image': '', 'url': '', 'seller_feedback': 10}, **fields)
+        return EbayItem(**fields)
+
+
+@replay_settings
+class ReplayTestCase(Replay, TestCase):
+    pass
+
+
+@replay_settings
+class ThreadedReplayTestCase(Replay, TransactionTestCase):
+    """ For scans on worker threads, which can't see or write past a TestCase's open transaction. """
+
+
+class WriterTests(ReplayTestCase):
+
+    @override_settings(SCAN_FLUSH='cycle')
+    def test_empty_shared_writer_is_flushed_in_cycle_mode(self):
+        wanted_item = self.wanted_item()
+        writer = EbayItemWriter()
+        scan_wanted_items([wanted_item], writer=writer)
+
+        self.assertEqual(len(writer), 0)
+        self.assertGreater(writer.inserted, 0)
+        self.assertEqual(EbayItem.objects.filter(wanted_item=wanted_item).count(), writer.inserted)
+
+    def test_listing_saved_by_another_process_is_not_reported_new(self):
+        wanted_item = self.wanted_item()
+        self.ebay_item(1).save()
+        writer = EbayItemWriter()
+        writer.add(self.ebay_item(1), wanted_item)
+        writer.add(self.ebay_item(2), wanted_item)
+
+        # As if the other process saved item 1 between the dedup query and the insert.
+        with mock.patch.object(EbayItem, 'existing_item_ids', return_value=set()):
+            saved = writer.flush()
+
+        self.assertEqual([item.item_id for item, wanted_item in saved], [2])
+        self.assertEqual(writer.inserted, 1)
+        self.assertEqual(EbayItem.objects.count(), 2)
+
+    def test_failed_search_leaves_nothing_on_the_shared_writer(self):
+        # Some listings over the max price are rejected before the failure, and the auction search is due.
+        wanted_item = self.wanted_item(max_price=50)
+        writer = EbayItemWriter()
+        with override_settings(SCAN_FLUSH='cycle'), \
+                mock.patch('alerts.tasks.fetch_item_details', side_effect=ConnectionError('lookup failed')):
+            search_and_filter(wanted_item, writer)
+
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(writer.flush(), [])
+        wanted_item.refresh_from_db()
+        self.assertIsNone(wanted_item.last_seen_start_time)
+        self.assertIsNone(wanted_item.last_auction_search)
+
+    def test_mark_advances_with_the_items_it_covers(self):
+        wanted_item = self.wanted_item()
+        writer = EbayItemWriter()
+        with override_settings(SCAN_FLUSH='cycle'):
+            search_and_filter(wanted_item, writer)
+        newest = max(listing.start_time for listing in self.catalogue.search('test search')['FixedPrice']).replace(
+            microsecond=0)
+
+        # Merged but not yet saved, the mark mustn't be in the database before the items.
+        self.assertEqual(wanted_item.last_seen_start_time, newest)
+        self.assertIsNone(WantedItem.objects.get(pk=wanted_item.pk).last_seen_start_time)
+        self.assertGreater(len(writer.flush()), 0)
+        self.assertEqual(WantedItem.objects.get(pk=wanted_item.pk).last_seen_start_time, newest)
+
+
+class TimeoutTests(ReplayTestCase):
+
+    def test_cancelled_search_saves_nothing(self):
+        wanted_item = self.wanted_item()
+        writer = EbayItemWriter()
+        cancelled = threading.Event()
+        cancelled.set()
+        with override_settings(SCAN_FLUSH='cycle'):
+            search_and_filter(wanted_item, writer, cancelled)
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(writer.flush(), [])
+
+    def test_timed_out_search_is_not_started_again_until_it_stops(self):
+        wanted_item = self.wanted_item()
+        release = threading.Event()
+        searches = []
+
+        def search(group, writer, cancelled=None):
+            searches.append(cancelled)
+            release.wait(10)
+            return 'ok'
+
+        with mock.patch('alerts.tasks.search_and_filter', side_effect=search):
+            report = scan_wanted_items([wanted_item], workers=2, timeout=0.1, groups=[SearchGroup([wanted_item])])
+            self.assertEqual([status for group, seconds, status in report], ['timeout'])
+            self.assertTrue(searches[0].is_set())
+
+            report = scan_wanted_items([wanted_item], workers=2, groups=[SearchGroup([wanted_item])])
+            self.assertEqual([status for group, seconds, status in report], ['busy'])
+            self.assertEqual(len(searches), 1)
+
+            release.set()
+            for _ in range(100):
+                report = scan_wanted_items([wanted_item], workers=2, groups=[SearchGroup([wanted_item])])
+                if report[0][2] != 'busy':
+                    break
+                time.sleep(0.05)
+            self.assertEqual([status for group, seconds, status in report], ['ok'])
+
+
+class ScanReportTests(ThreadedReplayTestCase):
+
+    def statuses(self, wanted_items, workers):
+        return [status for group, seconds, status in scan_wanted_items(wanted_items, workers=workers)]
+
+    def test_failed_searches_are_reported(self):
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                wanted_item = self.wanted_item('search with {} workers'.format(workers))
+                with mock.patch('alerts.tasks.fetch_item_details', side_effect=ConnectionError('lookup failed')):
+                    self.assertEqual(self.statuses([wanted_item], workers), ['error'])
+                with mock.patch.object(WantedItem, 'search_buy_it_now', return_value=None):
+                    self.assertEqual(self.statuses([wanted_item], workers), ['error'])
+                with mock.patch.object(EbayItem, 'send_alert'):
+                    self.assertEqual(self.statuses([wanted_item], workers), ['ok'])
+
+
+class AsyncScanTests(ThreadedReplayTestCase):
+
+    def scan(self, run):
+        """ Scan two wanted items against a fresh catalogue with run, returns the report's statuses, the items saved
+        and the items alerted and scheduled. """
+        EbayItem.objects.all().delete()
+        WantedItem.objects.all().delete()
+        seen_item_cache.clear()
+        catalogue = ListingCatalogue(per_search=10, auctions_per_search=2, anti_match_rate=0.3)
+        # Listed up front, in order, so both scans see the same item ids whichever searches first.
+        for keywords in ('games console', 'camera lens'):
+            catalogue.search(keywords)
+        ebay_api.set_transport(ReplayAdapter(catalogue, latency=0, jitter=0))
+        wanted_items = [self.wanted_item('games console', anti_keywords='spares', auction_alert_time=60 * 24),
+                        self.wanted_item('camera lens', anti_keywords='spares')]
+
+        with mock.patch.object(EbayItem, 'send_alert', autospec=True) as send_alert, \
+                mock.patch('alerts.tasks.auction_scheduler') as auction_scheduler:
+            report = run(wanted_items)
+
+        saved = sorted(EbayItem.objects.values_list('wanted_item__keywords', 'item_id', 'passed_filter'))
+        alerted = sorted((item.item_id, wanted_item.keywords) for (item, wanted_item), kwargs
+                         in send_alert.call_args_list)
+        scheduled = sorted(call.args[0] for call in auction_scheduler.schedule.call_args_list)
+        return [status for group, seconds, status in report], saved, alerted, scheduled
+
+    # Saved once the searches are done, two worker threads inserting at once lock the in-memory SQLite tables.
+    @override_settings(SCAN_FLUSH='cycle')
+    def test_async_scan_saves_and_alerts_the_same_listings(self):
+        threaded = self.scan(lambda wanted_items: scan_wanted_items(wanted_items, workers=2))
+        asynchronous = self.scan(lambda wanted_items: asyncio.run(async_scan_wanted_items(wanted_items,
+                                                                                          EbayItemWriter())))
+
+        self.assertEqual(asynchronous, threaded)
+        statuses, saved, alerted, scheduled = threaded
+        self.assertEqual(statuses, ['ok', 'ok'])
+        self.assertTrue(alerted)
+        self.assertTrue(scheduled)
+        self.assertTrue(any(not passed_filter for keywords, item_id, passed_filter in saved))
+
+    def test_client_reuses_its_connections(self):
+        wanted_items = [self.wanted_item('games console'), self.wanted_item('camera lens')]
+        with mock.patch('alerts.ebay_async.new_connection', wraps=ebay_api.new_connection) as new_connection, \
+                mock.patch.object(EbayItem, 'send_alert'):
+            report = asyncio.run(async_scan_wanted_items(wanted_items, EbayItemWriter()))
+
+        self.assertEqual([status for group, seconds, status in report], ['ok', 'ok'])
+        self.assertEqual(sorted(call.args[0] for call in new_connection.call_args_list), ['Finding', 'Shopping'])
+
+
+class AuctionAlertTests(ReplayTestCase):
+
+    def scheduled_auction(self, item_id, wanted_item):
+        now = datetime.datetime.now(timezone.utc)
+        item = self.ebay_item(item_id, listing_type='Auction', auction_or_fixed='A', price=20, wanted_item=wanted_item,
+                              end_time=now + datetime.timedelta(minutes=5), alert_at=now)
+        item.save()
+        return item
+
+    @staticmethod
+    def details(price):
+        return {'Description': 'Boxed and working', 'ConvertedCurrentPrice': {'_currencyID': 'GBP', 'value': price}}
+
+    def test_auction_bid_past_max_price_is_not_alerted(self):
+        wanted_item = self.wanted_item(max_price=50)
+        cheap, bid_up = self.scheduled_auction(1, wanted_item), self.scheduled_auction(2, wanted_item)
+        details = {cheap.item_id: self.details('45.00'), bid_up.item_id: self.details('80.00')}
+
+        with mock.patch('alerts.tasks.fetch_item_details', return_value=details), \
+                mock.patch.object(EbayItem, 'send_alert') as send_alert:
+            fire_auction_alerts([cheap.item_id, bid_up.item_id])
+
+        self.assertEqual(send_alert.call_count, 1)
+        bid_up.refresh_from_db()
+        self.assertFalse(bid_up.passed_filter)
+        self.assertEqual(bid_up.price.amount, 80)
+        cheap.refresh_from_db()
+        self.assertTrue(cheap.passed_filter)
+
+    def test_failed_lookup_of_an_ending_auction_is_retried_shortly(self):
+        wanted_item = self.wanted_item()
+        now = datetime.datetime.now(timezone.utc)
+        auction = self.ebay_item(1, listing_type='Auction', auction_or_fixed='A',
+                                 end_time=now + datetime.timedelta(minutes=5))
+        writer = EbayItemWriter()
+
+        retry = description_filter_items(wanted_item, [auction], {}, writer)
+
+        self.assertEqual(retry, [])
+        self.assertIsNotNone(auction.alert_at)
+        self.assertLess(auction.alert_at, auction.end_time)
+        with mock.patch('alerts.tasks.auction_scheduler') as scheduler:
+            send_alerts(writer.flush())
+        scheduler.schedule.assert_called_once_with(auction.item_id, auction.alert_at)
+
+
+class DedupTests(ReplayTestCase):
+
+    def test_listings_are_alerted_once(self):
+        wanted_item = self.wanted_item()
+        with mock.patch.object(EbayItem, 'send_alert') as send_alert:
+            scan_wanted_items([wanted_item])
+            alerted = send_alert.call_count
+            scan_wanted_items([wanted_item])
+            self.assertGreater(alerted, 0)
+            self.assertEqual(send_alert.call_count, alerted)
+
+            # Forgotten by the seen item cache and the mark, the database still knows them.
+            seen_item_cache.clear()
+            WantedItem.objects.filter(pk=wanted_item.pk).update(last_seen_start_time=None)
+            wanted_item.last_seen_start_time = None
+            scan_wanted_items([wanted_item])
+            self.assertEqual(send_alert.call_count, alerted)
+
+            self.catalogue.advance()
+            scan_wanted_items([wanted_item])
+            self.assertGreater(send_alert.call_count, alerted)
+        self.assertEqual(EbayItem.objects.filter(passed_filter=True).count(), send_alert.call_count)
+
+
+class CoalescingTests(ReplayTestCase):
+
+    def test_wanted_items_with_the_same_keywords_share_a_search(self):
+        cheap, any_price = self.wanted_item(max_price=50), self.wanted_item('Test  SEARCH')
+        with mock.patch.object(self.adapter, 'find_items_advanced', wraps=self.adapter.find_items_advanced) as find, \
+                mock.patch.object(EbayItem, 'send_alert'):
+            scan_wanted_items([cheap, any_price])
+
+        self.assertEqual([call[0][0]['ListingType'] for call in find.call_args_list].count(['FixedPrice']), 1)
+        self.assertTrue(EbayItem.objects.filter(wanted_item=cheap).exists())
+        self.assertFalse(EbayItem.objects.filter(wanted_item=cheap, price__gt=50).exists())
+        self.assertTrue(EbayItem.objects.filter(wanted_item=any_price, price__gt=50).exists())
+
+    def test_a_listing_one_member_rejects_is_still_alerted_for_another(self):
+        for order, keywords in (('strict first', 'first search'), ('loose first', 'second search')):
+            with self.subTest(order):
+                strict = self.wanted_item(keywords, max_feedback=100)
+                loose = self.wanted_item(keywords, max_feedback=100000)
+                with mock.patch.object(EbayItem, 'send_alert'):
+                    scan_wanted_items([strict, loose] if order == 'strict first' else [loose, strict])
+
+                trusted = [listing for listing in self.catalogue.search(keywords)['FixedPrice']
+                           if listing.feedback > 100]
+                self.assertTrue(trusted)
+                self.assertEqual(EbayItem.objects.filter(wanted_item=loose, passed_filter=True,
+                                                         seller_feedback__gt=100).count(), len(trusted))
+
+
+@override_settings(RATE_LIMIT=False)
+class LeaseTests(TestCase):
+
+    def setUp(self):
+        self.wanted_items = [WantedItem.objects.create(name=str(n), keywords=str(n), min_price=0, max_price=100)
+                             for n in range(5)]
+        self.first, self.second = LeaseManager('first', duration=60), LeaseManager('second', duration=60)
+
+    @staticmethod
+    def pks(wanted_items):
+        return {wanted_item.pk for wanted_item in wanted_items}
+
+    def test_two_workers_claim_disjoint_shares(self):
+        self.assertEqual(len(self.first.claim()), 5)
+        # Everything is leased to the first, which gives the extra back at its next claim.
+        self.assertEqual(self.second.claim(), [])
+        first = self.pks(self.first.claim())
+        second = self.pks(self.second.claim())
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse(first & second)
+        self.assertEqual(first | second, self.pks(self.wanted_items))
+        self.assertEqual(self.pks(self.first.claim()), first)
+
+    def test_dead_workers_share_is_reclaimed_once_its_leases_expire(self):
+        self.first.claim()
+        self.second.claim()
+        second = self.pks(self.first.claim()) ^ self.pks(self.wanted_items)
+        self.assertEqual(self.pks(self.second.claim()), second)
+
+        # The second stops renewing, its leases are still good so the first can't take them.
+        self.assertEqual(len(self.first.claim()), 3)
+        past = datetime.datetime.now(timezone.utc) - datetime.timedelta(seconds=61)
+        WantedItem.objects.filter(lease_owner='second').update(lease_expires=past)
+        ScanWorker.objects.filter(name='second').update(last_seen=past)
+
+        self.assertEqual(self.pks(self.first.claim()), self.pks(self.wanted_items))
+        self.assertFalse(ScanWorker.objects.filter(name='second').exists())
+
+    def test_one_off_scan_leaves_workers_rows_alone(self):
+        self.first.claim()
+        self.second.claim()
+        self.first.claim()
+        WantedItem.objects.filter(lease_owner='second').update(lease_owner='', lease_expires=None)
+        job = LeaseManager('job', duration=60)
+        acquired = self.pks(job.acquire(self.wanted_items))
+
+        self.assertFalse(acquired & self.pks(WantedItem.objects.filter(lease_owner='first')))
+        self.assertEqual(len(acquired), 2)
+        self.assertEqual(acquired, self.pks(WantedItem.objects.filter(lease_owner='job')))
+        self.assertFalse(ScanWorker.objects.filter(name='job').exists())
+        job.release()
+        self.assertFalse(WantedItem.objects.filter(lease_owner='job').exists())
+
+    @override_settings(RATE_LIMIT=True)
+    def test_workers_on_another_machine_claim_nothing_while_rate_limited(self):
+        self.assertEqual(len(self.first.claim()), 5)
+        with mock.patch('alerts.leasing.socket.gethostname', return_value='elsewhere'), \
+                mock.patch('alerts.leasing.db_logger') as db_logger:
+            self.assertEqual(self.second.claim(), [])
+        db_logger.error.assert_called_once()
+        self.assertEqual(len(self.first.claim()), 5)
+
+
+class MetricsTests(TestCase):
+
+    def test_each_process_writes_its_own_file_and_the_view_adds_them_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        processes = [Metrics(), Metrics()]
+        with override_settings(METRICS_FILE=os.path.join(directory, 'metrics.json')):
+            for pid, process in enumerate(processes):
+                process.start_cycle()
+                process.increment('searches', 2, wanted_item='a')
+                process.observe('cycle', pid + 1)
+                with mock.patch('alerts.metrics.os.getpid', return_value=pid):
+                    process.end_cycle()
+            snapshot = Metrics().load()
+
+        self.assertEqual(snapshot['counters'], [{'name': 'searches', 'labels': {'wanted_item': 'a'}, 'value': 4}])
+        self.assertEqual(snapshot['spans'], [{'name': 'cycle', 'labels': {}, 'count': 2, 'seconds': 3, 'max': 2}])
+        self.assertEqual(snapshot['pids'], [0, 1])
+
+
+class ResponseCacheTests(TestCase):
+
+    @override_settings(RESPONSE_CACHE_TTLS={'findItemsAdvanced': 20, 'GetMultipleItems': 3600}, POLL_MIN_INTERVAL=15)
+    def test_adaptive_polls_never_get_the_last_polls_search_back(self):
+        with override_settings(ADAPTIVE_POLLING=True):
+            self.assertLess(response_cache.ttl('findItemsAdvanced'), 15)
+            self.assertEqual(response_cache.ttl('GetMultipleItems'), 3600)
+        with override_settings(ADAPTIVE_POLLING=False):
+            self.assertEqual(response_cache.ttl('findItemsAdvanced'), 20)
+        self.assertEqual(response_cache.ttl('getUserProfile'), 0)
+
+
+class DispatcherTests(TestCase):
+
+    def test_drain_sends_queued_alerts_and_open_digests(self):
+        digest_route = mock.Mock(pk=1, type='EMA', digest_minutes=60)
+        webhook_route = mock.Mock(pk=2, type='DIS', digest_minutes=0)
+        items = [mock.Mock(), mock.Mock()]
+        dispatcher = AlertDispatcher()
+        with mock.patch('alerts.notifications.atexit'):
+            for item in items:
+                dispatcher.dispatch(item, digest_route)
+            dispatcher.dispatch(items[0], webhook_route)
+
+        self.assertTrue(dispatcher.drain(timeout=5))
+        digest_route.deliver_digest.assert_called_once_with(items, digest_route.connect.return_value)
+        items[0].deliver_alert.assert_called_once()
+        self.assertEqual(dispatcher.pending(), 0)
+
+
+class RouteCacheTests(ReplayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        route_cache.invalidate()
+        self.addCleanup(route_cache.invalidate)
+        self.route = self.route_named('first')
+        self.wanted_item = self.wanted_item()
+        self.wanted_item.notifications.add(self.route)
+        route_cache.prime(WantedItem.objects.prefetch_related('notifications'))
+
+    @staticmethod
+    def route_named(name):
+        return NotificationRoute.objects.create(name=name, description='', type='DIS',
+                                                webhook='https://discord.com/api/webhooks/{}/token'.format(name))
+
+    def dispatched(self):
+        """ The webhook of each route the wanted item's next alert goes to. """
+        with mock.patch('alerts.models.alert_dispatcher') as alert_dispatcher:
+            self.ebay_item('1').send_alert(self.wanted_item)
+        return sorted(call.args[1].webhook for call in alert_dispatcher.dispatch.call_args_list)
+
+    def test_editing_a_route_is_seen_by_the_next_alert(self):
+        self.assertEqual(self.dispatched(), ['https://discord.com/api/webhooks/first/token'])
+
+        route = NotificationRoute.objects.get(pk=self.route.pk)
+        route.webhook = 'https://discord.com/api/webhooks/edited/token'
+        route.save()
+        self.assertEqual(self.dispatched(), ['https://discord.com/api/webhooks/edited/token'])
+
+        route.delete()
+        self.assertEqual(self.dispatched(), [])
+
+    def test_adding_and_removing_routes_is_seen_by_the_next_alert(self):
+        second = self.route_named('second')
+        self.wanted_item.notifications.add(second)
+        self.assertEqual(len(self.dispatched()), 2)
+
+        # From the route's side too.
+        self.route.wanted_items.remove(self.wanted_item)
+        self.assertEqual(self.dispatched(), ['https://discord.com/api/webhooks/second/token'])
+        second.wanted_items.clear()
+        self.assertEqual(self.dispatched(), [])
+
+    def test_saving_or_deleting_a_wanted_item_forgets_its_routes(self):
+        second = self.route_named('second')
+        route_cache.prime(WantedItem.objects.prefetch_related('notifications'))
+        # Through rows created directly don't send m2m_changed, so the cache doesn't know about this one yet.
+        WantedItem.notifications.through.objects.create(wanteditem=self.wanted_item, notificationroute=second)
+        self.assertEqual(len(self.dispatched()), 1)
+
+        self.wanted_item.save()
+        self.assertEqual(len(self.dispatched()), 2)
+
+        pk = self.wanted_item.pk
+        self.wanted_item.delete()
+        self.assertNotIn(pk, route_cache._routes)
+
+
+class SMTPServer(smtpd.SMTPServer):
+    """ A local SMTP server on its own thread, counting the connections made to it and keeping what it's sent. """
+
+    def __init__(self):
+        self.map = {}
+        super().__init__(('127.0.0.1', 0), None, map=self.map, decode_data=True)
+        self.port = self.socket.getsockname()[1]
+        self.connections = 0
+        self.messages = []
+        self._calls = []
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while self._running:
+            asyncore.loop(timeout=0.01, map=self.map, count=1)
+            while self._calls:
+                self._calls.pop(0)()
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        super().handle_accepted(conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append(data)
+
+    def drop_connections(self):
+        """ Hang up on every client, as a server does with connections it thinks are idle. """
+        dropped = threading.Event()
+
+        def drop():
+            for channel in [channel for channel in self.map.values() if channel is not self]:
+                channel.close()
+            dropped.set()
+        self._calls.append(drop)
+        dropped.wait(5)
+
+    def stop(self):
+        self._running = False
+        self._thread.join(5)
+        asyncore.close_all(map=self.map)
+
+
+@override_settings(EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_TIMEOUT=5)
+class SMTPPoolTests(TestCase):
+
+    def setUp(self):
+        self.server = SMTPServer()
+        self.addCleanup(self.server.stop)
+        self.pool = SMTPPool('127.0.0.1', self.server.port, size=1, idle_timeout=60)
+        self.addCleanup(self.pool.close)
+
+    def send(self, body):
+        self.pool.sendmail('alert@example.com', ['user@example.com'], 'Subject: Alert\n\n{}'.format(body))
+
+    def bodies(self):
+        return [message.split('\n\n', 1)[1] for message in self.server.messages]
+
+    def test_connection_is_reused_between_sends(self):
+        for body in ('first', 'second', 'third'):
+            self.send(body)
+
+        self.assertEqual(self.bodies(), ['first', 'second', 'third'])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.pool.opened, 1)
+
+    def test_reconnects_after_the_server_drops_the_connection(self):
+        self.send('first')
+        self.server.drop_connections()
+        self.send('second')
+
+        self.assertEqual(self.bodies(), ['first', 'second'])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_digest_is_sent_as_one_message(self):
+        route = NotificationRoute.objects.create(name='digest', description='', webhook='user@example.com',
+                                                 type='EMA', digest_minutes=60)
+        items = [types.SimpleNamespace(name='item {}'.format(i), price=types.SimpleNamespace(amount=i),
+                                       listing_type='BIN', url='https://www.ebay.co.uk/itm/{}'.format(i))
+                 for i in range(3)]
+        dispatcher = AlertDispatcher()
+        with mock.patch('alerts.models.smtp_pool', self.pool), mock.patch('alerts.notifications.atexit'):
+            for item in items:
+                dispatcher.dispatch(item, route)
+            self.assertTrue(dispatcher.drain(timeout=5))
+
+        self.assertEqual(len(self.server.messages), 1)
+        message = email.message_from_string(self.server.messages[0])
+        self.assertEqual(message['Subject'], '3 New Item Alerts')
+        for item in items:
+            self.assertIn(item.url, message.get_payload(decode=True).decode())
+        self.assertEqual(self.server.connections, 1)
+
+
+class ScanJobTests(ReplayTestCase):
+
+    def run_job(self, wanted_items):
+        job = ScanJob.objects.create(wanted_item_ids=','.join(str(wanted_item.pk) for wanted_item in wanted_items))
+        with mock.patch.object(EbayItem, 'send_alert'):
+            run_scan_job.now(job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_wanted_items_a_worker_holds_are_skipped(self):
+        held, free = self.wanted_item('held search'), self.wanted_item('free search')
+        worker = LeaseManager('worker', duration=60)
+        worker.claim()
+        WantedItem.objects.filter(pk=free.pk).update(lease_owner='', lease_expires=None)
+
+        job = self.run_job([held, free])
+
+        self.assertEqual(job.status, 'PAR')
+        self.assertEqual(job.progress()['skipped'], [held.pk])
+        self.assertFalse(EbayItem.objects.filter(wanted_item=held).exists())
+        self.assertEqual(EbayItem.objects.filter(wanted_item=free).count(), job.items_found)
+        self.assertGreater(job.items_found, 0)
+        # Still the worker's, and the job's own leases are released.
+        self.assertEqual(WantedItem.objects.get(pk=held.pk).lease_owner, 'worker')
+        self.assertEqual(WantedItem.objects.get(pk=free.pk).lease_owner, '')
+
+    def test_job_fails_when_workers_hold_every_wanted_item(self):
+        wanted_item = self.wanted_item()
+        LeaseManager('worker', duration=60).claim()
+
+        job = self.run_job([wanted_item])
+
+        self.assertEqual(job.status, 'ERR')
+        self.assertEqual(job.progress()['skipped'], [wanted_item.pk])
+        self.assertTrue(job.error)
+        self.assertFalse(EbayItem.objects.exists())
+
+
+class ScanViewTests(TestCase):
+
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user('staff', password='password', is_staff=True)
+        self.client = Client(enforce_csrf_checks=True)
+
+    def csrf_token(self):
+        token = 'x' * 32
+        self.client.cookies['csrftoken'] = token
+        return token
+
+    def test_only_staff_can_start_a_scan(self):
+        get_user_model().objects.create_user('user', password='password')
+        for username in (None, 'user'):
+            if username:
+                self.client.login(username=username, password='password')
+            with mock.patch('alerts.views.run_scan_job') as run_scan_job:
+                response = self.client.post(reverse('scan'), HTTP_X_CSRFTOKEN=self.csrf_token())
+            self.assertEqual(response.status_code, 302)
+            run_scan_job.assert_not_called()
+        self.assertFalse(ScanJob.objects.exists())
+
+    def test_scan_needs_a_csrf_token(self):
+        self.client.login(username='staff', password='password')
+        with mock.patch('alerts.views.run_scan_job') as run_scan_job:
+            self.assertEqual(self.client.post(reverse('scan')).status_code, 403)
+            self.assertEqual(self.client.get(reverse('scan')).status_code, 405)
+            response = self.client.post(reverse('scan'), HTTP_X_CSRFTOKEN=self.csrf_token())
+        self.assertEqual(response.status_code, 202)
+        run_scan_job.assert_called_once()
+
+        job = ScanJob.objects.get()
+        self.assertEqual(job.created_by, self.staff)
+        response = self.client.get(response.json()['progress_url'])
+        self.assertEqual(response.json(), job.progress())
+        self.assertIn('Retry-After', response)
+
+
+def search_result(item_id, price=10, feedback=10, started=0, ends=60 * 24):
+    """ A findItemsAdvanced result as the API returns it, started and ending that many minutes from now. """
+    now = datetime.datetime.now(timezone.utc)
+    return {'itemId': str(item_id), 'sellingStatus': {'currentPrice': {'_currencyId': 'GBP', 'value': str(price)}},
+            'sellerInfo': {'feedbackScore': str(feedback)},
+            'listingInfo': {'startTime': ebay_time(now + datetime.timedelta(minutes=started)),
+                            'endTime': ebay_time(now + datetime.timedelta(minutes=ends))}}
+
+
+class AntiKeywordMatcherTests(TestCase):
+
+    def test_keywords(self):
+        matcher = AntiKeywordMatcher('spares, faulty,,')
+        self.assertEqual(matcher.search('a FAULTY console'), ' FAULTY')
+        self.assertEqual(matcher.search('Spares or repair'), 'Spares')
+        self.assertIsNone(matcher.search('boxed and working'))
+        self.assertIsNone(AntiKeywordMatcher(', ,').search('anything'))
+
+    def test_whole_words_and_case(self):
+        matcher = AntiKeywordMatcher('box, box only', whole_word=True, case_sensitive=True)
+        self.assertEqual(matcher.search('box only, no console'), 'box only')
+        self.assertIsNone(matcher.search('boxed'))
+        self.assertIsNone(matcher.search('BOX'))
+
+
+class DescriptionTests(TestCase):
+
+    def setUp(self):
+        self.matcher = AntiKeywordMatcher('spares,faulty')
+        rows = ''.join('<tr><td>row {}</td><td>boxed genuine tested</td></tr>'.format(i) for i in range(2000))
+        self.template = '<html><head><style>p {{}}</style></head><body><p>{}</p><table>' + rows + '</table></body>'
+
+    def test_extraction_stops_at_the_first_anti_keyword(self):
+        html = self.template.format('sold for spares')
+
+        text, complete = extract_text(html, self.matcher)
+
+        self.assertFalse(complete)
+        self.assertIn('sold for spares', text)
+        self.assertNotIn('row 1999', text)
+        text, complete = extract_text(html)
+        self.assertTrue(complete)
+        self.assertIn('row 1999', text)
+
+    def test_extraction_finds_a_keyword_split_between_chunks(self):
+        html = self.template.format('not working')
+        position = html.index('tested') + len('tes')
+        html = html[:position] + 'faulty' + html[position:]
+        chunk_size = position + len('fau')
+
+        text, complete = extract_text(html, self.matcher, chunk_size=chunk_size)
+
+        self.assertFalse(complete)
+        self.assertIn('faulty', text)
+
+    def test_extraction_without_a_keyword_reads_everything(self):
+        html = self.template.format('boxed and working')
+
+        self.assertEqual(extract_text(html, self.matcher), extract_text(html))
+        self.assertTrue(extract_text(html, self.matcher)[1])
+        self.assertNotIn('p {}', extract_text(html)[0])
+
+    def test_converter_caches_by_html(self):
+        html = self.template.format('boxed and working')
+        for mode in ('html2text', 'fast'):
+            with self.subTest(mode=mode), self.settings(DESCRIPTION_TEXT=mode):
+                converter = DescriptionConverter()
+                text = converter.convert(html)
+                self.assertEqual(converter.convert(html), text)
+                self.assertEqual(converter.convert(html, self.matcher), text)
+                self.assertEqual((converter.hits, converter.misses), (2, 1))
+
+    @override_settings(DESCRIPTION_TEXT='fast')
+    def test_converter_does_not_cache_early_exits(self):
+        converter = DescriptionConverter()
+        html = self.template.format('sold for spares')
+
+        stopped = converter.convert(html, self.matcher)
+        self.assertNotIn('row 1999', stopped)
+        # Without the anti keywords the whole description is converted, not the early exit's share.
+        self.assertIn('row 1999', converter.convert(html))
+        self.assertEqual((converter.hits, converter.misses), (0, 2))
+
+    def test_converter_evicts_the_least_recently_used(self):
+        converter = DescriptionConverter(max_entries=2)
+        first, second, third = '<p>first</p>', '<p>second</p>', '<p>third</p>'
+        for html in (first, second, first, third):
+            converter.convert(html)
+
+        converter.convert(first)
+        converter.convert(second)
+        self.assertEqual((converter.hits, converter.misses), (2, 4))
+
+    def test_fixtures_give_a_corpus(self):
+        adapter = ReplayAdapter(ListingCatalogue(per_search=3, auctions_per_search=0), latency=0, jitter=0)
+        item_ids = [str(listing.item_id) for listing in adapter.catalogue.search('test search')['FixedPrice']]
+        fixtures = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, fixtures)
+        os.makedirs(os.path.join(fixtures, 'GetMultipleItems'))
+        with open(os.path.join(fixtures, 'GetMultipleItems', '1.xml'), 'wb') as f:
+            f.write(adapter.get_items('GetMultipleItems', {'ItemID': item_ids}))
+
+        descriptions = load_fixtures(fixtures)
+
+        self.assertEqual(sorted(descriptions), sorted(item_ids))
+        for item_id in item_ids:
+            self.assertEqual(descriptions[item_id], adapter.catalogue.listings[item_id].description)
+        corpus = os.path.join(fixtures, 'corpus')
+        save_corpus(descriptions, corpus)
+        self.assertEqual(sorted(load_corpus(corpus)), sorted(descriptions.values()))
+
+
+class SeenItemCacheTests(TestCase):
+
+    @staticmethod
+    def ending(minutes):
+        return datetime.datetime.now(timezone.utc) + datetime.timedelta(minutes=minutes)
+
+    def test_ended_listings_are_not_seen(self):
+        cache = SeenItemCache()
+        cache.add_many([(1, self.ending(10)), (2, self.ending(-1)), ('3', self.ending(10))])
+        self.assertEqual(cache.seen([1, 2, 3, 4]), {1, 3})
+        self.assertEqual(len(cache), 2)
+
+    def test_soonest_ending_are_evicted_first(self):
+        cache = SeenItemCache(max_size=2)
+        cache.add_many([(1, self.ending(30)), (2, self.ending(10)), (3, self.ending(20))])
+        self.assertEqual(cache.seen([1, 2, 3]), {1, 3})
+
+        # Re-added ending later, its old heap entry doesn't evict it.
+        cache.add(3, self.ending(60))
+        cache.add(4, self.ending(40))
+        self.assertEqual(cache.seen([1, 3, 4]), {3, 4})
+
+    def test_clear(self):
+        cache = SeenItemCache()
+        cache.add(1, self.ending(10))
+        cache.warmed = True
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertFalse(cache.warmed)
+        cache.add(2, self.ending(10))
+        self.assertEqual(cache.seen([1, 2]), {2})
+
+
+class ResultColumnsTests(TestCase):
+
+    def check_filters(self):
+        columns = ResultColumns([search_result(1, price=5), search_result(2, price=50, feedback=0)],
+                                [search_result(3, price=20, started=-60 * 24, ends=30)])
+        self.assertEqual(columns.item_ids, [1, 2, 3])
+        in_price = columns.between('prices', 10, 60)
+        self.assertEqual(columns.rows(in_price), [1, 2])
+        self.assertEqual(columns.rows(columns.all_of(in_price, columns.greater('feedback', 5))), [2])
+        self.assertEqual(columns.rows(columns.any_of(columns.isin('item_ids', {1}), columns.negate(columns.fixed))),
+                         [0, 2])
+        soon = (datetime.datetime.now(timezone.utc) + datetime.timedelta(hours=1)).timestamp()
+        self.assertEqual(columns.count(columns.less('end_times', soon)), 1)
+        self.assertEqual(columns.end_time(2), parse_ebay_time(columns.results[2]['listingInfo']['endTime']))
+
+    def test_filters(self):
+        self.check_filters()
+
+    def test_filters_without_numpy(self):
+        with mock.patch.object(results, 'numpy', None):
+            self.check_filters()
+
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.limiter = RateLimiter(path=os.path.join(directory, 'rate_limit.json'))
+
+    @override_settings(RATE_LIMIT_RESERVE=0.5,
+                       RATE_LIMITS={'findItemsAdvanced': {'per_second': 0.001, 'burst': 2, 'daily': 100}})
+    def test_searches_leave_tokens_for_urgent_calls(self):
+        self.assertEqual(self.limiter.try_acquire('Finding', 'findItemsAdvanced', LOW), 0)
+        self.assertGreater(self.limiter.try_acquire('Finding', 'findItemsAdvanced', LOW), 0)
+        self.assertEqual(self.limiter.try_acquire('Finding', 'findItemsAdvanced', HIGH), 0)
+        self.assertGreater(self.limiter.try_acquire('Finding', 'findItemsAdvanced', HIGH), 0)
+        self.assertEqual(self.limiter.usage(), {'Finding.findItemsAdvanced': 2})
+        self.assertEqual(self.limiter.try_acquire('Shopping', 'GeoCategories', LOW), 0)
+
+    @override_settings(RATE_LIMIT_RESERVE=0.5,
+                       RATE_LIMITS={'findItemsAdvanced': {'per_second': 1000, 'burst': 10, 'daily': 4}})
+    def test_searches_leave_quota_for_urgent_calls(self):
+        for _ in range(2):
+            self.assertEqual(self.limiter.try_acquire('Finding', 'findItemsAdvanced', LOW), 0)
+        with self.assertRaises(QuotaExceeded):
+            self.limiter.try_acquire('Finding', 'findItemsAdvanced', LOW)
+        for _ in range(2):
+            self.assertEqual(self.limiter.try_acquire('Finding', 'findItemsAdvanced', HIGH), 0)
+        with self.assertRaises(QuotaExceeded):
+            self.limiter.try_acquire('Finding', 'findItemsAdvanced', HIGH)
+        # Shared through the file, another process's limiter sees the quota used.
+        with self.assertRaises(QuotaExceeded):
+            RateLimiter(path=self.limiter.path).try_acquire('Finding', 'findItemsAdvanced', HIGH)
+
+
+@override_settings(POLL_MIN_INTERVAL=15, POLL_MAX_INTERVAL=900, POLL_TARGET_NEW=1, POLL_RATE_SMOOTHING=0.5,
+                   AUCTION_SEARCH_INTERVAL=10, SCAN_ITEM_TIMEOUT=30)
+class PollSchedulerTests(TestCase):
+
+    @staticmethod
+    def wanted_item(keywords='test search', **fields):
+        fields = dict({'name': keywords, 'keywords': keywords, 'min_price': 0, 'max_price': 100,
+                       'buy_it_now_time': 60 * 24}, **fields)
+        return WantedItem(**fields)
+
+    def test_interval_follows_the_arrival_rate(self):
+        scheduler = PollScheduler()
+        polled = datetime.datetime.now(timezone.utc)
+        self.assertEqual(scheduler.base_interval(self.wanted_item()), 60)
+        self.assertEqual(scheduler.base_interval(self.wanted_item(last_polled_at=polled, arrival_rate=0)), 600)
+        self.assertEqual(scheduler.base_interval(self.wanted_item(last_polled_at=polled, arrival_rate=2)), 30)
+        self.assertEqual(scheduler.base_interval(self.wanted_item(last_polled_at=polled, arrival_rate=100)), 15)
+        # Polled often enough that listings don't age past the buy it now time in between.
+        self.assertEqual(scheduler.base_interval(self.wanted_item(last_polled_at=polled, arrival_rate=0,
+                                                                  buy_it_now_time=5)), 240)
+
+    def test_record_smooths_the_arrival_rate(self):
+        scheduler = PollScheduler()
+        polled = datetime.datetime.now(timezone.utc)
+        wanted_item = self.wanted_item(last_polled_at=polled - datetime.timedelta(minutes=2), arrival_rate=1)
+        fields = scheduler.record(wanted_item, 6, polled)
+        self.assertEqual(fields['arrival_rate'], 0.5 * 3 + 0.5 * 1)
+        self.assertEqual(fields['poll_interval'], 30)
+        self.assertEqual(fields['next_poll_at'], polled + datetime.timedelta(seconds=30))
+
+    def test_plan_holds_polls_to_the_budget(self):
+        scheduler = PollScheduler()
+        now = datetime.datetime.now(timezone.utc)
+        wanted_items = [self.wanted_item(str(n), last_polled_at=now, arrival_rate=4, next_poll_at=now)
+                        for n in range(4)]
+        wanted_items[0].next_poll_at = now + datetime.timedelta(minutes=1)
+
+        with override_settings(SEARCH_CALL_BUDGET=100):
+            due = scheduler.plan([SearchGroup([wanted_item]) for wanted_item in wanted_items], now)
+        self.assertEqual(due, wanted_items[1:])
+        self.assertEqual(scheduler.budget_factor, 1)
+        # Held back from polling again until the poll is recorded.
+        self.assertEqual(wanted_items[1].next_poll_at, now + datetime.timedelta(seconds=30))
+
+        # Four every 15 seconds and an auction search each per 10 minutes is 16.4 calls a minute.
+        with override_settings(SEARCH_CALL_BUDGET=8.2):
+            scheduler.plan([SearchGroup([wanted_item]) for wanted_item in wanted_items], now)
+        self.assertAlmostEqual(scheduler.budget_factor, 2)
+        self.assertEqual(scheduler.record(wanted_items[1], 1, now)['poll_interval'], 30)
+
+
+class SearchGroupTests(TestCase):
+
+    @staticmethod
+    def wanted_item(keywords='test search', **fields):
+        fields = dict({'name': keywords, 'keywords': keywords, 'min_price': 0, 'max_price': 100, 'min_feedback': 0,
+                       'buy_it_now_time': 60 * 24}, **fields)
+        return WantedItem(**fields)
+
+    def test_wanted_items_are_grouped_on_their_search(self):
+        wanted_items = [self.wanted_item('Test search'), self.wanted_item('other'), self.wanted_item(' test  SEARCH')]
+        with override_settings(SEARCH_COALESCE=True):
+            groups = plan_searches(wanted_items)
+        self.assertEqual([group.members for group in groups], [wanted_items[::2], wanted_items[1:2]])
+        self.assertIs(groups[1].proxy, wanted_items[1])
+        with override_settings(SEARCH_COALESCE=False):
+            self.assertEqual(len(plan_searches(wanted_items)), 3)
+
+    def test_fan_out_gives_each_member_its_own_results(self):
+        now = datetime.datetime.now(timezone.utc)
+        cheap = self.wanted_item(max_price=20, last_auction_search=now)
+        trusted = self.wanted_item(min_feedback=100, last_seen_start_time=(now - datetime.timedelta(minutes=5)
+                                                                           ).replace(microsecond=0))
+        group = SearchGroup([cheap, trusted])
+        self.assertEqual(group.proxy.max_price.amount, 100)
+        self.assertEqual(group.proxy.min_feedback, 0)
+        self.assertIsNone(group.proxy.last_auction_search)
+
+        buy_it_now = [search_result(1, price=10, feedback=500), search_result(2, price=50, feedback=500),
+                      search_result(3, price=10, feedback=500, started=-10), search_result(4, price=10)]
+        auctions = [search_result(5, price=10, feedback=500, ends=30)]
+        shares = {id(member): ([item['itemId'] for item in items], [item['itemId'] for item in auction_items])
+                  for member, items, auction_items in group.fan_out(buy_it_now, auctions)}
+
+        # Only the member due an auction search gets the auctions, seen listings are dropped.
+        self.assertEqual(shares[id(cheap)], (['1', '3', '4'], []))
+        self.assertEqual(shares[id(trusted)], (['1', '2'], ['5']))
+
+
+class QueuedDatabaseHandlerTests(TransactionTestCase):
+    """ The listener saves from its own thread, which can't write past a TestCase's open transaction. """
+
+    def setUp(self):
+        patcher = mock.patch('alerts.log_handlers.atexit')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, **kwargs):
+        handler = QueuedDatabaseHandler(**kwargs)
+        self.addCleanup(handler.close)
+        return handler
+
+    def log(self, handler, msg, *args, exc_info=None):
+        handler.handle(logging.LogRecord('test', logging.INFO, __file__, 0, msg, args, exc_info))
+
+    def test_records_are_saved_in_batches(self):
+        handler = self.handler(batch_size=3, flush_interval=5)
+        try:
+            raise ValueError('bad value')
+        except ValueError:
+            exc_info = sys.exc_info()
+
+        with mock.patch.object(StatusLog.objects, 'bulk_create', wraps=StatusLog.objects.bulk_create) as bulk_create:
+            for i in range(5):
+                self.log(handler, 'record %s', i)
+            self.log(handler, 'failed', exc_info=exc_info)
+            handler.flush()
+
+        # The app's own 'db' log handler saves through bulk_create too.
+        batches = [call.args[0] for call in bulk_create.call_args_list if call.args[0][0].logger_name == 'test']
+        self.assertEqual([len(batch) for batch in batches], [3, 3])
+        logs = StatusLog.objects.filter(logger_name='test').order_by('pk')
+        self.assertEqual([log.msg for log in logs], ['record {}'.format(i) for i in range(5)] + ['failed'])
+        self.assertIn('ValueError: bad value', logs.last().trace)
+
+    def test_records_are_dropped_when_the_queue_is_full(self):
+        handler = self.handler(batch_size=10, flush_interval=0.05, max_queue=2)
+        with mock.patch.object(handler.listener, 'start'):
+            for i in range(5):
+                self.log(handler, 'record %s', i)
+
+        handler.listener.start()
+        handler.flush()
+
+        logs = StatusLog.objects.filter(logger_name='test').order_by('pk')
+        self.assertEqual([log.msg for log in logs], ['record 0', 'record 1'])
+        self.assertTrue(StatusLog.objects.filter(msg__endswith='dropped 3 records').exists())
+
+    def test_close_saves_what_is_queued(self):
+        handler = self.handler(batch_size=100, flush_interval=60)
+        for i in range(3):
+            self.log(handler, 'record %s', i)
+
+        handler.close()
+
+        self.assertEqual(StatusLog.objects.filter(logger_name='test').count(), 3)
+
+
+class RateLimitFilterTests(TestCase):
+
+    def record(self, msg):
+        return logging.LogRecord('db', logging.INFO, __file__, 0, msg, None, None)
+
+    def test_matching_records_over_the_limit_are_suppressed(self):
+        rate_filter = RateLimitFilter('Filtered out', per_minute=2)
+        with mock.patch('alerts.log_handlers.time.monotonic', return_value=0):
+            passed = [rate_filter.filter(self.record('Filtered out item {}'.format(i))) for i in range(5)]
+            self.assertTrue(rate_filter.filter(self.record('Exception in scan')))
+        self.assertEqual(passed, [True, True, False, False, False])
+
+        record = self.record('Filtered out item 5')
+        with mock.patch('alerts.log_handlers.time.monotonic', return_value=60):
+            self.assertTrue(rate_filter.filter(record))
+        self.assertEqual(record.msg, 'Filtered out item 5 (3 similar messages suppressed)')
+
+
+class PruneStatusLogsTests(TestCase):
+
+    def test_only_old_logs_are_deleted(self):
+        StatusLog.objects.bulk_create([StatusLog(logger_name='test', level=logging.INFO, msg=str(i))
+                                       for i in range(7)])
+        old = list(StatusLog.objects.order_by('pk').values_list('pk', flat=True)[:5])
+        StatusLog.objects.filter(pk__in=old).update(
+            create_datetime=datetime.datetime.now(timezone.utc) - datetime.timedelta(days=15))
+
+        self.assertEqual(prune_status_logs(14, chunk_size=2), 5)
+        self.assertEqual(sorted(StatusLog.objects.values_list('msg', flat=True)), ['5', '6'])
+
+
+class AuctionAlertSchedulerTests(TestCase):
+
+    def test_due_auctions_fire_once(self):
+        fired = []
+        done = threading.Event()
+
+        def fire(item_ids):
+            fired.extend(item_ids)
+            if len(fired) >= 2:
+                done.set()
+
+        scheduler = AuctionAlertScheduler(fire)
+        now = datetime.datetime.now(timezone.utc)
+        scheduler.schedule_many([(1, now - datetime.timedelta(seconds=1)), (2, now + datetime.timedelta(seconds=0.2)),
+                                 (1, now), (3, now + datetime.timedelta(hours=1))])
+        self.assertEqual(len(scheduler), 3)
+        scheduler.start()
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(fired, [1, 2])
+        self.assertEqual(len(scheduler), 1)
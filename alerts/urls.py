@@ -14,8 +14,10 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from .views import scan
+from .views import scan, scan_progress, scan_metrics
 
 urlpatterns = [
     path('scan/', scan, name="scan"),
+    path('scan/<int:job_id>/', scan_progress, name="scan_progress"),
+    path('metrics/', scan_metrics, name="metrics"),
 ]
@@ -1,7 +1,68 @@
+import json
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, JsonResponse, Http404
 from django.shortcuts import render
-from .tasks import notify_user, scan_ebay_items
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from .metrics import metrics, prometheus_text
+from .models import ScanJob, WantedItem
+from .tasks import notify_user, run_scan_job
+
+
+def requested_ids(request):
+    """ The wanted item ids asked for, as ?ids=1,2 (or ids repeated), the same as a form or a JSON body {"ids": []}. """
+    values = request.GET.getlist('ids') + request.POST.getlist('ids')
+    if request.content_type == 'application/json' and request.body:
+        body = json.loads(request.body)
+        ids = body.get('ids', []) if isinstance(body, dict) else body
+        values += [str(pk) for pk in (ids if isinstance(ids, list) else [ids])]
+    return sorted({int(pk) for value in values for pk in value.split(',') if pk.strip()})
 
 
 # Create your views here.
+@staff_member_required
+@require_POST
 def scan(request):
-    scan_ebay_items()
+    """ Queue an on demand scan of the wanted items asked for, or all of them, and return its job id at once.
+
+    A scan spends the eBay quota and can send alerts, so only staff can start one, with a CSRF token like any other
+    POST. It runs on the SCAN_JOB_QUEUE background task queue, its progress is polled from progress_url.
+    """
+    try:
+        ids = requested_ids(request)
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'ids must be wanted item ids'}, status=400)
+    if ids:
+        missing = set(ids) - set(WantedItem.objects.filter(pk__in=ids, deleted=False).values_list('pk', flat=True))
+        if missing:
+            return JsonResponse({'error': 'no wanted items {}'.format(sorted(missing))}, status=404)
+
+    job = ScanJob.objects.create(wanted_item_ids=','.join(str(pk) for pk in ids), created_by=request.user)
+    run_scan_job(job.pk, priority=settings.SCAN_JOB_PRIORITY)
+    return JsonResponse({'job_id': job.pk, 'status': job.progress()['status'],
+                         'progress_url': reverse('scan_progress', args=[job.pk])}, status=202)
+
+
+@staff_member_required
+def scan_progress(request, job_id):
+    """ A scan job's progress as JSON, to poll every SCAN_JOB_POLL_INTERVAL seconds until it's finished. """
+    try:
+        job = ScanJob.objects.get(pk=job_id)
+    except ScanJob.DoesNotExist:
+        raise Http404('No scan job {}'.format(job_id))
+
+    response = JsonResponse(job.progress())
+    response['Cache-Control'] = 'no-cache'
+    if job.status not in ScanJob.FINISHED:
+        response['Retry-After'] = settings.SCAN_JOB_POLL_INTERVAL
+    return response
+
+
+def scan_metrics(request):
+    """ The scan's counters and timings as of its last cycle, as Prometheus text or JSON with ?format=json. """
+    snapshot = metrics.load()
+    if request.GET.get('format') == 'json':
+        return JsonResponse(snapshot)
+    return HttpResponse(prometheus_text(snapshot), content_type='text/plain; version=0.0.4; charset=utf-8')
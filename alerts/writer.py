@@ -0,0 +1,113 @@
+import threading
+
+from .cache import seen_item_cache
+from .models import EbayItem, WantedItem
+
+
+class EbayItemWriter:
+    """ Collects scanned EbayItems and saves them in bulk instead of one INSERT per item.
+
+    Items are added together with the wanted item that found them. flush() saves everything pending with a single
+    bulk_create, ignoring items that are already saved, and returns the (item, wanted item) pair saved for each new
+    listing so alerts are only sent once per listing even when several workers find it. Safe to share between threads.
+
+    Each search queues on a writer of its own and merges it into the cycle's shared writer once it has finished, so
+    the wanted item updates of a search that failed or timed out are never saved without the items they cover.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.skipped = 0
+        self._pending = []  # List of (EbayItem, WantedItem)
+        self._updates = {}  # WantedItem id -> (WantedItem, fields to update on flush)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, item: EbayItem, wanted_item=None):
+        with self._lock:
+            self._pending.append((item, wanted_item))
+
+    def update_wanted_item(self, wanted_item: WantedItem, **fields):
+        """ Update the wanted item's search bookkeeping, saved only once the items found so far are saved.
+
+        The wanted item itself is updated when the search's writer is merged or flushed.
+        """
+        with self._lock:
+            self._updates.setdefault(wanted_item.pk, (wanted_item, {}))[1].update(fields)
+
+    def merge(self, other):
+        """ Take over everything pending on other, the writer of a search that has finished. """
+        with other._lock:
+            pending, other._pending = other._pending, []
+            updates, other._updates = other._updates, {}
+        with self._lock:
+            self._pending += pending
+            for wanted_item_id, (wanted_item, fields) in updates.items():
+                self._updates.setdefault(wanted_item_id, (wanted_item, {}))[1].update(fields)
+        self._set_fields(updates)
+
+    @staticmethod
+    def _set_fields(updates):
+        for wanted_item, fields in updates.values():
+            for name, value in fields.items():
+                setattr(wanted_item, name, value)
+
+    def advance_mark(self, wanted_item: WantedItem, start_time):
+        """ Move the wanted item's last_seen_start_time forward. """
+        with self._lock:
+            mark = self._updates.get(wanted_item.pk, (wanted_item, {}))[1].get('last_seen_start_time',
+                                                                              wanted_item.last_seen_start_time)
+        if start_time is None or (mark is not None and start_time <= mark):
+            return
+        self.update_wanted_item(wanted_item, last_seen_start_time=start_time)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            updates, self._updates = self._updates, {}
+        new_rows = self._save_items(pending) if pending else []
+        # Only once the items are saved, so a failed flush has them searched for again.
+        for wanted_item_id, (wanted_item, fields) in updates.items():
+            WantedItem.objects.filter(pk=wanted_item_id).update(**fields)
+        self._set_fields(updates)
+        return new_rows
+
+    def _save_items(self, pending):
+        # One row per listing, if any wanted item passed it that is the row we keep.
+        rows = {}
+        for item, wanted_item in pending:
+            row = rows.get(int(item.item_id))
+            if row is None or (item.passed_filter and not row[0].passed_filter):
+                rows[int(item.item_id)] = (item, wanted_item)
+
+        already_saved = EbayItem.existing_item_ids(rows)
+        new_rows = [row for item_id, row in rows.items() if item_id not in already_saved]
+        # Conflicts can still happen if another process saves the same listing between the two queries.
+        EbayItem.objects.bulk_create([item for item, wanted_item in new_rows], batch_size=self.batch_size,
+                                     ignore_conflicts=True)
+        new_rows = self._inserted(new_rows)
+        seen_item_cache.add_many((item.item_id, item.end_time) for item, wanted_item in rows.values())
+
+        inserted = len(new_rows)
+        skipped = len(pending) - inserted
+        with self._lock:
+            self.inserted += inserted
+            self.skipped += skipped
+
+        return new_rows
+
+    @staticmethod
+    def _inserted(rows):
+        """ The rows bulk_create actually inserted, not the ones it skipped because another process saved them first.
+
+        ignore_conflicts doesn't say which rows were skipped, but bulk_create sets each item's insert_date as it saves
+        it, so a row is ours if the saved insert_date is the one on our item.
+        """
+        if not rows:
+            return rows
+        saved = dict(EbayItem.objects.filter(item_id__in=[item.item_id for item, wanted_item in rows])
+                     .values_list('item_id', 'insert_date'))
+        return [(item, wanted_item) for item, wanted_item in rows if saved.get(int(item.item_id)) == item.insert_date]
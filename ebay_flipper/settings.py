@@ -11,11 +11,15 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
+
 from dotenv import load_dotenv
 
 load_dotenv()
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Where the response cache, rate limit buckets and scan metrics are kept, outside the source tree.
+RUNTIME_DIR = os.getenv("RUNTIME_DIR", tempfile.gettempdir())
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.0/howto/deployment/checklist/
@@ -34,6 +38,75 @@ POSTGRES_PASS = os.getenv("POSTGRES_PASS")
 POSTGRES_USERNAME = os.getenv("POSTGRES_USERNAME")
 POSTGRES_DBNAME = os.getenv("POSTGRES_DBNAME")
 
+# Scanning
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", 8))  # wanted items scanned concurrently, 1 scans serially
+SCAN_ITEM_TIMEOUT = int(os.getenv("SCAN_ITEM_TIMEOUT", 45))  # seconds before a wanted item scan is abandoned
+SEEN_CACHE_SIZE = int(os.getenv("SEEN_CACHE_SIZE", 200000))  # max item ids kept in memory for dedup
+SEEN_CACHE_FILE = os.getenv("SEEN_CACHE_FILE")  # optional local file to persist the seen item cache
+SCAN_FLUSH = os.getenv("SCAN_FLUSH", "item")  # save found items once per wanted item ('item') or per cycle ('cycle')
+DETAIL_FETCH_WORKERS = int(os.getenv("DETAIL_FETCH_WORKERS", 16))  # item detail lookups in flight across all scans
+DETAIL_FETCH_BATCH_SIZE = int(os.getenv("DETAIL_FETCH_BATCH_SIZE", 20))  # items per GetMultipleItems call, max 20
+EBAY_API_POOL_SIZE = int(os.getenv("EBAY_API_POOL_SIZE", 32))  # pooled HTTP connections kept per eBay API
+EBAY_API_TIMEOUT = int(os.getenv("EBAY_API_TIMEOUT", 20))  # seconds per eBay API call
+EBAY_API_RECORD = os.getenv("EBAY_API_RECORD")  # optional directory to record eBay responses to, for bench_scan
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")  # eBay API response cache, 'memory', 'sqlite' or '' for none
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 5000))  # responses kept by the memory cache
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", os.path.join(RUNTIME_DIR,
+                                                                 'ebay_flipper_response_cache.sqlite3'))
+RESPONSE_CACHE_TTLS = {  # seconds each call's responses are cached for, calls not listed aren't cached
+    'GetMultipleItems': int(os.getenv("DETAIL_CACHE_TTL", 3600)),
+    'findItemsAdvanced': int(os.getenv("SEARCH_CACHE_TTL", 10)),  # under POLL_MIN_INTERVAL with ADAPTIVE_POLLING
+}
+SCAN_ASYNC = os.getenv("SCAN_ASYNC", "False") == "True"  # scan on one asyncio event loop instead of worker threads
+SCAN_ASYNC_CONCURRENCY = int(os.getenv("SCAN_ASYNC_CONCURRENCY", 100))  # wanted items scanned at once when async
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 100))  # results per findItemsAdvanced page, max 100
+SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", 10))  # pages of new buy it now listings fetched per scan
+SEARCH_COALESCE = os.getenv("SEARCH_COALESCE", "True") == "True"  # one search for wanted items with the same keywords
+DESCRIPTION_TEXT = os.getenv("DESCRIPTION_TEXT", "html2text")  # description to text with 'html2text' or 'fast'
+DESCRIPTION_CACHE_SIZE = int(os.getenv("DESCRIPTION_CACHE_SIZE", 10000))  # converted descriptions kept in memory
+AUCTION_SEARCH_INTERVAL = int(os.getenv("AUCTION_SEARCH_INTERVAL", 10))  # minutes between auction searches
+AUCTION_ALERT_RETRY = int(os.getenv("AUCTION_ALERT_RETRY", 30))  # seconds before a failed auction alert is retried
+RATE_LIMIT = os.getenv("RATE_LIMIT", "True") == "True"  # hold eBay calls to RATE_LIMITS across one machine
+RATE_LIMIT_FILE = os.getenv("RATE_LIMIT_FILE", os.path.join(RUNTIME_DIR, 'ebay_flipper_rate_limit.json'))  # buckets
+RATE_LIMIT_RESERVE = float(os.getenv("RATE_LIMIT_RESERVE", 0.2))  # share of tokens and quota searches can't use
+RATE_LIMITS = {  # calls per second, burst and daily quota per call, calls not listed aren't limited
+    'findItemsAdvanced': {'per_second': float(os.getenv("SEARCH_CALLS_PER_SECOND", 5)), 'burst': 10,
+                          'daily': int(os.getenv("FINDING_DAILY_QUOTA", 5000))},
+    'GetMultipleItems': {'per_second': float(os.getenv("DETAIL_CALLS_PER_SECOND", 5)), 'burst': 10,
+                         'daily': int(os.getenv("SHOPPING_DAILY_QUOTA", 5000))},
+}
+METRICS_FILE = os.getenv("METRICS_FILE", os.path.join(RUNTIME_DIR, 'ebay_flipper_metrics.json'))  # for the metrics view
+METRICS_LOG_JSON = os.getenv("METRICS_LOG_JSON", "False") == "True"  # also log each cycle's metrics as JSON
+SCAN_LEASING = os.getenv("SCAN_LEASING", "False") == "True"  # scan a leased share of wanted items, for many processes
+SCAN_LEASE_DURATION = int(os.getenv("SCAN_LEASE_DURATION", 180))  # seconds, a dead worker's items are reassigned after
+SCAN_WORKER_INTERVAL = int(os.getenv("SCAN_WORKER_INTERVAL", 60))  # seconds between a scan worker's cycles
+SCAN_JOB_QUEUE = os.getenv("SCAN_JOB_QUEUE", "on_demand")  # background task queue for scans asked for at /scan/
+SCAN_JOB_PRIORITY = int(os.getenv("SCAN_JOB_PRIORITY", 10))  # on demand scans run before queued tasks of less
+SCAN_JOB_POLL_INTERVAL = int(os.getenv("SCAN_JOB_POLL_INTERVAL", 1))  # seconds clients wait between progress polls
+ADAPTIVE_POLLING = os.getenv("ADAPTIVE_POLLING", "True") == "True"  # poll each wanted item at its own interval
+POLL_MIN_INTERVAL = int(os.getenv("POLL_MIN_INTERVAL", 15))  # seconds, shortest interval between searches
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", 900))  # seconds, longest interval between searches
+POLL_TARGET_NEW = float(os.getenv("POLL_TARGET_NEW", 1))  # new buy it now listings expected per search
+POLL_RATE_SMOOTHING = float(os.getenv("POLL_RATE_SMOOTHING", 0.3))  # weight of the latest search in the arrival rate
+# Search calls a minute polling can plan for, intervals stretch to fit. The searches' share of the daily quota spread
+# over the day, so polling doesn't spend the quota early and leave the rate limiter holding every search back.
+SEARCH_CALL_BUDGET = RATE_LIMITS['findItemsAdvanced']['daily'] * (1 - RATE_LIMIT_RESERVE) / (24 * 60)
+POLL_CYCLE = int(os.getenv("POLL_CYCLE", 55))  # seconds each scan task keeps polling before the next one starts
+ALERT_MAX_RETRIES = int(os.getenv("ALERT_MAX_RETRIES", 5))  # retries of a failed alert delivery before giving up
+ALERT_RETRY_BACKOFF = float(os.getenv("ALERT_RETRY_BACKOFF", 1))  # seconds before the first retry, doubled each time
+ALERT_DRAIN_TIMEOUT = int(os.getenv("ALERT_DRAIN_TIMEOUT", 30))  # seconds queued alerts are waited for at exit
+
+# Email alerts
+EMAIL_HOST = os.getenv("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", 25))
+EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "False") == "True"
+EMAIL_TIMEOUT = int(os.getenv("EMAIL_TIMEOUT", 30))
+ALERT_EMAIL_FROM = os.getenv("ALERT_EMAIL_FROM", "alert@ebayflipper.com")
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 4))  # open SMTP connections shared by every email route
+SMTP_IDLE_TIMEOUT = int(os.getenv("SMTP_IDLE_TIMEOUT", 60))  # seconds an unused SMTP connection is kept open
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -45,7 +118,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'djmoney',
     'background_task',
-    'alerts',
+    'alerts.apps.AlertsConfig',
     'django_db_logger'
 
 ]
@@ -147,16 +220,30 @@ LOGGING = {
             'format': '%(levelname)s %(asctime)s %(message)s'
         },
     },
+    'filters': {
+        # One log line per item rejected for an anti keyword is far too many to keep.
+        'anti_keyword_rate': {
+            '()': 'alerts.log_handlers.RateLimitFilter',
+            'match': 'Filtered out anti keyword',
+            'per_minute': int(os.getenv("LOG_ANTI_KEYWORD_PER_MINUTE", 10)),
+        },
+    },
     'handlers': {
         'db_log': {
             'level': 'DEBUG',
-            'class': 'django_db_logger.db_log_handler.DatabaseLogHandler'
+            # Saves to django_db_logger's table in batches from a background thread.
+            'class': 'alerts.log_handlers.QueuedDatabaseHandler',
+            'batch_size': int(os.getenv("LOG_BATCH_SIZE", 200)),
+            'flush_interval': float(os.getenv("LOG_FLUSH_INTERVAL", 1)),
+            'max_queue': int(os.getenv("LOG_MAX_QUEUE", 10000)),
         },
     },
     'loggers': {
         'db': {
             'handlers': ['db_log'],
-            'level': 'DEBUG'
+            'filters': ['anti_keyword_rate'],
+            'level': os.getenv("LOG_LEVEL", 'DEBUG')
         }
     }
-}
\ No newline at end of file
+}
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", 14))  # days of database log kept by prune_logs
\ No newline at end of file
@@ -15,7 +15,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from alerts.tasks import scan_ebay_items
+from alerts.tasks import scan_ebay_items, prune_logs
 
 
 
@@ -28,4 +28,5 @@ urlpatterns = [
 # Run once at start up to queue the tasks
 # uncomment the below if no tasks in scheduled tasks yet (must be run once and then commented out again)
 # scan_ebay_items(repeat=60, repeat_until=None)
+# prune_logs(repeat=60 * 60, repeat_until=None)
 